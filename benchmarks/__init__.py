@@ -0,0 +1,9 @@
+"""Load-test benchmarks over generated datasets.
+
+Seed a database once, then run the routes against it and keep the JSON
+reports to compare between commits::
+
+    python -m benchmarks seed --scale 100k bench-100k.db
+    python -m benchmarks run bench-100k.db --concurrency 4 -o before.json
+    python -m benchmarks compare before.json after.json
+"""
@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+import click
+
+from benchmarks.runner import make_app, run, compare as compare_reports
+from benchmarks.seed import SCALES, seed as seed_database
+
+
+@click.group()
+def cli():
+    """Seeds benchmark databases and measures the main routes."""
+
+
+@cli.command()
+@click.argument("database")
+@click.option(
+    "--scale",
+    type=click.Choice(list(SCALES)),
+    default="1k",
+    help="Dataset size, named by the number of comments.",
+)
+@click.option("--seed", default=0, help="Random seed, default is 0.")
+@click.option("--chunk", default=5000, help="Rows per executemany, default is 5000.")
+def seed(database, scale, seed, chunk):
+    """Creates DATABASE and fills it with generated data."""
+    from myblog.extensions import db
+
+    if os.path.exists(database):
+        os.remove(database)
+    app = make_app(database)
+    with app.app_context():
+        db.create_all()
+        seed_database(scale, seed, chunk, echo=click.echo)
+    click.echo("Done.")
+
+
+@cli.command("run")
+@click.argument("database")
+@click.option("--requests", default=200, help="Requests per route, default is 200.")
+@click.option("--concurrency", default=1, help="Concurrent clients, default is 1.")
+@click.option("--warmup", default=5, help="Unmeasured requests per client.")
+@click.option("--route", "routes", multiple=True, help="Only run these routes.")
+@click.option("--page-cache", is_flag=True, help="Enable the anonymous page cache.")
+@click.option(
+    "--url", "base_url", help="Drive a running server instead of the WSGI app."
+)
+@click.option("-o", "--output", type=click.File("w"), default="-")
+def run_command(
+    database, requests, concurrency, warmup, routes, page_cache, base_url, output
+):
+    """Benchmarks the routes against DATABASE and writes a JSON report."""
+    app = make_app(database)
+    app.config["BLOG_PAGE_CACHE"] = page_cache
+    report = run(
+        app,
+        requests=requests,
+        concurrency=concurrency,
+        warmup=warmup,
+        routes=routes,
+        base_url=base_url,
+        echo=lambda message: click.echo(message, err=True),
+    )
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write("\n")
+
+
+@cli.command()
+@click.argument("old", type=click.File())
+@click.argument("new", type=click.File())
+def compare(old, new):
+    """Shows how each route changed between two reports."""
+    for route, metric, before, after, change in compare_reports(
+        json.load(old), json.load(new)
+    ):
+        click.echo(
+            "%-22s %-20s %10.2f %10.2f %+7.1f%%"
+            % (route, metric, before, after, change)
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,285 @@
+import os
+import platform
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from flask import url_for
+from sqlalchemy import event
+
+from myblog.extensions import db
+from myblog.models import Admin, Category, Comment, Post
+from myblog.pagination import make_cursor
+
+from benchmarks.seed import HOT_POST_ID
+
+
+def make_app(database):
+    """The production app bound to the SQLite file ``database``."""
+    from myblog import create_app
+    from myblog.settings import config, ProductionConfig
+
+    class BenchmarkConfig(ProductionConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.abspath(database)
+        BLOG_QUERY_STATS_PATH = None
+
+    config["benchmark"] = BenchmarkConfig
+    return create_app("benchmark")
+
+
+def build_routes(app, deep_page=50):
+    """Map a route name to ``(url, needs_login)``."""
+    with app.test_request_context():
+        per_page = app.config["BLOG_POST_PER_PAGE"]
+        public = Post.query.filter(Post.private.isnot(True))
+        deep = _deep_row(public, Post, deep_page, per_page)
+        category = Category.query.order_by(Category.post_count.desc()).first()
+        deep_comment = _deep_row(
+            Comment.query, Comment, deep_page, app.config["BLOG_COMMENT_PER_PAGE"]
+        )
+        routes = dict(
+            index=(url_for("blog.index"), False),
+            category=(url_for("blog.show_category", category_id=category.id), False),
+            post=(url_for("blog.show_post", post_id=HOT_POST_ID), False),
+            post_last_comments=(
+                url_for(
+                    "blog.show_post", post_id=HOT_POST_ID, cursor=make_cursor("last")
+                ),
+                False,
+            ),
+            manage_post=(url_for("admin.manage_post"), True),
+            manage_comment=(url_for("admin.manage_comment"), True),
+        )
+        if deep is not None:
+            routes["index_deep"] = (
+                url_for("blog.index", cursor=make_cursor("next", deep)),
+                False,
+            )
+        if deep_comment is not None:
+            routes["manage_comment_deep"] = (
+                url_for(
+                    "admin.manage_comment", cursor=make_cursor("next", deep_comment)
+                ),
+                True,
+            )
+    return routes
+
+
+def _deep_row(query, model, pages, per_page):
+    """The row ending page ``pages``, capped so another page follows it."""
+    pages = min(pages, query.count() // per_page - 1)
+    if pages <= 0:
+        return None
+    return (
+        query.with_entities(model.timestamp, model.id)
+        .order_by(model.timestamp.desc(), model.id.desc())
+        .offset(pages * per_page - 1)
+        .first()
+    )
+
+
+class QueryCounter(object):
+    """Count the statements each thread sends to the engine."""
+
+    def __init__(self, app):
+        self.local = threading.local()
+        with app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.local.count = getattr(self.local, "count", 0) + 1
+
+    def take(self):
+        count = getattr(self.local, "count", 0)
+        self.local.count = 0
+        return count
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def login(client):
+    # 直接写会话，不用走带 CSRF 的登录表单
+    with client.application.app_context():
+        user_id = Admin.query.first().get_id()
+    with client.session_transaction() as session:
+        session["_user_id"] = user_id
+        session["_fresh"] = True
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return None
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(timings, queries, errors, elapsed):
+    timings = sorted(timings)
+    count = len(timings)
+    return dict(
+        requests=count,
+        errors=errors,
+        p50_ms=percentile(timings, 50) * 1000 if count else None,
+        p95_ms=percentile(timings, 95) * 1000 if count else None,
+        p99_ms=percentile(timings, 99) * 1000 if count else None,
+        mean_ms=sum(timings) / count * 1000 if count else None,
+        throughput_rps=count / elapsed if elapsed else None,
+        queries_per_request=(sum(queries) / len(queries)) if queries else None,
+    )
+
+
+def run_route(app, url, needs_login, requests, concurrency, warmup, counter=None):
+    """GET ``url`` ``requests`` times from ``concurrency`` in-process clients."""
+    lock = threading.Lock()
+    timings, queries = [], []
+    errors = [0]
+
+    def worker(count):
+        client = app.test_client()
+        if needs_login:
+            login(client)
+        for _ in range(warmup):
+            client.get(url).close()
+        local_timings, local_queries, local_errors = [], [], 0
+        for _ in range(count):
+            if counter is not None:
+                counter.take()
+            start = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            local_timings.append(time.perf_counter() - start)
+            if counter is not None:
+                local_queries.append(counter.take())
+            if response.status_code != 200:
+                local_errors += 1
+            response.close()
+        with lock:
+            timings.extend(local_timings)
+            queries.extend(local_queries)
+            errors[0] += local_errors
+
+    return _drive(worker, requests, concurrency, timings, queries, errors)
+
+
+def run_http_route(base_url, url, requests, concurrency, warmup):
+    """Like :func:`run_route` against a running server, queries are unknown."""
+    lock = threading.Lock()
+    timings, errors = [], [0]
+
+    def fetch():
+        with urlopen(base_url.rstrip("/") + url) as response:
+            response.read()
+            return response.status
+
+    def worker(count):
+        for _ in range(warmup):
+            fetch()
+        local_timings, local_errors = [], 0
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                status = fetch()
+            except OSError:
+                status = None
+            local_timings.append(time.perf_counter() - start)
+            if status != 200:
+                local_errors += 1
+        with lock:
+            timings.extend(local_timings)
+            errors[0] += local_errors
+
+    return _drive(worker, requests, concurrency, timings, [], errors)
+
+
+def _drive(worker, requests, concurrency, timings, queries, errors):
+    shares = [requests // concurrency] * concurrency
+    for i in range(requests % concurrency):
+        shares[i] += 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker, share) for share in shares]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    return summarize(timings, queries, errors[0], elapsed)
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    app,
+    requests=200,
+    concurrency=1,
+    warmup=5,
+    routes=None,
+    base_url=None,
+    echo=None,
+):
+    """Benchmark every route and return a JSON-serializable report."""
+    echo = echo or (lambda message: None)
+    all_routes = build_routes(app)
+    if routes:
+        all_routes = {name: all_routes[name] for name in routes}
+    counter = QueryCounter(app) if base_url is None else None
+    results = {}
+    try:
+        for name, (url, needs_login) in all_routes.items():
+            echo("%s %s" % (name, url))
+            if base_url is None:
+                results[name] = run_route(
+                    app, url, needs_login, requests, concurrency, warmup, counter
+                )
+            elif needs_login:
+                continue
+            else:
+                results[name] = run_http_route(
+                    base_url, url, requests, concurrency, warmup
+                )
+            results[name]["url"] = url
+    finally:
+        if counter is not None:
+            counter.close()
+    return dict(
+        meta=dict(
+            revision=git_revision(),
+            python=platform.python_version(),
+            requests=requests,
+            concurrency=concurrency,
+            mode="http" if base_url else "wsgi",
+            page_cache=app.config["BLOG_PAGE_CACHE"],
+        ),
+        routes=results,
+    )
+
+
+def compare(old, new, metrics=("p50_ms", "p95_ms", "p99_ms", "throughput_rps")):
+    """Rows of ``(route, metric, old, new, change)`` for two reports."""
+    rows = []
+    for name, result in new["routes"].items():
+        previous = old["routes"].get(name)
+        if previous is None:
+            continue
+        for metric in metrics + ("queries_per_request",):
+            before, after = previous.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            rows.append((name, metric, before, after, change))
+    return rows
@@ -0,0 +1,168 @@
+import random
+from datetime import datetime, timedelta
+
+from myblog.extensions import db
+from myblog.models import (
+    Admin,
+    Category,
+    Comment,
+    Link,
+    Post,
+    category_post_table,
+)
+
+# 每个规模的数据量，scale 名字就是评论数
+SCALES = {
+    "smoke": dict(categories=3, posts=30, comments=100),
+    "1k": dict(categories=10, posts=100, comments=1000),
+    "100k": dict(categories=30, posts=5000, comments=100000),
+    "1m": dict(categories=50, posts=20000, comments=1000000),
+}
+
+ADMIN_USERNAME = "admin"
+ADMIN_PASSWORD = "benchmark"
+
+# 热门文章的 id，它分到 HOT_SHARE 比例的评论
+HOT_POST_ID = 1
+HOT_SHARE = 0.05
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua flask blog python "
+    "query index cache page post comment category 博客 文章 评论 分类 缓存"
+).split()
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _insert(table, rows, chunk):
+    for i in range(0, len(rows), chunk):
+        db.session.execute(table.insert(), rows[i : i + chunk])
+
+
+def _update(table, rows, chunk):
+    statement = table.update().where(table.c.id == db.bindparam("b_id"))
+    for i in range(0, len(rows), chunk):
+        db.session.execute(statement, rows[i : i + chunk])
+
+
+def seed(scale="1k", seed=0, chunk=5000, echo=None):
+    """Fill an empty database with a deterministic dataset of ``scale``.
+
+    Rows are written with executemany in chunks, so events such as the
+    excerpt listener and the search index are bypassed: excerpts are filled
+    and counters are computed here, and the search index is left empty.
+    """
+    sizes = SCALES[scale]
+    rng = random.Random(seed)
+    now = datetime(2020, 1, 1)
+    echo = echo or (lambda message: None)
+
+    admin = Admin(
+        username=ADMIN_USERNAME,
+        blog_title="Benchmark",
+        blog_sub_title="Generated data",
+        name="Bench",
+        about="Benchmark dataset",
+    )
+    admin.set_password(ADMIN_PASSWORD)
+    db.session.add(admin)
+    db.session.add_all(
+        Link(name="Link %d" % i, url="https://example.com/%d" % i) for i in range(4)
+    )
+
+    echo("Inserting %d categories..." % sizes["categories"])
+    _insert(
+        Category.__table__,
+        [dict(id=1, name="Default")]
+        + [
+            dict(id=i, name="Category %d" % i)
+            for i in range(2, sizes["categories"] + 1)
+        ],
+        chunk,
+    )
+
+    echo("Inserting %d posts..." % sizes["posts"])
+    posts, links = [], []
+    post_counts = [0] * (sizes["categories"] + 1)
+    for i in range(1, sizes["posts"] + 1):
+        body = "\n".join(
+            "<p>%s</p>" % _text(rng, rng.randint(40, 120))
+            for _ in range(rng.randint(3, 12))
+        )
+        posts.append(
+            dict(
+                id=i,
+                title=_text(rng, 6)[:60],
+                body=body,
+                excerpt=Post.make_excerpt(body),
+                private=rng.random() < 0.05,
+                can_comment=True,
+                timestamp=now - timedelta(minutes=rng.randint(0, 525600)),
+            )
+        )
+        for category_id in rng.sample(
+            range(1, sizes["categories"] + 1), rng.randint(1, 3)
+        ):
+            links.append(dict(category_id=category_id, post_id=i))
+            post_counts[category_id] += 1
+    _insert(Post.__table__, posts, chunk)
+    _insert(category_post_table, links, chunk)
+    del posts, links
+
+    echo("Inserting %d comments..." % sizes["comments"])
+    last_comment = {}
+    comment_counts = [0] * (sizes["posts"] + 1)
+    reviewed_counts = [0] * (sizes["posts"] + 1)
+    rows = []
+    for i in range(1, sizes["comments"] + 1):
+        if rng.random() < HOT_SHARE:
+            post_id = HOT_POST_ID
+        else:
+            post_id = rng.randint(1, sizes["posts"])
+        replied_id = None
+        if post_id in last_comment and rng.random() < 0.1:
+            replied_id = last_comment[post_id]
+        last_comment[post_id] = i
+        reviewed = rng.random() < 0.9
+        comment_counts[post_id] += 1
+        reviewed_counts[post_id] += reviewed
+        rows.append(
+            dict(
+                id=i,
+                author=_text(rng, 2)[:30],
+                email="reader%d@example.com" % rng.randint(1, 5000),
+                site="https://example.com",
+                body=_text(rng, rng.randint(5, 60)),
+                from_admin=rng.random() < 0.02,
+                reviewed=reviewed,
+                timestamp=now - timedelta(seconds=rng.randint(0, 31536000)),
+                post_id=post_id,
+                replied_id=replied_id,
+            )
+        )
+        if len(rows) >= chunk:
+            _insert(Comment.__table__, rows, chunk)
+            rows = []
+            echo("  %d comments" % i)
+    _insert(Comment.__table__, rows, chunk)
+
+    # 计数在生成时就算好了，不用 update_counters 对整张表做关联子查询
+    echo("Updating counters...")
+    _update(
+        Category.__table__,
+        [dict(b_id=i, post_count=n) for i, n in enumerate(post_counts) if n],
+        chunk,
+    )
+    _update(
+        Post.__table__,
+        [
+            dict(b_id=i, comment_count=n, reviewed_comment_count=reviewed_counts[i])
+            for i, n in enumerate(comment_counts)
+            if n
+        ],
+        chunk,
+    )
+    db.session.commit()
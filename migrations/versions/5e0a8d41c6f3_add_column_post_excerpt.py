@@ -0,0 +1,25 @@
+"""add column post.excerpt
+
+Revision ID: 5e0a8d41c6f3
+Revises: 9c3f1b7d2e51
+Create Date: 2026-10-18 11:02:47.530912
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5e0a8d41c6f3"
+down_revision = "9c3f1b7d2e51"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("post", sa.Column("excerpt", sa.String(length=300), nullable=True))
+    # 已有文章的摘要用 flask excerpt 生成
+
+
+def downgrade():
+    op.drop_column("post", "excerpt")
@@ -0,0 +1,42 @@
+"""add counter columns
+
+Revision ID: 9c3f1b7d2e51
+Revises: 4aa21a7ccd86
+Create Date: 2026-10-18 10:12:31.204517
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9c3f1b7d2e51"
+down_revision = "4aa21a7ccd86"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("category", sa.Column("post_count", sa.Integer(), server_default="0"))
+    op.add_column("post", sa.Column("comment_count", sa.Integer(), server_default="0"))
+    op.add_column(
+        "post",
+        sa.Column("reviewed_comment_count", sa.Integer(), server_default="0"),
+    )
+    op.execute(
+        "UPDATE post SET "
+        "comment_count = (SELECT count(*) FROM comment "
+        "WHERE comment.post_id = post.id), "
+        "reviewed_comment_count = (SELECT count(*) FROM comment "
+        "WHERE comment.post_id = post.id AND comment.reviewed = 1)"
+    )
+    op.execute(
+        "UPDATE category SET post_count = (SELECT count(*) FROM category_post "
+        "WHERE category_post.category_id = category.id)"
+    )
+
+
+def downgrade():
+    op.drop_column("post", "reviewed_comment_count")
+    op.drop_column("post", "comment_count")
+    op.drop_column("category", "post_count")
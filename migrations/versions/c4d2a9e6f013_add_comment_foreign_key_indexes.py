@@ -0,0 +1,27 @@
+"""add indexes on comment.post_id and comment.replied_id
+
+Revision ID: c4d2a9e6f013
+Revises: b71e02f4a9d8
+Create Date: 2026-10-18 19:05:12.408115
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c4d2a9e6f013"
+down_revision = "b71e02f4a9d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f("ix_comment_post_id"), "comment", ["post_id"], unique=False)
+    op.create_index(
+        op.f("ix_comment_replied_id"), "comment", ["replied_id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_comment_replied_id"), table_name="comment")
+    op.drop_index(op.f("ix_comment_post_id"), table_name="comment")
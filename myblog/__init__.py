@@ -6,15 +6,21 @@ import logging
 from logging.handlers import RotatingFileHandler, SMTPHandler
 
 import click
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, g
 from flask_login import current_user
+from flask_sqlalchemy import get_debug_queries
 from flask_wtf.csrf import CSRFError
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from myblog.blueprints.admin import admin_bp
 from myblog.blueprints.blog import blog_bp
 from myblog.blueprints.auth import auth_bp
-from myblog.models import Admin, Category, Comment, Link
+from myblog.blueprints.feed import feed_bp
+from myblog.emails import email_queue
+from myblog.freeze import ENVIRON_KEY as FREEZE_ENVIRON_KEY
+from myblog.models import Admin, Category, Comment, Link, Post, update_counters
 from myblog.settings import config
+from myblog.streaming import after_response
 from myblog.extensions import (
     bootstrap,
     db,
@@ -24,6 +30,15 @@ from myblog.extensions import (
     login_manager,
     csrf,
     migrate,
+    cache,
+    page_cache,
+    user_stamp,
+    site_stamp,
+    query_stats,
+    metrics,
+    assets,
+    compress,
+    ratelimiter,
 )
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
@@ -35,6 +50,9 @@ def create_app(config_name=None):
 
     app = Flask("myblog")
     app.config.from_object(config[config_name])
+    if app.config["BLOG_PROXY_FIX"]:
+        # 限流、/metrics 和日志里的客户端地址从 X-Forwarded-For 取
+        app.wsgi_app = ProxyFix(app.wsgi_app, **app.config["BLOG_PROXY_FIX"])
     register_logging(app)
     register_extensions(app)
     register_blueprints(app)
@@ -42,6 +60,7 @@ def create_app(config_name=None):
     register_commands(app)
     register_shell_context(app)
     register_template_context(app)
+    register_request_handlers(app)
 
     return app
 
@@ -93,12 +112,28 @@ def register_extensions(app):
     login_manager.init_app(app)
     csrf.init_app(app)
     migrate.init_app(app, db)
+    cache.init_app(app)
+    page_cache.init_app(app)
+    user_stamp.init_app(app)
+    site_stamp.init_app(app)
+    email_queue.init_app(app)
+    query_stats.init_app(app)
+    metrics.init_app(app, db)
+    assets.init_app(app)
+    compress.init_app(app)
+    ratelimiter.init_app(app)
+    if app.config["BLOG_DEBUG_TOOLBAR"]:
+        # 只有打开时才导入
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        DebugToolbarExtension(app)
 
 
 def register_blueprints(app):
     app.register_blueprint(blog_bp)
     app.register_blueprint(admin_bp, url_prefix="/admin")
     app.register_blueprint(auth_bp, url_prefix="/auth")
+    app.register_blueprint(feed_bp)
 
 
 def register_shell_context(app: Flask):
@@ -108,23 +143,71 @@ def register_shell_context(app: Flask):
 
 
 def register_template_context(app: Flask):
-    @app.context_processor
-    def make_template_context():
+    def load_site_context():
         admin = Admin.query.first()
         categories = Category.query.order_by(Category.name).all()
         links = Link.query.order_by(Link.name).all()
+        # 缓存普通的字典而不是 ORM 对象，避免在之后的请求里访问到已脱离 session 的对象
+        return dict(
+            admin=admin
+            and dict(
+                name=admin.name,
+                blog_title=admin.blog_title,
+                blog_sub_title=admin.blog_sub_title,
+                about=admin.about,
+            ),
+            categories=[
+                dict(id=c.id, name=c.name, post_count=c.post_count) for c in categories
+            ],
+            links=[dict(name=link.name, url=link.url) for link in links],
+        )
+
+    @app.context_processor
+    def make_template_context():
+        # 其他进程修改设置、分类和链接时会更新 site_stamp
+        stamp = site_stamp.get()
+        context = cache.get_or_set(cache.key("site", stamp), load_site_context)
         if current_user.is_authenticated:
-            unread_comments = Comment.query.filter_by(reviewed=False).count()
+            unread_comments = cache.get_or_set(
+                cache.key("comments", stamp, "unread"),
+                Comment.query.filter_by(reviewed=False).count,
+            )
         else:
             unread_comments = None
         return dict(
-            admin=admin,
-            categories=categories,
-            links=links,
+            context,
             unread_comments=unread_comments,
+            frozen=request.environ.get(FREEZE_ENVIRON_KEY, False),
+            # 流式渲染时由 render_page 换成输出 FLUSH 的函数
+            flush=lambda: "",
         )
 
 
+def register_request_handlers(app: Flask):
+    @app.before_request
+    def mark_queries():
+        # 测试时多个请求共用一个应用上下文，只统计本次请求的查询
+        g.query_offset = len(get_debug_queries())
+
+    @app.after_request
+    def query_profiler(response):
+        # 流式响应的模板里还可能查询，发送完再统计
+        after_response(response, profile_queries)
+        return response
+
+    def profile_queries():
+        queries = get_debug_queries()[g.get("query_offset", 0) :]
+        endpoint = request.endpoint or "<unknown>"
+        for q in queries:
+            if q.duration >= app.config["BLOG_SLOW_QUERY_THRESHOLD"]:
+                app.logger.warning(
+                    "Slow query: Duration: %fs\nEndpoint: %s\nContext: %s\n"
+                    "Query: %s\nParameters: %r"
+                    % (q.duration, endpoint, q.context, q.statement, q.parameters)
+                )
+        query_stats.add(endpoint, queries)
+
+
 def register_errors(app: Flask):
     @app.errorhandler(400)
     def bad_request(e):
@@ -134,6 +217,14 @@ def register_errors(app: Flask):
     def page_not_found(e):
         return render_template("errors/404.html"), 404
 
+    @app.errorhandler(429)
+    def too_many_requests(e):
+        return (
+            render_template("errors/429.html"),
+            429,
+            {"Retry-After": e.retry_after},
+        )
+
     @app.errorhandler(500)
     def internal_server_error(e):
         return render_template("errors/500.html"), 500
@@ -147,40 +238,69 @@ def register_commands(app: Flask):
     # flask forge
     @app.cli.command()
     @click.option(
-        "--category", default=10, help="Quantity of categories, default is 10."
+        "--scale",
+        type=click.Choice(["small", "medium", "large", "huge"]),
+        default="small",
+        help="Preset quantities, default is small (10/50/500).",
     )
-    @click.option("--post", default=50, help="Quantity of posts, default is 50.")
+    @click.option("--category", type=int, help="Quantity of categories.")
+    @click.option("--post", type=int, help="Quantity of posts.")
+    @click.option("--comment", type=int, help="Quantity of reviewed comments.")
+    @click.option("--seed", type=int, help="Random seed for a reproducible dataset.")
+    @click.option("--chunk", default=5000, help="Rows per insert, default is 5000.")
     @click.option(
-        "--comment", default=500, help="Quantity of comments, default is 500."
+        "--workers", default=1, help="Processes generating fake text, default is 1."
     )
-    def forge(category, post, comment):
+    def forge(scale, category, post, comment, seed, chunk, workers):
         """Generates the fake categories, posts, comments and links."""
-        from myblog.fakes import (
-            fake_admin,
-            fake_categories,
-            fake_posts,
-            fake_comments,
-            fake_links,
-        )
+        from datetime import datetime
+
+        from myblog import fakes
+        from myblog.search import get_backend, rebuild_index
+
+        quantities = dict(fakes.SCALES[scale])
+        for key, value in (
+            ("category", category),
+            ("post", post),
+            ("comment", comment),
+        ):
+            if value is not None:
+                quantities[key] = value
+        now = datetime.utcnow()
+        if seed is not None:
+            fakes.seed(seed)
+            # 时间也要固定，否则同一个 seed 每天生成的数据不同
+            now = datetime(2020, 1, 1)
 
         db.drop_all()
         db.create_all()
 
         click.echo("Generating the administrator...")
-        fake_admin()
+        fakes.fake_admin()
 
-        click.echo("Generating %d categories..." % category)
-        fake_categories(category)
+        click.echo("Generating %d categories..." % quantities["category"])
+        fakes.fake_categories(quantities["category"])
 
-        click.echo("Generating %d posts..." % post)
-        fake_posts(post)
+        pool = fakes.make_pool(workers)
+        try:
+            click.echo("Generating %d posts..." % quantities["post"])
+            fakes.fake_posts(quantities["post"], min(chunk, 1000), pool, now)
 
-        click.echo("Generating %d comments..." % comment)
-        fake_comments(comment)
+            click.echo("Generating %d comments..." % quantities["comment"])
+            fakes.fake_comments(quantities["comment"], chunk, pool, now)
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
         click.echo("Generating links...")
-        fake_links()
+        fakes.fake_links()
+
+        if get_backend() is not None:
+            click.echo("Indexing...")
+            rebuild_index(chunk)
 
+        # 正在运行的各进程清空页面缓存
+        site_stamp.bump()
         click.echo("Done.")
 
     # flask init
@@ -223,4 +343,150 @@ def register_commands(app: Flask):
             db.session.add(category)
 
         db.session.commit()
+        # 各进程缓存的管理员随之失效，改了密码的话已登录的会话也失效
+        user_stamp.bump()
+        site_stamp.bump()
         click.echo("Done.")
+
+    # flask recount
+    @app.cli.command()
+    def recount():
+        """Recompute the comment and post counters."""
+        click.echo("Recounting comments of posts and posts of categories...")
+        update_counters()
+        db.session.commit()
+        site_stamp.bump()
+        click.echo("Done.")
+
+    # flask reindex
+    @app.cli.command()
+    @click.option(
+        "--chunk", default=500, help="Documents per transaction, default is 500."
+    )
+    def reindex(chunk):
+        """Rebuilds the full-text search index."""
+        from myblog.search import rebuild_index
+
+        click.echo("Rebuilding the search index...")
+        count = rebuild_index(chunk, echo=click.echo)
+        click.echo("Indexed %d documents." % count)
+
+    # flask excerpt
+    @app.cli.command()
+    @click.option("--all", "rebuild", is_flag=True, help="Rebuild every excerpt.")
+    @click.option("--chunk", default=500, help="Posts per transaction, default is 500.")
+    def excerpt(rebuild, chunk):
+        """Generates the excerpts of posts."""
+        query = Post.query.with_entities(Post.id, Post.body)
+        if not rebuild:
+            query = query.filter(Post.excerpt.is_(None))
+        table = Post.__table__
+        count = last_id = 0
+        while True:
+            rows = query.filter(Post.id > last_id).order_by(Post.id).limit(chunk).all()
+            if not rows:
+                break
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam("post_id")),
+                [dict(post_id=i, excerpt=Post.make_excerpt(body)) for i, body in rows],
+            )
+            db.session.commit()
+            count += len(rows)
+            last_id = rows[-1].id
+        site_stamp.bump()
+        click.echo("Generated %d excerpts." % count)
+
+    # flask queries
+    @app.cli.command()
+    @click.option("--reset", is_flag=True, help="Clear the statistics after dumping.")
+    def queries(reset):
+        """Dumps the per-endpoint query statistics."""
+        rows = query_stats.report()
+        click.echo(
+            "%-30s %8s %8s %8s %10s %6s"
+            % ("Endpoint", "Requests", "Queries", "Max", "DB time", "Slow")
+        )
+        for row in rows:
+            click.echo(
+                "%-30s %8d %8.1f %8d %9.3fs %6d"
+                % (
+                    row["endpoint"],
+                    row["requests"],
+                    row["avg_queries"],
+                    row["max_queries"],
+                    row["db_time"],
+                    row["slow"],
+                )
+            )
+        if reset:
+            query_stats.reset()
+            click.echo("Statistics cleared.")
+
+    # flask startup
+    @app.cli.command()
+    @click.option("--config", "config_name", help="Defaults to FLASK_CONFIG.")
+    @click.option("--eager", is_flag=True, help="Turn BLOG_LAZY_IMPORTS off.")
+    @click.option("--limit", default=15, help="Packages to list, default is 15.")
+    def startup(config_name, eager, limit):
+        """Profiles the imports of create_app with -X importtime."""
+        from myblog.profiling import profile_startup
+
+        config_name = config_name or os.getenv("FLASK_CONFIG", "development")
+        seconds, packages = profile_startup(config_name, lazy=not eager)
+        click.echo("%-30s %9s" % ("Package", "Import"))
+        for name, cumulative in packages[:limit]:
+            click.echo("%-30s %8.1fms" % (name, cumulative * 1000))
+        click.echo("create_app(%r) took %.1fms." % (config_name, seconds * 1000))
+
+    # flask assets
+    @app.cli.command()
+    @click.option("--clean", is_flag=True, help="Remove the previous build first.")
+    def assets(clean):
+        """Builds fingerprinted, compressed copies of the static files."""
+        from myblog.assets import build_assets, clean_assets
+
+        output = app.config["BLOG_ASSETS_PATH"]
+        if not output:
+            raise click.UsageError("BLOG_ASSETS_PATH is not set.")
+        if clean:
+            clean_assets(output)
+        click.echo("Building static assets into %s..." % output)
+        manifest = build_assets(app.static_folder, output, echo=click.echo)
+        click.echo("Done, %d files in the manifest." % len(manifest))
+
+    # flask freeze
+    @app.cli.command()
+    @click.option(
+        "--output",
+        type=click.Path(file_okay=False),
+        help="Output directory, default is BLOG_FREEZE_PATH.",
+    )
+    @click.option(
+        "--base-url",
+        default="http://localhost/",
+        help="The URL the site is served at, used in absolute links.",
+    )
+    @click.option("--workers", default=1, help="Rendering processes, default is 1.")
+    @click.option("--full", is_flag=True, help="Render every page again.")
+    def freeze(output, base_url, workers, full):
+        """Exports the public pages as static files."""
+        from myblog.freeze import freeze_site
+
+        output = output or app.config["BLOG_FREEZE_PATH"]
+        if not output:
+            raise click.UsageError("BLOG_FREEZE_PATH is not set.")
+        click.echo("Freezing into %s..." % output)
+        try:
+            rendered, unchanged, removed, failed = freeze_site(
+                app, output, base_url, workers, full, echo=click.echo
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        for url, status in failed:
+            click.echo("Failed to render %s: %d" % (url, status), err=True)
+        click.echo(
+            "Done, %d rendered, %d unchanged, %d removed."
+            % (rendered, unchanged, len(removed))
+        )
+        if failed:
+            raise click.ClickException("%d pages failed." % len(failed))
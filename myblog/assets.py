@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, request, safe_join, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # 没有 brotli 时只生成 .gz
+    brotli = None
+
+MANIFEST = "manifest.json"
+
+# 这些类型的文件生成压缩版本，图片、字体等本身已经压缩过，不在其中
+COMPRESSIBLE = {".css", ".js", ".map", ".svg", ".json", ".html", ".txt", ".ico", ".md"}
+
+
+class Assets(object):
+    """Serve fingerprinted, precompressed copies of ``static`` after a build.
+
+    ``flask assets`` writes every static file twice into ``BLOG_ASSETS_PATH``,
+    once under its own name and once as ``name.<hash>.ext``, each with
+    ``.gz`` and ``.br`` siblings, and a manifest from the original name to
+    the hashed one.  When the manifest exists, ``url_for('static', ...)``
+    returns hashed names, which are cached forever, and the static route
+    sends the best precompressed variant the client accepts.  Without a
+    build the default static handling is left alone.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_ASSETS_PATH", None)
+        path = app.config["BLOG_ASSETS_PATH"]
+        manifest = load_manifest(path) if path else None
+        if not manifest:
+            return
+        app.extensions["blog_assets"] = _AssetsState(path, manifest)
+        app.url_defaults(self._hashed_filename)
+        app.view_functions["static"] = self.send_asset
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_assets"]
+
+    def asset_name(self, filename):
+        return self._state.manifest.get(filename, filename)
+
+    def _hashed_filename(self, endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = self.asset_name(values["filename"])
+
+    def send_asset(self, filename):
+        state = self._state
+        path = safe_join(state.path, filename)
+        if path is None or not os.path.isfile(path):
+            # 构建之后新加的文件
+            return current_app.send_static_file(filename)
+        encoding = None
+        for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if name in request.accept_encodings and os.path.isfile(path + suffix):
+                encoding = name
+                break
+        if encoding is None:
+            response = send_from_directory(state.path, filename, conditional=True)
+        else:
+            response = send_from_directory(
+                state.path,
+                filename + (".br" if encoding == "br" else ".gz"),
+                mimetype=mimetypes.guess_type(filename)[0],
+                conditional=True,
+            )
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        if filename in state.hashed:
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 3600
+            response.cache_control.immutable = True
+        return response
+
+
+class _AssetsState(object):
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.hashed = set(manifest.values())
+
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def hashed_name(filename, data):
+    digest = hashlib.md5(data).hexdigest()[:10]
+    base, ext = os.path.splitext(filename)
+    return "%s.%s%s" % (base, digest, ext)
+
+
+def build_assets(source, output, echo=None):
+    """Write hashed and compressed copies of ``source`` to ``output``.
+
+    Returns the manifest.  Unchanged files are skipped, so rebuilding after
+    a deploy only compresses what changed.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            src = os.path.join(root, name)
+            filename = os.path.relpath(src, source).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                data = f.read()
+            hashed = hashed_name(filename, data)
+            manifest[filename] = hashed
+            for target in (filename, hashed):
+                if (
+                    write_compressed(os.path.join(output, target), data)
+                    and echo is not None
+                ):
+                    echo(target)
+
+    # 最后写 manifest，构建中断时应用仍然用旧的
+    tmp = os.path.join(output, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(output, MANIFEST))
+    return manifest
+
+
+def write_compressed(path, data, brotli_quality=11):
+    """Write ``data`` and its compressed siblings, False if up to date."""
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for suffix in (".gz", ".br"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    files = [("", data)]
+    if os.path.splitext(path)[1].lower() in COMPRESSIBLE:
+        files.append((".gz", _gzip(data)))
+        if brotli is not None:
+            files.append((".br", brotli.compress(data, quality=brotli_quality)))
+    for suffix, body in files:
+        # 压缩效果不明显就不保存
+        if suffix and len(body) >= len(data) * 0.9:
+            continue
+        # 先写临时文件再改名，服务器不会读到写了一半的文件
+        with open(path + suffix + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + suffix + ".tmp", path + suffix)
+    return True
+
+
+def _gzip(data):
+    # mtime 固定为 0，同样的内容得到同样的 .gz；gzip.compress 到 3.8 才能指定 mtime
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def clean_assets(output):
+    if os.path.isdir(output):
+        shutil.rmtree(output)
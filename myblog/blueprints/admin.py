@@ -8,13 +8,36 @@ from flask import (
     url_for,
     request,
     current_app,
+    jsonify,
 )
+from flask_ckeditor import upload_success, upload_fail
 from flask_login import login_required, current_user
 
-from myblog.extensions import db, csrf
+from myblog.extensions import (
+    db,
+    csrf,
+    cache,
+    page_cache,
+    query_stats,
+    site_stamp,
+    user_stamp,
+)
+from myblog.caching import post_page_tags
 from myblog.forms import SettingForm, PostForm, CategoryForm, LinkForm
-from myblog.models import Post, Category, Comment, Link
-from myblog.utils import redirect_back
+from myblog.models import (
+    Admin,
+    Post,
+    Category,
+    Comment,
+    Link,
+    approve_comments,
+    category_post_table,
+    delete_comments,
+)
+from myblog.pagination import paginate
+from myblog.search import index_comments, unindex_comments
+from myblog.uploads import allowed_file, save_image, send_image
+from myblog.utils import redirect_back, render_page, to_local, to_utc
 
 admin_bp = Blueprint("admin", __name__)
 
@@ -24,11 +47,16 @@ admin_bp = Blueprint("admin", __name__)
 def settings():
     form = SettingForm()
     if form.validate_on_submit():
-        current_user.name = form.name.data
-        current_user.blog_title = form.blog_title.data
-        current_user.blog_sub_title = form.blog_sub_title.data
-        current_user.about = form.about.data
+        # current_user 是缓存的对象，不在 session 里
+        admin = Admin.query.get(current_user.id)
+        admin.name = form.name.data
+        admin.blog_title = form.blog_title.data
+        admin.blog_sub_title = form.blog_sub_title.data
+        admin.about = form.about.data
         db.session.commit()
+        user_stamp.bump()
+        cache.bump("site")
+        page_cache.clear()
         flash("Setting updated.", "success")
         return redirect(url_for("blog.index"))
     form.name.data = current_user.name
@@ -42,11 +70,23 @@ def settings():
 @login_required
 def manage_post():
     page = request.args.get("page", 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config.get("BLOG_MANAGE_POST_PER_PAGE", 30)
+    pagination = paginate(
+        Post.query.options(
+            db.defer(Post.body),
+            db.undefer(Post.body_length),
+            db.selectinload(Post.categories),
+        ),
+        Post,
+        current_app.config.get("BLOG_MANAGE_POST_PER_PAGE", 30),
+        page=page,
     )
     posts = pagination.items
-    return render_template("admin/manage_post.html", pagination=pagination, posts=posts)
+    total = cache.get_or_set(
+        cache.key("site", site_stamp.get(), "post_count"), Post.query.count
+    )
+    return render_page(
+        "admin/manage_post.html", pagination=pagination, posts=posts, total=total
+    )
 
 
 @admin_bp.route("/post/new", methods=["GET", "POST"])
@@ -62,6 +102,8 @@ def new_post():
         post = Post(title=title, body=body, private=private, categories=categories)
         db.session.add(post)
         db.session.commit()
+        cache.bump("site")
+        page_cache.evict(*post_page_tags(post))
         flash("Post created.", "success")
         return redirect(url_for("blog.show_post", post_id=post.id))
     return render_template("admin/new_post.html", form=form)
@@ -76,10 +118,13 @@ def edit_post(post_id):
         post.title = form.title.data
         post.body = form.body.data
         post.private = form.private.data
+        old_categories = list(post.categories)
         # post.category = Category.query.get(form.category.data)
         categories = [Category.query.get(i) for i in form.categories.data]
         post.categories = categories
         db.session.commit()
+        cache.bump("site")
+        page_cache.evict(*post_page_tags(post, old_categories))
         flash("Post <%s> updated." % post.title, "success")
         return redirect(url_for("blog.show_post", post_id=post.id))
     form.title.data = post.title
@@ -93,8 +138,11 @@ def edit_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
+    tags = post_page_tags(post)
     db.session.delete(post)
     db.session.commit()
+    cache.bump("site", "comments")
+    page_cache.evict(*tags)
     flash("Post <%s> deleted." % post.title, "success")
     return redirect_back()
 
@@ -108,6 +156,8 @@ def new_category():
         category = Category(name=form.name.data)
         db.session.add(category)
         db.session.commit()
+        cache.bump("site")
+        page_cache.clear()
         flash("Category created.", "success")
         return redirect(url_for(".manage_category"))
 
@@ -127,6 +177,8 @@ def edit_category(category_id):
         # 可以对name再做一个防重复验证
         category.name = form.name.data
         db.session.commit()
+        cache.bump("site")
+        page_cache.clear()
         flash("Category updated.", "success")
         return redirect(url_for(".manage_category"))
 
@@ -141,6 +193,8 @@ def delete_category(category_id):
         return redirect(url_for("blog.index"))
     category = Category.query.get_or_404(category_id)
     category.delete()
+    cache.bump("site")
+    page_cache.clear()
     flash("Category deleted.", "success")
     return redirect(url_for(".manage_category"))
 
@@ -149,7 +203,7 @@ def delete_category(category_id):
 @login_required
 def manage_category():
     categories = Category.query.all()
-    return render_template("admin/manage_category.html", categories=categories)
+    return render_page("admin/manage_category.html", categories=categories)
 
 
 @admin_bp.route("/link/new", methods=["GET", "POST"])
@@ -160,6 +214,8 @@ def new_link():
         link = Link(name=form.name.data, url=form.url.data)
         db.session.add(link)
         db.session.commit()
+        cache.bump("site")
+        page_cache.clear()
         flash("Link created.", "success")
         return redirect(url_for(".manage_link"))
     return render_template("admin/new_link.html", form=form)
@@ -179,6 +235,7 @@ def set_comment(post_id):
     post.can_comment = not post.can_comment
     flash("Comment %s" % ("Enabled" if post.can_comment else "Disabled"))
     db.session.commit()
+    page_cache.evict("post:%d" % post_id)
     return redirect_back()
 
 
@@ -196,12 +253,16 @@ def manage_comment():
     else:
         filtered_comments = Comment.query
 
-    pagination = filtered_comments.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=per_page
-    )
+    pagination = paginate(filtered_comments, Comment, per_page, page=page)
     comments = pagination.items
-    return render_template(
-        "admin/manage_comment.html", comments=comments, pagination=pagination
+    total = cache.get_or_set(
+        cache.key("comments", site_stamp.get(), filter_rule), filtered_comments.count
+    )
+    return render_page(
+        "admin/manage_comment.html",
+        comments=comments,
+        pagination=pagination,
+        total=total,
     )
 
 
@@ -211,6 +272,8 @@ def approve_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     comment.reviewed = True
     db.session.commit()
+    cache.bump("comments")
+    page_cache.evict(*post_page_tags(comment.post))
     flash("Comment published.", "success")
     return redirect_back()
 
@@ -219,24 +282,169 @@ def approve_comment(comment_id):
 @login_required
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
+    tags = post_page_tags(comment.post)
     db.session.delete(comment)
     db.session.commit()
+    cache.bump("comments")
+    page_cache.evict(*tags)
     flash("Comment deleted.", "success")
     return redirect_back()
 
 
+@admin_bp.route("/comment/bulk", methods=["POST"])
+@login_required
+def bulk_comments():
+    action = request.form.get("action")
+    ids = request.form.getlist("ids", type=int)
+    if action not in ("approve", "delete") or not ids:
+        flash("No comment selected.", "warning")
+        return redirect_back()
+    if action == "approve":
+        rows = approve_comments(Comment.id.in_(ids))
+        index_comments([i for i, post_id in rows])
+    else:
+        # 回复会被一起删除
+        rows = delete_comments(Comment.id.in_(ids))
+        unindex_comments([i for i, post_id in rows])
+    db.session.commit()
+    _evict_comment_pages(rows)
+    flash(
+        "%d comments %s."
+        % (len(rows), "published" if action == "approve" else "deleted"),
+        "success",
+    )
+    return redirect_back()
+
+
+# 一百年前的评论都删掉就等于删掉所有未审核的评论了
+MAX_PRUNE_DAYS = 36500
+
+
+@admin_bp.route("/comment/prune", methods=["POST"])
+@login_required
+def prune_comments():
+    days = request.form.get("days", type=int)
+    # timedelta 最多约 270 万天，太大时会溢出
+    if days is None or not 0 <= days <= MAX_PRUNE_DAYS:
+        flash("Invalid number of days.", "warning")
+        return redirect_back()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    rows = delete_comments(
+        db.and_(Comment.reviewed.isnot(True), Comment.timestamp < cutoff)
+    )
+    unindex_comments([i for i, post_id in rows])
+    db.session.commit()
+    _evict_comment_pages(rows)
+    flash("%d comments deleted." % len(rows), "success")
+    return redirect_back()
+
+
+def _evict_comment_pages(rows):
+    cache.bump("comments")
+    post_ids = {post_id for i, post_id in rows}
+    if not post_ids:
+        return
+    if len(post_ids) > 100:
+        # 涉及的文章太多时直接清空
+        page_cache.clear()
+        return
+    categories = (
+        db.session.query(category_post_table.c.category_id)
+        .filter(category_post_table.c.post_id.in_(post_ids))
+        .distinct()
+    )
+    page_cache.evict(
+        "index",
+        *["post:%d" % i for i in post_ids],
+        *["category:%d" % i for i, in categories]
+    )
+
+
 @admin_bp.route("/timemachine", methods=["GET", "POST"])
 @login_required
-@csrf.exempt
 def timemachine():
-    posts = Post.query.order_by(Post.timestamp.desc()).all()
     if request.method == "POST":
-        for post_id, post_time in request.form.items():
-            if post_time:
-                utc_time = datetime.strptime(post_time, "%Y-%m-%dT%H:%M") - timedelta(
-                    hours=8
-                )
-                post = Post.query.get_or_404(int(post_id))
-                post.timestamp = utc_time
-                db.session.commit()
-    return render_template("admin/timemachine.html", posts=posts)
+        changes, errors = _parse_times(request.form)
+        if errors:
+            # 有一项不对就全部不改
+            flash(
+                "Nothing changed, invalid time for: %s." % ", ".join(errors), "warning"
+            )
+        elif changes:
+            table = Post.__table__
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam("post_id")),
+                [dict(post_id=i, timestamp=t) for i, t in changes.items()],
+            )
+            db.session.commit()
+            cache.bump("site")
+            page_cache.clear()
+            flash("%d posts updated." % len(changes), "success")
+        return redirect(request.full_path)
+
+    pagination = paginate(
+        Post.query.options(db.load_only("id", "title", "timestamp")),
+        Post,
+        current_app.config["BLOG_MANAGE_POST_PER_PAGE"],
+        page=request.args.get("page", 1, type=int),
+    )
+    return render_template(
+        "admin/timemachine.html",
+        posts=[(post, to_local(post.timestamp)) for post in pagination.items],
+        pagination=pagination,
+        timezone=current_app.config["BLOG_TIMEZONE"],
+    )
+
+
+def _parse_times(form):
+    """Read ``{post_id: local time}`` fields into UTC times.
+
+    Returns ``(changes, errors)``, errors list the fields that are not a
+    valid time or not an existing post.
+    """
+    changes, errors = {}, []
+    for key, value in form.items():
+        if key == "csrf_token" or not value:
+            continue
+        try:
+            # 有的浏览器会带上秒
+            fmt = "%Y-%m-%dT%H:%M:%S" if value.count(":") == 2 else "%Y-%m-%dT%H:%M"
+            changes[int(key)] = to_utc(datetime.strptime(value, fmt))
+        except ValueError:
+            errors.append(key)
+    if changes:
+        found = {
+            i for i, in db.session.query(Post.id).filter(Post.id.in_(changes.keys()))
+        }
+        errors.extend(str(i) for i in changes if i not in found)
+    return changes, errors
+
+
+@admin_bp.route("/cache")
+@login_required
+def cache_stats():
+    return jsonify(page_cache.stats())
+
+
+@admin_bp.route("/queries")
+@login_required
+def query_report():
+    return render_template("admin/queries.html", rows=query_stats.report())
+
+
+@admin_bp.route("/uploads/<path:filename>")
+def get_image(filename):
+    return send_image(filename)
+
+
+@admin_bp.route("/upload", methods=["POST"])
+@login_required
+def upload_image():
+    f = request.files.get("upload")
+    if f is None or not allowed_file(f.filename):
+        return upload_fail("Image only!")
+    filename = save_image(f)
+    if filename is None:
+        return upload_fail("Image only!")
+    url = url_for(".get_image", filename=filename)
+    return upload_success(url, filename)
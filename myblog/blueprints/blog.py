@@ -10,11 +10,14 @@ from flask import (
     make_response,
 )
 
-from myblog.extensions import db, csrf
+from myblog.extensions import db, csrf, cache, page_cache
+from myblog.caching import post_page_tags
 from myblog.emails import send_new_comment_email, send_new_reply_email
 from myblog.models import Post, Category, Comment
 from myblog.forms import CommentForm, AdminCommentForm
-from myblog.utils import redirect_back
+from myblog.pagination import KeysetPagination, paginate, paginate_threads
+from myblog.search import search_index
+from myblog.utils import deferred, redirect_back, render_page
 from flask_login import current_user, login_required
 
 blog_bp = Blueprint("blog", __name__)
@@ -22,51 +25,59 @@ blog_bp = Blueprint("blog", __name__)
 
 @blog_bp.route("/", defaults={"page": 1})
 @blog_bp.route("/page/<int:page>")
+@page_cache.cached("index")
 def index(page):
     per_page = current_app.config["BLOG_POST_PER_PAGE"]
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=per_page
-    )
+    query = Post.query.options(db.defer(Post.body), db.selectinload(Post.categories))
+    if not current_user.is_authenticated:
+        query = query.filter(Post.private.isnot(True))
+    pagination = paginate(query, Post, per_page, page=page)
     posts = pagination.items
-    return render_template("blog/index.html", pagination=pagination, posts=posts)
+    return render_page("blog/index.html", pagination=pagination, posts=posts)
 
 
 @blog_bp.route("/about")
+@page_cache.cached("about")
 def about():
     return render_template("blog/about.html")
 
 
-@blog_bp.route("/category/<int:category_id>")
-def show_category(category_id):
+@blog_bp.route("/category/<int:category_id>", defaults={"page": 1})
+@blog_bp.route("/category/<int:category_id>/page/<int:page>")
+@page_cache.cached("category:{category_id}")
+def show_category(category_id, page):
     category = Category.query.get_or_404(category_id)
-    page = request.args.get("page", 1, type=int)
+    page = request.args.get("page", page, type=int)
     per_page = current_app.config.get("BLOG_POST_PER_PAGE", 10)
-    pagination = (
-        Post.query.with_parent(category)
-        .order_by(Post.timestamp.desc())
-        .paginate(page, per_page=per_page)
+    query = Post.query.with_parent(category).options(
+        db.defer(Post.body), db.selectinload(Post.categories)
     )
+    if not current_user.is_authenticated:
+        query = query.filter(Post.private.isnot(True))
+    pagination = paginate(query, Post, per_page, page=page)
     posts = pagination.items
     return render_template(
         "blog/category.html", category=category, posts=posts, pagination=pagination
     )
 
 
-@blog_bp.route("/post/<int:post_id>", methods=["GET", "POST"])
-def show_post(post_id):
-    post = Post.query.get_or_404(post_id)
+@blog_bp.route("/post/<int:post_id>", defaults={"page": 1}, methods=["GET", "POST"])
+@blog_bp.route("/post/<int:post_id>/page/<int:page>", methods=["GET", "POST"])
+@page_cache.cached("post:{post_id}")
+def show_post(post_id, page):
+    post = Post.query.options(db.joinedload(Post.categories)).get_or_404(post_id)
     if post.private and not current_user.is_authenticated:
         flash("你没有权限访问该文章！", "warning")
         return redirect(url_for(".index"))
-    page = request.args.get("page", 1, type=int)
+    page = request.args.get("page", page, type=int)
     per_page = current_app.config.get("BLOG_COMMENT_PER_PAGE", 15)
-    pagination = (
-        Comment.query.with_parent(post)
-        .filter_by(reviewed=True)
-        .order_by(Comment.timestamp.asc())
-        .paginate(page, per_page=per_page)
-    )
-    comments = pagination.items
+    # 游标无效时要在发出响应头之前回复 400
+    cursor = request.args.get("cursor")
+    if cursor:
+        KeysetPagination.load_cursor(cursor)
+    # 流式渲染时先发出文章，渲染到评论时才查询
+    pagination = deferred(lambda: paginate_threads(post, per_page, page=page))
+    threads = deferred(lambda: pagination.threads)
 
     if current_user.is_authenticated:
         form = AdminCommentForm()
@@ -102,14 +113,28 @@ def show_post(post_id):
 
         db.session.add(comment)
         db.session.commit()
+        cache.bump("comments")
+        if reviewed:
+            page_cache.evict(*post_page_tags(post))
         if current_user.is_authenticated:
             flash("Comment published.", "success")
         else:
             flash("Thanks, your comment will be published after reviewed.", "info")
             send_new_comment_email(post)
         return redirect(url_for(".show_post", post_id=post_id))
+    return render_page(
+        "blog/post.html", post=post, pagination=pagination, threads=threads, form=form
+    )
+
+
+@blog_bp.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = current_app.config["BLOG_POST_PER_PAGE"]
+    pagination = search_index(q, current_user.is_authenticated, page, per_page)
     return render_template(
-        "blog/post.html", post=post, pagination=pagination, comments=comments, form=form
+        "blog/search.html", q=q, pagination=pagination, hits=pagination.items
     )
 
 
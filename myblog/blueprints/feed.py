@@ -0,0 +1,149 @@
+from datetime import datetime
+
+from flask import Blueprint, current_app, request, abort
+
+from myblog.extensions import db, cache, site_stamp
+from myblog.models import Post, Category
+from myblog.streaming import stream_response
+from myblog.utils import stream_template
+
+feed_bp = Blueprint("feed", __name__)
+
+
+def cache_key(name):
+    # 任何进程修改文章都会更新 site_stamp，见 PageCache.evict
+    return cache.key("site", site_stamp.get(), name)
+
+
+def cached_xml(name, template_name, make_context):
+    """Stream an XML document and keep it until the next post write.
+
+    ``make_context`` is only called on a cache miss.  Feed readers and
+    crawlers poll with ``If-Modified-Since``, so the time the document was
+    generated is sent as ``Last-Modified``.
+    """
+    key = cache_key(name)
+    timeout = current_app.config["BLOG_FEED_CACHE_TIMEOUT"]
+    mimetype = "application/atom+xml" if name == "atom" else "text/xml"
+    entry = cache.get(key)
+    if entry is None and not request.if_modified_since:
+        last_modified = datetime.utcnow().replace(microsecond=0)
+
+        def generate():
+            chunks = []
+            with cache.filling():
+                for chunk in stream_template(template_name, **make_context()):
+                    chunks.append(chunk)
+                    yield chunk
+            cache.set(key, (last_modified, "".join(chunks), {}), timeout)
+
+        # 刚生成的文档没有什么可比较的，make_conditional 会为了计算长度读完
+        # 整个正文，这里不调用
+        response = stream_response(generate(), mimetype=mimetype)
+        response.last_modified = last_modified
+        return _public(response)
+
+    if entry is None:
+        # 条件请求要和完整的文档比较，先渲染并存进缓存，再决定是否回复 304
+        last_modified = datetime.utcnow().replace(microsecond=0)
+        with cache.filling():
+            body = "".join(stream_template(template_name, **make_context()))
+        entry = (last_modified, body, {})
+        cache.set(key, entry, timeout)
+    last_modified, body, encoded = entry
+    response = current_app.response_class(body, mimetype=mimetype)
+    # 压缩后的文档和原文一起缓存
+    response.compressed_cache = encoded
+    response.last_modified = last_modified
+    return _public(response).make_conditional(request)
+
+
+def _public(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+
+def public_posts():
+    return Post.query.filter(Post.private.isnot(True))
+
+
+def category_ids():
+    return (c for c, in Category.query.with_entities(Category.id))
+
+
+def sitemap_chunks():
+    """How many post sitemaps are needed, 0 if one sitemap fits everything."""
+    limit = current_app.config["BLOG_SITEMAP_MAX_URLS"]
+    urls = public_posts().count() + Category.query.count() + 2
+    if urls <= limit:
+        return 0
+    max_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+    return (max_id + limit - 1) // limit
+
+
+@feed_bp.route("/feed.xml")
+def atom():
+    def make_context():
+        posts = (
+            public_posts()
+            .options(db.selectinload(Post.categories))
+            .order_by(Post.timestamp.desc())
+            .limit(current_app.config["BLOG_FEED_SIZE"])
+            .all()
+        )
+        updated = posts[0].timestamp if posts else datetime.utcnow()
+        return dict(posts=posts, updated=updated)
+
+    return cached_xml("atom", "feed/atom.xml", make_context)
+
+
+@feed_bp.route("/sitemap.xml")
+def sitemap():
+    chunks = cache.get_or_set(cache_key("sitemap-chunks"), sitemap_chunks)
+    if chunks:
+        return cached_xml(
+            "sitemap", "feed/sitemap_index.xml", lambda: dict(chunks=chunks)
+        )
+
+    def make_context():
+        # 逐行读取，不把所有文章一次性加载到内存
+        posts = (
+            public_posts()
+            .with_entities(Post.id, Post.timestamp)
+            .order_by(Post.id)
+            .yield_per(1000)
+        )
+        return dict(pages=True, categories=category_ids(), posts=posts)
+
+    return cached_xml("sitemap", "feed/sitemap.xml", make_context)
+
+
+@feed_bp.route("/sitemap-pages.xml")
+def sitemap_pages():
+    return cached_xml(
+        "sitemap-pages",
+        "feed/sitemap.xml",
+        lambda: dict(pages=True, categories=category_ids(), posts=()),
+    )
+
+
+@feed_bp.route("/sitemap-posts-<int:n>.xml")
+def sitemap_posts(n):
+    chunks = cache.get_or_set(cache_key("sitemap-chunks"), sitemap_chunks)
+    if n >= chunks:
+        abort(404)
+
+    def make_context():
+        # 按 id 区间切分，每个文件的 URL 数不超过上限，查询也能走主键
+        limit = current_app.config["BLOG_SITEMAP_MAX_URLS"]
+        posts = (
+            public_posts()
+            .with_entities(Post.id, Post.timestamp)
+            .filter(Post.id > n * limit, Post.id <= (n + 1) * limit)
+            .order_by(Post.id)
+            .yield_per(1000)
+        )
+        return dict(posts=posts)
+
+    return cached_xml("sitemap-posts-%d" % n, "feed/sitemap.xml", make_context)
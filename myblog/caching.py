@@ -0,0 +1,417 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request, session, g
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+
+class Cache(object):
+    """A small in-process cache with expiring entries and generation keys.
+
+    Every write that changes what a group of cached values depends on calls
+    :meth:`bump` for that group, values are stored under the current
+    generation so a bump makes the old ones unreachable at once, and the
+    timeout cleans them up later.  State lives in ``app.extensions`` so every
+    app (and every worker process) has its own store.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_CACHE_TIMEOUT", 300)
+        app.extensions["blog_cache"] = _CacheState()
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_cache"]
+
+    def get(self, key):
+        state = self._state
+        entry = state.store.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            state.store.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = current_app.config["BLOG_CACHE_TIMEOUT"]
+        state = self._state
+        now = time.monotonic()
+        with state.lock:
+            if now > state.next_prune:
+                for k, (expires, _) in list(state.store.items()):
+                    if expires < now:
+                        del state.store[k]
+                state.next_prune = now + timeout
+            state.store[key] = (now + timeout, value)
+
+    def get_or_set(self, key, func, timeout=None):
+        value = self.get(key)
+        if value is None:
+            with self.filling():
+                value = func()
+            self.set(key, value, timeout)
+        return value
+
+    @contextmanager
+    def filling(self):
+        """Mark the block as computing a value other requests will reuse."""
+        g.blog_cache_filling = g.get("blog_cache_filling", 0) + 1
+        try:
+            yield
+        finally:
+            g.blog_cache_filling -= 1
+
+    def delete(self, key):
+        self._state.store.pop(key, None)
+
+    def generation(self, name):
+        return self._state.generations.get(name, 0)
+
+    def bump(self, *names):
+        state = self._state
+        with state.lock:
+            for name in names:
+                state.generations[name] = state.generations.get(name, 0) + 1
+
+    def key(self, name, *parts):
+        """Build a key that is invalidated by ``bump(name)``."""
+        return ":".join([name, str(self.generation(name))] + [str(p) for p in parts])
+
+    def clear(self):
+        state = self._state
+        with state.lock:
+            state.store.clear()
+            state.generations.clear()
+
+
+def filling_cache():
+    """Whether the request is computing something a cache will keep.
+
+    True inside :meth:`Cache.filling` and while a view renders a page the
+    page cache is going to store.
+    """
+    return g.get("blog_cache_filling", 0) > 0 or g.get("blog_page_cache_storing", False)
+
+
+class _CacheState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.store = {}
+        self.generations = {}
+        self.next_prune = 0
+
+
+class SharedStamp(object):
+    """A version stamp shared by every process, bumped on rare writes.
+
+    The stamp is the inode and modification time of the file at
+    ``BLOG_<NAME>_STAMP_PATH``, :meth:`bump` replaces the file, so reading it
+    is one ``stat`` call and a bump from any process, the ``flask`` CLI
+    included, is seen by all workers.  Without a path the stamp is a counter
+    in this process.
+    """
+
+    def __init__(self, name, app=None):
+        self.name = name
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config_key = "BLOG_%s_STAMP_PATH" % self.name.upper()
+        app.config.setdefault(config_key, None)
+        app.extensions["blog_%s_stamp" % self.name] = _StampState(
+            app.config[config_key]
+        )
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_%s_stamp" % self.name]
+
+    def get(self):
+        state = self._state
+        if state.path is None:
+            return state.counter
+        try:
+            stat = os.stat(state.path)
+        except FileNotFoundError:
+            return 0
+        return "%d-%d" % (stat.st_ino, stat.st_mtime_ns)
+
+    def bump(self):
+        state = self._state
+        with state.lock:
+            state.counter += 1
+            if state.path is not None:
+                os.makedirs(os.path.dirname(state.path), exist_ok=True)
+                tmp = "%s.%d.tmp" % (state.path, os.getpid())
+                with open(tmp, "w") as f:
+                    f.write(str(time.time()))
+                # 换成新文件，inode 一定会变
+                os.replace(tmp, state.path)
+
+
+class _StampState(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.counter = 0
+
+
+class PageCache(object):
+    """A bounded LRU cache of whole responses for anonymous readers.
+
+    Views opt in with :meth:`cached` and name the tags their page depends
+    on, writes evict only the tags they touch.  Pages are never served to or
+    stored from a logged-in user, a non-GET request, or a request that has
+    flashed messages waiting.
+
+    Every process has its own cache.  Evicting also bumps ``stamp``, a
+    :class:`SharedStamp`, and a process that sees the stamp changed by
+    someone else drops all its pages, so a write in one worker or in the
+    ``flask`` CLI reaches the others on their next lookup.
+    """
+
+    csrf_placeholder = "\x00csrf-token\x00"
+
+    def __init__(self, app=None, stamp=None):
+        self.stamp = stamp
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_PAGE_CACHE", False)
+        app.config.setdefault("BLOG_PAGE_CACHE_SIZE", 500)
+        app.config.setdefault("BLOG_PAGE_CACHE_TIMEOUT", 300)
+        app.extensions["blog_page_cache"] = _PageCacheState()
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_page_cache"]
+
+    def cached(self, *tags):
+        """Cache the view, ``tags`` are formatted with the view arguments."""
+
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self._cacheable():
+                    return f(*args, **kwargs)
+                key = self._make_key()
+                self._check_stamp()
+                entry = self._state.get(key)
+                if entry is not None:
+                    return self._make_response(entry)
+                g.blog_page_cache_storing = True
+                response = current_app.make_response(f(*args, **kwargs))
+                if self._storable(response):
+                    self._store(key, response, [t.format(**kwargs) for t in tags])
+                response.headers["X-Cache"] = "MISS"
+                return response
+
+            return decorated
+
+        return decorator
+
+    @property
+    def storing(self):
+        """Whether the view being run renders a page that will be stored."""
+        return g.get("blog_page_cache_storing", False)
+
+    def evict(self, *tags):
+        self._check_stamp()
+        state = self._state
+        with state.lock:
+            for tag in tags:
+                for key in state.tags.pop(tag, ()):
+                    entry = state.entries.pop(key, None)
+                    if entry is not None:
+                        state.invalidations += 1
+                        state.untag(key, entry)
+        self._bump_stamp()
+
+    def clear(self):
+        self._state.clear()
+        self._bump_stamp()
+
+    def _check_stamp(self):
+        """Drop every page if another process has written since we looked."""
+        if self.stamp is None:
+            return
+        state = self._state
+        stamp = self.stamp.get()
+        if stamp != state.stamp:
+            state.clear()
+            state.stamp = stamp
+
+    def _bump_stamp(self):
+        if self.stamp is not None:
+            self.stamp.bump()
+            # 本进程已经清除了受影响的页面，其余页面在新的版本下仍然有效
+            self._state.stamp = self.stamp.get()
+
+    def stats(self):
+        state = self._state
+        lookups = state.hits + state.misses
+        return dict(
+            size=len(state.entries),
+            max_size=current_app.config["BLOG_PAGE_CACHE_SIZE"],
+            hits=state.hits,
+            misses=state.misses,
+            hit_rate=state.hits / lookups if lookups else 0.0,
+            evictions=state.evictions,
+            invalidations=state.invalidations,
+        )
+
+    def _cacheable(self):
+        return (
+            current_app.config["BLOG_PAGE_CACHE"]
+            and request.method == "GET"
+            and "_flashes" not in session
+            and not current_user.is_authenticated
+        )
+
+    def _make_key(self):
+        return (
+            request.path,
+            request.query_string,
+            request.cookies.get("theme"),
+        )
+
+    def _storable(self, response):
+        return (
+            response.status_code == 200
+            and not response.is_streamed
+            and "Set-Cookie" not in response.headers
+            and "_flashes" not in session
+        )
+
+    def _store(self, key, response, tags):
+        body = response.get_data()
+        token = g.get(self._csrf_field)
+        if token:
+            # 表单里的 CSRF 令牌属于当前用户，缓存时换成占位符，命中时再生成
+            body = body.replace(token.encode(), self.csrf_placeholder.encode())
+        headers = [
+            (k, v)
+            for k, v in response.headers
+            if k not in ("Set-Cookie", "Content-Length")
+        ]
+        entry = _PageEntry(
+            response.status_code,
+            headers,
+            body,
+            time.monotonic() + current_app.config["BLOG_PAGE_CACHE_TIMEOUT"],
+            bool(token),
+        )
+        self._state.put(key, entry, tags, current_app.config["BLOG_PAGE_CACHE_SIZE"])
+
+    def _make_response(self, entry):
+        body = entry.body
+        if entry.has_csrf:
+            body = body.replace(
+                self.csrf_placeholder.encode(), generate_csrf().encode()
+            )
+        response = current_app.response_class(
+            body, status=entry.status, headers=entry.headers
+        )
+        if not entry.has_csrf:
+            # 每次命中的令牌都不同，带令牌的页面不能复用压缩结果
+            response.compressed_cache = entry.encoded
+        response.headers["X-Cache"] = "HIT"
+        return response
+
+    @property
+    def _csrf_field(self):
+        return current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+
+
+def post_page_tags(post, categories=()):
+    """Tags of the cached pages that show ``post``.
+
+    Pass the categories the post used to belong to when they changed.
+    """
+    tags = {"index", "post:%d" % post.id}
+    for category in list(post.categories) + list(categories):
+        tags.add("category:%d" % category.id)
+    return tags
+
+
+class _PageEntry(object):
+    __slots__ = ("status", "headers", "body", "expires", "has_csrf", "tags", "encoded")
+
+    def __init__(self, status, headers, body, expires, has_csrf):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.has_csrf = has_csrf
+        self.tags = ()
+        # 压缩后的正文，按编码保存
+        self.encoded = {}
+
+
+class _PageCacheState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tags = {}
+        # 当前页面对应的共享版本
+        self.stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.tags.clear()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                del self.entries[key]
+                self.untag(key, entry)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, tags, max_size):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.untag(key, old)
+            entry.tags = tuple(tags)
+            self.entries[key] = entry
+            for tag in entry.tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > max_size:
+                old_key, old = self.entries.popitem(last=False)
+                self.untag(old_key, old)
+                self.evictions += 1
+
+    def untag(self, key, entry):
+        for tag in entry.tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
@@ -0,0 +1,132 @@
+import gzip
+import zlib
+
+from flask import current_app, request
+
+from myblog.assets import brotli
+
+
+class Compress(object):
+    """Compress HTML, JSON and XML responses with brotli or gzip.
+
+    Bodies under ``BLOG_COMPRESS_MIN_SIZE`` bytes are left alone, streamed
+    responses are compressed chunk by chunk and flushed so they still
+    stream.  A response can carry a ``compressed_cache`` dict, then the
+    compressed bytes are kept there per encoding and reused the next time
+    the same cached body is sent.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_COMPRESS", True)
+        app.config.setdefault("BLOG_COMPRESS_MIN_SIZE", 500)
+        app.config.setdefault("BLOG_COMPRESS_LEVEL", 6)
+        app.config.setdefault("BLOG_COMPRESS_BR_QUALITY", 4)
+        app.config.setdefault(
+            "BLOG_COMPRESS_MIMETYPES",
+            [
+                "text/html",
+                "text/xml",
+                "application/xml",
+                "application/atom+xml",
+                "application/json",
+            ],
+        )
+        if app.config["BLOG_COMPRESS"]:
+            app.after_request(self.compress_response)
+
+    def compress_response(self, response):
+        if not self._compressible(response):
+            return response
+        # 不管这次是否压缩，缓存都要按 Accept-Encoding 区分
+        response.vary.add("Accept-Encoding")
+        encoding = self._negotiate()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            original = response.response
+            response.response = self._compress_stream(
+                response.iter_encoded(), original, encoding
+            )
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < current_app.config["BLOG_COMPRESS_MIN_SIZE"]:
+                return response
+            cache = getattr(response, "compressed_cache", None)
+            body = cache.get(encoding) if cache is not None else None
+            if body is None:
+                body = self.compress(data, encoding)
+                if cache is not None:
+                    cache[encoding] = body
+            response.set_data(body)
+
+        response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag("%s-%s" % (etag, encoding), weak)
+        return response
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(
+                data, quality=current_app.config["BLOG_COMPRESS_BR_QUALITY"]
+            )
+        return gzip.compress(data, current_app.config["BLOG_COMPRESS_LEVEL"])
+
+    def _compressible(self, response):
+        return (
+            200 <= response.status_code < 300
+            and response.status_code not in (204, 206)
+            and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers
+            and response.mimetype in current_app.config["BLOG_COMPRESS_MIMETYPES"]
+        )
+
+    @staticmethod
+    def _negotiate():
+        accept = request.accept_encodings
+        candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+        best = accept.best_match(candidates)
+        return best if best and accept[best] > 0 else None
+
+    def _compress_stream(self, chunks, original, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(
+                quality=current_app.config["BLOG_COMPRESS_BR_QUALITY"]
+            )
+
+            def compress(chunk):
+                return compressor.process(chunk) + compressor.flush()
+
+            finish = compressor.finish
+        else:
+            # wbits 加 16 输出 gzip 格式
+            compressor = zlib.compressobj(
+                current_app.config["BLOG_COMPRESS_LEVEL"],
+                zlib.DEFLATED,
+                zlib.MAX_WBITS | 16,
+            )
+
+            def compress(chunk):
+                return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+            finish = compressor.flush
+
+        def generate():
+            try:
+                for chunk in chunks:
+                    # 每块都 flush，客户端能及时收到已经渲染的部分
+                    data = compress(chunk)
+                    if data:
+                        yield data
+                yield finish()
+            finally:
+                if hasattr(original, "close"):
+                    original.close()
+
+        return generate()
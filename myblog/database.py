@@ -0,0 +1,150 @@
+import random
+
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy import (
+    SQLAlchemy,
+    SignallingSession,
+    _EngineDebuggingSignalEvents,
+    _record_queries,
+)
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from myblog.caching import filling_cache
+
+_PRAGMAS = "blog_sqlite_pragmas"
+
+# 写入后带着这个 cookie 的请求都读主库，直到副本追上
+PRIMARY_COOKIE = "blog_primary"
+
+# 请求里提交过事务时 environ 里有这个键
+WRITTEN_ENVIRON_KEY = "myblog.db_written"
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with our engine profile and read replicas.
+
+    SQLite files get a small connection pool and ``BLOG_SQLITE_PRAGMAS`` on
+    every new connection, MySQL gets ``BLOG_DB_POOL_SIZE``,
+    ``BLOG_DB_POOL_RECYCLE`` and a ping before a pooled connection is used.
+    When ``BLOG_DB_REPLICAS`` lists database URLs, GET requests to the
+    blueprints in ``BLOG_DB_READ_BLUEPRINTS`` read from a random replica,
+    everything else, and every flush, goes to the primary.  So do reads
+    that fill a cache, which would otherwise keep a lagging copy around,
+    and for ``BLOG_DB_PRIMARY_AFTER_WRITE`` seconds the requests of a
+    client that has just written, so it sees its own changes.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_SQLITE_PRAGMAS", {})
+        app.config.setdefault("BLOG_DB_POOL_SIZE", 10)
+        app.config.setdefault("BLOG_DB_POOL_RECYCLE", 3600)
+        app.config.setdefault("BLOG_DB_REPLICAS", [])
+        app.config.setdefault("BLOG_DB_READ_BLUEPRINTS", ["blog"])
+        app.config.setdefault("BLOG_DB_PRIMARY_AFTER_WRITE", 10)
+        app.extensions["blog_replicas"] = None
+        super().init_app(app)
+
+        @app.after_request
+        def stick_to_primary(response):
+            seconds = app.config["BLOG_DB_PRIMARY_AFTER_WRITE"]
+            written = request.environ.get(WRITTEN_ENVIRON_KEY, False)
+            if written and seconds and app.config["BLOG_DB_REPLICAS"]:
+                response.set_cookie(PRIMARY_COOKIE, "1", max_age=seconds, httponly=True)
+            return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if sa_url.drivername.startswith("mysql"):
+            options.setdefault("pool_size", app.config["BLOG_DB_POOL_SIZE"])
+            # 比 MySQL 和中间代理的空闲超时短，避免拿到已经被断开的连接
+            options.setdefault("pool_recycle", app.config["BLOG_DB_POOL_RECYCLE"])
+            options.setdefault("pool_pre_ping", True)
+        elif sa_url.drivername == "sqlite" and sa_url.database not in (
+            None,
+            "",
+            ":memory:",
+        ):
+            # 默认的 NullPool 每个请求都重新打开文件，页缓存和 mmap 也跟着丢掉
+            options.setdefault("poolclass", QueuePool)
+            options.setdefault("pool_size", 5)
+            options.setdefault("connect_args", {})["check_same_thread"] = False
+        if sa_url.drivername == "sqlite":
+            # create_engine 拿不到 app，经 options 传过去
+            options[_PRAGMAS] = app.config["BLOG_SQLITE_PRAGMAS"]
+        return super().apply_driver_hacks(app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop(_PRAGMAS, None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas:
+
+            @event.listens_for(engine, "connect")
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas.items():
+                    cursor.execute("PRAGMA %s = %s" % (name, value))
+                cursor.close()
+
+        return engine
+
+    def get_replica(self, app=None):
+        """A random replica engine, None if there are none."""
+        app = self.get_app(app)
+        engines = app.extensions["blog_replicas"]
+        if engines is None:
+            engines = app.extensions["blog_replicas"] = [
+                self._create_replica(app, uri) for uri in app.config["BLOG_DB_REPLICAS"]
+            ]
+        return random.choice(engines) if engines else None
+
+    def dispose(self, app=None):
+        """Close the pooled connections of every engine, e.g. after a fork."""
+        app = self.get_app(app)
+        self.get_engine(app).dispose()
+        for engine in app.extensions["blog_replicas"] or ():
+            engine.dispose()
+
+    def _create_replica(self, app, uri):
+        # 和主库的引擎一样经过 Flask-SQLAlchemy 的参数处理
+        sa_url = make_url(uri)
+        options = {}
+        self.apply_pool_defaults(app, options)
+        self.apply_driver_hacks(app, sa_url, options)
+        options.update(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+        engine = self.create_engine(sa_url, options)
+        if _record_queries(app):
+            _EngineDebuggingSignalEvents(engine, app.import_name).register()
+        return engine
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and _reads_from_replica():
+            replica = self.db.get_replica(self.app)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause)
+
+    def commit(self):
+        super().commit()
+        if has_request_context():
+            request.environ[WRITTEN_ENVIRON_KEY] = True
+
+
+def _reads_from_replica():
+    return (
+        has_request_context()
+        and request.method in ("GET", "HEAD")
+        and request.blueprint in current_app.config["BLOG_DB_READ_BLUEPRINTS"]
+        and not request.environ.get(WRITTEN_ENVIRON_KEY, False)
+        and PRIMARY_COOKIE not in request.cookies
+        and not filling_cache()
+    )
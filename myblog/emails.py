@@ -1,21 +1,180 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
 from flask import url_for, current_app, render_template
 from flask_mail import Message
 from myblog.extensions import mail
-from threading import Thread
+
+_STOP = object()
+
+
+class EmailQueue(object):
+    """A bounded pool of worker threads sending mail in the background.
+
+    Each worker keeps its SMTP connection open between messages and closes
+    it after ``BLOG_MAIL_IDLE_TIMEOUT`` seconds without work.  A failed send
+    is retried with exponential backoff and logged when it gives up.  When
+    the queue is full new messages are dropped and logged rather than
+    blocking the request.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_MAIL_WORKERS", 2)
+        app.config.setdefault("BLOG_MAIL_QUEUE_SIZE", 100)
+        app.config.setdefault("BLOG_MAIL_RETRIES", 3)
+        app.config.setdefault("BLOG_MAIL_RETRY_DELAY", 2)
+        app.config.setdefault("BLOG_MAIL_IDLE_TIMEOUT", 60)
+        app.extensions["email_queue"] = _EmailWorkers(app)
+
+    @property
+    def _workers(self):
+        return current_app.extensions["email_queue"]
+
+    def send(self, message):
+        return self._workers.submit(message)
+
+    @property
+    def depth(self):
+        """Messages waiting to be sent."""
+        return self._workers.queue.qsize()
+
+    def stats(self):
+        workers = self._workers
+        return dict(
+            depth=workers.queue.qsize(),
+            sent=workers.sent,
+            retried=workers.retried,
+            failed=workers.failed,
+            dropped=workers.dropped,
+        )
+
+    def join(self):
+        """Block until every queued message has been handled."""
+        self._workers.queue.join()
+
+    def shutdown(self, timeout=None):
+        self._workers.shutdown(timeout)
+
+
+class _EmailWorkers(object):
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.pid = None
+        self.threads = []
+        self.queue = queue.Queue(app.config["BLOG_MAIL_QUEUE_SIZE"])
+        self.sent = self.retried = self.failed = self.dropped = 0
+
+    def submit(self, message):
+        self._start()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            self.app.logger.error(
+                "Email queue is full, dropped message %r to %s",
+                message.subject,
+                message.recipients,
+            )
+            return False
+        return True
+
+    def _start(self):
+        # fork 之后子进程里没有线程，需要重新启动
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                self.queue = queue.Queue(self.app.config["BLOG_MAIL_QUEUE_SIZE"])
+            self.threads = [
+                threading.Thread(target=self._work, name="email-worker-%d" % i)
+                for i in range(self.app.config["BLOG_MAIL_WORKERS"])
+            ]
+            for thread in self.threads:
+                thread.daemon = True
+                thread.start()
+            if self.pid is None:
+                atexit.register(self.shutdown)
+            self.pid = os.getpid()
+
+    def shutdown(self, timeout=None):
+        """Send what is queued, then stop the workers."""
+        with self.lock:
+            threads, self.threads = self.threads, []
+            if self.pid != os.getpid():
+                return
+            self.pid = None
+            for _ in threads:
+                self.queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _work(self):
+        idle_timeout = self.app.config["BLOG_MAIL_IDLE_TIMEOUT"]
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    message = self.queue.get(timeout=idle_timeout)
+                except queue.Empty:
+                    connection = self._close(connection)
+                    continue
+                try:
+                    if message is _STOP:
+                        self._close(connection)
+                        return
+                    connection = self._deliver(connection, message)
+                finally:
+                    self.queue.task_done()
+
+    def _deliver(self, connection, message):
+        retries = self.app.config["BLOG_MAIL_RETRIES"]
+        delay = self.app.config["BLOG_MAIL_RETRY_DELAY"]
+        for attempt in range(retries + 1):
+            try:
+                if connection is None:
+                    connection = mail.connect().__enter__()
+                connection.send(message)
+                self.sent += 1
+                return connection
+            except Exception:
+                connection = self._close(connection)
+                if attempt == retries:
+                    self.failed += 1
+                    self.app.logger.exception(
+                        "Failed to send email %r to %s",
+                        message.subject,
+                        message.recipients,
+                    )
+                    return None
+                self.retried += 1
+                time.sleep(delay * 2**attempt)
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
 
 
-def _send_async_email(app, message):
-    with app.app_context():
-        mail.send(message)
+email_queue = EmailQueue()
 
 
 def send_email(subject, to, html):
-    app = current_app._get_current_object()
     message = Message(subject=subject, recipients=[to], html=html)
-    # mail.send(message)
-    thr = Thread(target=_send_async_email, args=(app, message))
-    thr.start()
-    return thr
+    return email_queue.send(message)
 
 
 def send_new_comment_email(post):
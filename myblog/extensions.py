@@ -1,27 +1,60 @@
+import hmac
+
 from flask_bootstrap import Bootstrap
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from flask_ckeditor import CKEditor
 from flask_login import LoginManager
 from flask_wtf import CSRFProtect
-from flask_migrate import Migrate
 
-db = SQLAlchemy()
+from myblog.assets import Assets
+from myblog.caching import Cache, PageCache, SharedStamp
+from myblog.compression import Compress
+from myblog.database import RoutingSQLAlchemy
+from myblog.lazy import LazyMigrate, LazyMoment
+from myblog.metrics import Metrics
+from myblog.profiling import QueryStats
+from myblog.ratelimit import RateLimiter
+
+db = RoutingSQLAlchemy()
 bootstrap = Bootstrap()
 mail = Mail()
-moment = Moment()
+moment = LazyMoment()
 ckeditor = CKEditor()
 login_manager = LoginManager()
 csrf = CSRFProtect()
-migrate = Migrate()
+migrate = LazyMigrate()
+cache = Cache()
+user_stamp = SharedStamp("user")
+site_stamp = SharedStamp("site")
+page_cache = PageCache(stamp=site_stamp)
+query_stats = QueryStats()
+metrics = Metrics()
+assets = Assets()
+compress = Compress()
+ratelimiter = RateLimiter()
 
 
 @login_manager.user_loader
 def load_user(user_id):
+    # 会话里是 "id:密码指纹"，见 Admin.get_id
+    admin_id, _, fingerprint = user_id.partition(":")
+    if not admin_id.isdigit():
+        return None
+    user = cache.get_or_set(
+        cache.key("admin", user_stamp.get(), admin_id), lambda: _load_admin(admin_id)
+    )
+    if user is None or not hmac.compare_digest(fingerprint, user.password_fingerprint):
+        return None
+    return user
+
+
+def _load_admin(admin_id):
     from myblog.models import Admin
 
-    user = Admin.query.get(int(user_id))
+    user = Admin.query.get(int(admin_id))
+    if user is not None:
+        # 缓存的对象在多个请求间共用，不能留在某个请求的 session 里；要修改时重新查询
+        db.session.expunge(user)
     return user
 
 
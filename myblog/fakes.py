@@ -1,13 +1,38 @@
 import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
 from faker import Faker
-from sqlalchemy.exc import IntegrityError
 
-from myblog.models import Admin, Category, Post, Comment, Link
+from myblog.models import (
+    Admin,
+    Category,
+    Post,
+    Comment,
+    Link,
+    category_post_table,
+    update_counters,
+)
 from myblog.extensions import db
 
 fake = Faker()
 
+# flask forge --scale 的预设，数字是分类、文章和审核通过的评论数，
+# 另外还会生成 10% 的待审核评论、10% 的管理员评论和 10% 的回复
+SCALES = {
+    "small": dict(category=10, post=50, comment=500),
+    "medium": dict(category=20, post=1000, comment=10000),
+    "large": dict(category=30, post=5000, comment=100000),
+    "huge": dict(category=50, post=20000, comment=1000000),
+}
+
+
+def seed(value):
+    """Make the following fakes reproducible."""
+    Faker.seed(value)
+    random.seed(value)
+
 
 def fake_admin():
     admin = Admin(
@@ -23,91 +48,153 @@ def fake_admin():
 
 
 def fake_categories(count=10):
-    category = Category(name="Default")
-    db.session.add(category)
-
-    for i in range(count):
-        category = Category(name=fake.word())
-        db.session.add(category)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-
-
-def fake_posts(count=50):
-    for i in range(count):
-        post = Post(
-            title=fake.sentence(),
-            body=fake.text(2000),
-            # category=Category.query.get(random.randint(1, Category.query.count())),
-            timestamp=fake.date_time_this_year(),
-        )
-        post.categories.extend(
-            set(
-                random.choices(
-                    Category.query.all(),
-                    k=random.randint(1, Category.query.count() // 3),
-                )
-            )
-        )
-        db.session.add(post)
+    names = {"Default"}
+    # 分类名不能重复，最多尝试 count * 10 次
+    for i in range(count * 10):
+        if len(names) > count:
+            break
+        names.add(fake.word())
+    names.discard("Default")
+    db.session.execute(
+        Category.__table__.insert(),
+        [dict(name="Default", post_count=0)]
+        + [dict(name=name, post_count=0) for name in sorted(names)],
+    )
     db.session.commit()
 
 
-def fake_comments(count=500):
-    for i in range(count):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=True,
-            post=Post.query.get(random.randint(1, Post.query.count())),
-        )
-        db.session.add(comment)
-
-    salt = int(count * 0.1)
-    for i in range(salt):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=False,
-            post=Post.query.get(random.randint(1, Post.query.count())),
+def _time_range(now):
+    return now - timedelta(days=365), now
+
+
+def _post_rows(args):
+    start_id, count, seed_value, now = args
+    faker = Faker()
+    faker.seed_instance(seed_value)
+    start, end = _time_range(now)
+    rows = []
+    for i in range(start_id, start_id + count):
+        body = faker.text(2000)
+        rows.append(
+            dict(
+                id=i,
+                title=faker.sentence()[:60],
+                body=body,
+                excerpt=Post.make_excerpt(body),
+                private=False,
+                can_comment=True,
+                timestamp=faker.date_time_between(start, end),
+                comment_count=0,
+                reviewed_comment_count=0,
+            )
         )
-        db.session.add(comment)
-
-        # 管理员发表的评论
-        comment = Comment(
-            author="Mima Kirigoe",
-            email="Mima@example.com",
-            site="example.com",
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            from_admin=True,
+    return rows
+
+
+def _comment_rows(args):
+    start_id, count, seed_value, now = args
+    faker = Faker()
+    faker.seed_instance(seed_value)
+    start, end = _time_range(now)
+    return [
+        dict(
+            id=i,
+            author=faker.name()[:30],
+            email=faker.email(),
+            site=faker.url(),
+            body=faker.sentence(),
+            timestamp=faker.date_time_between(start, end),
             reviewed=True,
-            post=Post.query.get(random.randint(1, Post.query.count())),
+            from_admin=False,
         )
-        db.session.add(comment)
+        for i in range(start_id, start_id + count)
+    ]
+
+
+def _generate(make_rows, first_id, count, chunk, pool, now):
+    """Yield chunks of rows, the same for a seed whatever the pool size."""
+    jobs = [
+        (first_id + i, min(chunk, count - i), random.getrandbits(32), now)
+        for i in range(0, count, chunk)
+    ]
+    if pool is None:
+        yield from map(make_rows, jobs)
+        return
+    # 只提前生成有限的几块，避免写库跟不上时占满内存
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.submit(make_rows, job))
+        if len(pending) >= 16:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def fake_posts(count=50, chunk=1000, pool=None, now=None):
+    now = now or datetime.utcnow()
+    category_ids = [i for i, in db.session.query(Category.id)]
+    first_id = _next_id(Post)
+    for rows in _generate(_post_rows, first_id, count, chunk, pool, now):
+        db.session.execute(Post.__table__.insert(), rows)
+        links = []
+        # 没有分类时文章不属于任何分类
+        for row in rows if category_ids else ():
+            k = random.randint(1, max(len(category_ids) // 3, 1))
+            for category_id in set(random.choices(category_ids, k=k)):
+                links.append(dict(category_id=category_id, post_id=row["id"]))
+        if links:
+            db.session.execute(category_post_table.insert(), links)
+        db.session.commit()
+    update_counters(post_ids=(), category_ids=None)
     db.session.commit()
 
+
+def fake_comments(count=500, chunk=5000, pool=None, now=None):
+    now = now or datetime.utcnow()
+    post_ids = [i for i, in db.session.query(Post.id)]
+    if not post_ids:
+        # 评论必须属于某篇文章
+        return
+    first_id = _next_id(Comment)
+    salt = int(count * 0.1)
+
+    def insert(rows):
+        db.session.execute(Comment.__table__.insert(), rows)
+        db.session.commit()
+
+    # 记下每条评论所属的文章，回复要和被回复的评论在同一篇文章下
+    comment_posts = []
+    for rows in _generate(_comment_rows, first_id, count + salt * 2, chunk, pool, now):
+        for row in rows:
+            row["post_id"] = random.choice(post_ids)
+            comment_posts.append(row["post_id"])
+            n = row["id"] - first_id
+            if n >= count + salt:
+                # 管理员发表的评论
+                row.update(
+                    author="Mima Kirigoe",
+                    email="Mima@example.com",
+                    site="example.com",
+                    from_admin=True,
+                )
+            elif n >= count:
+                row["reviewed"] = False
+        insert(rows)
+
     # 回复
-    for i in range(salt):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=True,
-            replied=Comment.query.get(random.randint(1, Comment.query.count())),
-            post=Post.query.get(random.randint(1, Post.query.count())),
-        )
-        db.session.add(comment)
+    next_id = first_id + len(comment_posts)
+    for rows in _generate(_comment_rows, next_id, salt, chunk, pool, now):
+        for row in rows:
+            n = random.randrange(len(comment_posts))
+            row["replied_id"] = first_id + n
+            row["post_id"] = comment_posts[n]
+        insert(rows)
+
+    update_counters(post_ids=None, category_ids=())
     db.session.commit()
 
 
@@ -118,3 +205,8 @@ def fake_links():
     google = Link(name="Google+", url="#")
     db.session.add_all([twitter, facebook, linkedin, google])
     db.session.commit()
+
+
+def make_pool(workers):
+    """A process pool for the Faker calls, or None to generate in-process."""
+    return ProcessPoolExecutor(workers) if workers > 1 else None
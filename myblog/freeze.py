@@ -0,0 +1,265 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from flask import url_for
+
+from myblog.assets import write_compressed
+from myblog.extensions import db
+from myblog.models import Admin, Category, Comment, Link, Post, category_post_table
+from myblog.pagination import is_thread_root
+
+MANIFEST = ".freeze.json"
+
+# 导出时请求的 environ 里带上这个键，模板据此生成页码链接、隐藏评论表单
+ENVIRON_KEY = "myblog.freeze"
+
+# 几千个页面都要压缩，brotli 用中等质量
+BROTLI_QUALITY = 6
+
+# 每个任务渲染的页面数
+BATCH_SIZE = 50
+
+_app = None
+
+
+def freeze_site(
+    app, output, base_url="http://localhost/", workers=1, full=False, echo=None
+):
+    """Render every public page as an anonymous reader into ``output``.
+
+    A page is written to ``<url>/index.html`` next to ``.gz`` and ``.br``
+    copies, so nginx can serve GET requests without a query string with
+    ``try_files $uri/index.html @app`` and ``gzip_static``/``brotli_static``,
+    and pass everything else (forms, cursor links, search) to the app.
+
+    Each page gets a fingerprint of the rows it shows, stored in a manifest.
+    Later runs only render pages whose fingerprint changed and remove the
+    ones that are gone, ``full`` renders everything, e.g. after a template
+    change.  Returns ``(rendered, unchanged, removed, failed)`` where
+    ``failed`` lists ``(url, status)``.  More than one worker needs
+    ``fork``, the workers inherit ``app``, so it is not available on Windows.
+    """
+    global _app
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        raise ValueError("Rendering in several processes needs os.fork().")
+    echo = echo or (lambda message: None)
+    old = {} if full else load_manifest(output)
+    with app.test_request_context(base_url=base_url):
+        pages = plan_pages(
+            app.config["BLOG_POST_PER_PAGE"], app.config["BLOG_COMMENT_PER_PAGE"]
+        )
+    db.session.remove()
+
+    todo = [
+        url
+        for url, fingerprint in pages.items()
+        if old.get(url) != fingerprint or not os.path.exists(page_path(output, url))
+    ]
+    echo("%d pages, %d to render..." % (len(pages), len(todo)))
+
+    _app = app
+    if workers > 1:
+        # 子进程要继承 _app，不管平台默认的启动方式（macOS 上是 spawn）都用 fork
+        pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+        )
+    else:
+        # 单独的线程里每个请求有自己的应用上下文，查询记录和 session 不会越积越多
+        pool = ThreadPoolExecutor(1)
+    failed = []
+    done = 0
+    try:
+        batches = [todo[i : i + BATCH_SIZE] for i in range(0, len(todo), BATCH_SIZE)]
+        jobs = [pool.submit(_render, output, base_url, batch) for batch in batches]
+        for job in jobs:
+            for url, status in job.result():
+                if status != 200:
+                    failed.append((url, status))
+                    pages.pop(url)
+            done += BATCH_SIZE
+            echo("  %d/%d" % (min(done, len(todo)), len(todo)))
+    finally:
+        pool.shutdown()
+        _app = None
+
+    # 渲染失败的页面保留上次导出的文件
+    removed = [url for url in old if url not in pages and url not in dict(failed)]
+    for url in removed:
+        path = page_path(output, url)
+        for suffix in ("", ".gz", ".br"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    # 渲染失败的页面不记录，下次重新渲染
+    save_manifest(output, pages)
+    return (
+        len(todo) - len(failed),
+        len(pages) - len(todo) + len(failed),
+        removed,
+        failed,
+    )
+
+
+def plan_pages(per_page, comment_per_page):
+    """Map the URL of every public page to a fingerprint of its content.
+
+    Needs a request context for ``url_for``.  List pages depend on the
+    summaries of the posts they show, post pages on the whole post and its
+    reviewed comments, and every page on the sidebar data, so a new post
+    changes every page through the category counts.
+    """
+    site = _site_fingerprint()
+    public = Post.private.isnot(True)
+
+    # 评论按楼层分页，页数由顶层评论数决定
+    parent = db.aliased(Comment)
+    comments = {
+        row.post_id: (row.threads, row.count, row.last_id, row.last_time.isoformat())
+        for row in db.session.query(
+            Comment.post_id,
+            db.func.sum(db.case([(is_thread_root(parent), 1)], else_=0)).label(
+                "threads"
+            ),
+            db.func.count(Comment.id).label("count"),
+            db.func.max(Comment.id).label("last_id"),
+            db.func.max(Comment.timestamp).label("last_time"),
+        )
+        .outerjoin(parent, Comment.replied_id == parent.id)
+        .filter(Comment.reviewed == db.true())
+        .group_by(Comment.post_id)
+    }
+
+    post_categories = {}
+    members = {c: [] for c, in db.session.query(Category.id)}
+    for category_id, post_id in (
+        db.session.query(category_post_table.c.category_id, Post.id)
+        .join(Post, Post.id == category_post_table.c.post_id)
+        .filter(public)
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+    ):
+        post_categories.setdefault(post_id, []).append(category_id)
+        members.setdefault(category_id, []).append(post_id)
+
+    pages = {url_for("blog.about"): _digest(site)}
+    summaries = {}
+    ordered = []
+    query = (
+        db.session.query(
+            Post.id,
+            Post.title,
+            Post.excerpt,
+            Post.body,
+            Post.timestamp,
+            Post.can_comment,
+            Post.reviewed_comment_count,
+        )
+        .filter(public)
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+    )
+    for post in query.yield_per(1000):
+        summary = [
+            post.id,
+            post.title,
+            post.excerpt,
+            post.timestamp.isoformat(),
+            post.reviewed_comment_count,
+            sorted(post_categories.get(post.id, ())),
+        ]
+        summaries[post.id] = summary
+        ordered.append(post.id)
+        detail = [
+            site,
+            summary,
+            hashlib.md5((post.body or "").encode()).hexdigest(),
+            post.can_comment,
+            comments.get(post.id),
+        ]
+        count = comments.get(post.id, (0,))[0]
+        last = max((count + comment_per_page - 1) // comment_per_page, 1)
+        for page in range(1, last + 1):
+            url = url_for("blog.show_post", post_id=post.id, page=page)
+            pages[url] = _digest(detail + [page, last])
+
+    def list_pages(endpoint, post_ids, **values):
+        last = max((len(post_ids) + per_page - 1) // per_page, 1)
+        for page in range(1, last + 1):
+            items = post_ids[(page - 1) * per_page : page * per_page]
+            url = url_for(endpoint, page=page, **values)
+            pages[url] = _digest(
+                [site, page, page < last] + [summaries[i] for i in items]
+            )
+
+    list_pages("blog.index", ordered)
+    for category_id, post_ids in members.items():
+        list_pages("blog.show_category", post_ids, category_id=category_id)
+    return pages
+
+
+def page_path(output, url):
+    return os.path.join(output, *url.strip("/").split("/"), "index.html")
+
+
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            return json.load(f)["pages"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_manifest(output, pages):
+    os.makedirs(output, exist_ok=True)
+    tmp = os.path.join(output, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(
+            dict(time=datetime.utcnow().isoformat(), pages=pages),
+            f,
+            indent=1,
+            sort_keys=True,
+        )
+    os.replace(tmp, os.path.join(output, MANIFEST))
+
+
+def _site_fingerprint():
+    admin = db.session.query(
+        Admin.name, Admin.blog_title, Admin.blog_sub_title, Admin.about
+    ).first()
+    categories = db.session.query(Category.id, Category.name, Category.post_count)
+    links = db.session.query(Link.name, Link.url)
+    return _digest(
+        [
+            list(admin or ()),
+            sorted(list(c) for c in categories),
+            sorted(list(link) for link in links),
+        ]
+    )
+
+
+def _digest(value):
+    data = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def _init_worker():
+    # 不能和父进程共用数据库连接
+    db.dispose(_app)
+
+
+def _render(output, base_url, urls):
+    client = _app.test_client()
+    results = []
+    for url in urls:
+        response = client.get(url, base_url=base_url, environ_base={ENVIRON_KEY: True})
+        if response.status_code == 200:
+            write_compressed(
+                page_path(output, url), response.get_data(), BROTLI_QUALITY
+            )
+        results.append((url, response.status_code))
+        response.close()
+    return results
@@ -0,0 +1,66 @@
+from flask import current_app
+
+
+class LazyMoment(object):
+    """Flask-Moment, imported when the first template is rendered.
+
+    ``flask_moment`` pulls in ``distutils`` and with it ``pkg_resources``,
+    the largest import of a cold start.  With ``BLOG_LAZY_IMPORTS`` off it
+    is set up at once like any other extension.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_LAZY_IMPORTS", True)
+        if not app.config["BLOG_LAZY_IMPORTS"]:
+            from flask_moment import Moment
+
+            Moment(app)
+            return
+        app.context_processor(self.context_processor)
+
+    @staticmethod
+    def context_processor():
+        import flask_moment
+
+        # 和 Moment.init_app 一样，只是不能在处理过请求之后再注册上下文处理器
+        current_app.extensions.setdefault("moment", flask_moment._moment)
+        return flask_moment.Moment.context_processor()
+
+
+class LazyMigrate(object):
+    """Flask-Migrate, imported when a ``flask db`` command first needs it.
+
+    The commands find their settings in ``app.extensions["migrate"]``, in
+    lazy mode that is a stand-in which sets up Flask-Migrate and alembic on
+    the first attribute access.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault("BLOG_LAZY_IMPORTS", True)
+        if not app.config["BLOG_LAZY_IMPORTS"]:
+            from flask_migrate import Migrate
+
+            Migrate(app, db)
+            return
+        app.extensions["migrate"] = _DeferredMigrate(app, db)
+
+
+class _DeferredMigrate(object):
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+
+    def __getattr__(self, name):
+        from flask_migrate import Migrate
+
+        # 换成真正的配置，之后不再经过这里
+        Migrate(self.app, self.db)
+        return getattr(self.app.extensions["migrate"], name)
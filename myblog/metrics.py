@@ -0,0 +1,181 @@
+import ipaddress
+import os
+import time
+
+from flask import (
+    abort,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    before_render_template,
+    template_rendered,
+)
+from flask_login import current_user
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+from myblog.streaming import after_response
+
+MULTIPROC_ENV = "prometheus_multiproc_dir"
+
+
+class Metrics(object):
+    """Prometheus metrics for requests, SQL, templates and the mail queue.
+
+    With several gunicorn workers, point the ``prometheus_multiproc_dir``
+    environment variable at an empty directory before the workers start.
+    Each worker then writes its samples to files there and ``/metrics``
+    sums them, whichever worker answers.  Call
+    ``prometheus_client.multiprocess.mark_process_dead(worker.pid)`` from
+    gunicorn's ``child_exit`` hook so dead workers' gauges are dropped.
+
+    ``/metrics`` is open to the logged-in admin and to the networks in
+    ``BLOG_METRICS_ALLOWED_IPS``, empty by default: behind a reverse proxy
+    without ``BLOG_PROXY_FIX`` every request comes from the proxy's address.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, db):
+        app.config.setdefault("BLOG_METRICS", True)
+        app.config.setdefault("BLOG_METRICS_ALLOWED_IPS", [])
+        if not app.config["BLOG_METRICS"]:
+            return
+        app.extensions["blog_metrics"] = state = _MetricsState()
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._end_template, app)
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", self._start_query)
+        event.listen(engine, "after_cursor_execute", state.end_query)
+        app.add_url_rule("/metrics", "metrics", self.view)
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_metrics"]
+
+    def view(self):
+        if not self._allowed():
+            abort(403)
+        self._state.email_queue_depth()
+        if MULTIPROC_ENV in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = self._state.registry
+        return current_app.response_class(
+            generate_latest(registry), mimetype=CONTENT_TYPE_LATEST
+        )
+
+    def _allowed(self):
+        if current_user.is_authenticated:
+            return True
+        try:
+            address = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            return False
+        return any(
+            address in ipaddress.ip_network(network, strict=False)
+            for network in current_app.config["BLOG_METRICS_ALLOWED_IPS"]
+        )
+
+    @staticmethod
+    def _start_request():
+        g.metrics_start = time.perf_counter()
+
+    def _end_request(self, response):
+        # 流式响应的耗时算到最后一块发出为止
+        after_response(response, self._observe_request, response.status_code)
+        return response
+
+    def _observe_request(self, status_code):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "<unknown>"
+            state = self._state
+            state.latency.labels(endpoint, request.method).observe(
+                time.perf_counter() - start
+            )
+            state.responses.labels(endpoint, str(status_code)).inc()
+            state.email_queue_depth()
+
+    @staticmethod
+    def _start_template(sender, template, context, **extra):
+        g.setdefault("metrics_templates", []).append(time.perf_counter())
+
+    def _end_template(self, sender, template, context, **extra):
+        starts = g.get("metrics_templates")
+        if starts:
+            self._state.render_time.labels(template.name or "<string>").observe(
+                time.perf_counter() - starts.pop()
+            )
+
+    @staticmethod
+    def _start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+class _MetricsState(object):
+    def __init__(self):
+        # 每个应用一个 registry，多进程模式下数据写在文件里，与 registry 无关
+        self.registry = registry = CollectorRegistry()
+        self.latency = Histogram(
+            "blog_request_duration_seconds",
+            "Request latency.",
+            ["endpoint", "method"],
+            registry=registry,
+        )
+        self.responses = Counter(
+            "blog_responses_total",
+            "Responses by status code.",
+            ["endpoint", "status"],
+            registry=registry,
+        )
+        self.query_time = Histogram(
+            "blog_sql_query_duration_seconds",
+            "SQL statement duration.",
+            ["endpoint"],
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+            registry=registry,
+        )
+        self.render_time = Histogram(
+            "blog_template_render_seconds",
+            "Jinja template render time.",
+            ["template"],
+            registry=registry,
+        )
+        self.queue_depth = Gauge(
+            "blog_email_queue_depth",
+            "Emails waiting to be sent.",
+            multiprocess_mode="livesum",
+            registry=registry,
+        )
+
+    def end_query(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        endpoint = "<none>"
+        if has_request_context():
+            endpoint = request.endpoint or "<unknown>"
+        # Histogram 自带 _count，就是语句数
+        self.query_time.labels(endpoint).observe(duration)
+
+    def email_queue_depth(self):
+        from myblog.emails import email_queue
+
+        self.queue_depth.set(email_queue.depth)
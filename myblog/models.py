@@ -1,7 +1,12 @@
+import hashlib
 from datetime import datetime
 
+from sqlalchemy import inspect
+from sqlalchemy.orm.util import identity_key
+
 from myblog.extensions import db
 from flask_login import UserMixin
+from markupsafe import Markup
 
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -21,6 +26,14 @@ class Admin(db.Model, UserMixin):
     def validate_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @property
+    def password_fingerprint(self):
+        return hashlib.sha256((self.password_hash or "").encode()).hexdigest()[:16]
+
+    def get_id(self):
+        # 改密码后已有的会话和“记住我”的 cookie 都对不上，需要重新登录
+        return "%d:%s" % (self.id, self.password_fingerprint)
+
 
 category_post_table = db.Table(
     "category_post",
@@ -32,6 +45,7 @@ category_post_table = db.Table(
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique=True)
+    post_count = db.Column(db.Integer, default=0)
     # posts = db.relationship('Post', back_populates='category')
     posts = db.relationship(
         "Post", secondary=category_post_table, back_populates="categories"
@@ -40,7 +54,9 @@ class Category(db.Model):
     def delete(self):
         default_category = Category.query.get(1)
         for post in self.posts:
-            post.category = default_category
+            # 只属于该分类的文章移到默认分类下
+            if len(post.categories) == 1:
+                post.categories.append(default_category)
         db.session.delete(self)
         db.session.commit()
 
@@ -49,9 +65,14 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(60))
     body = db.Column(db.Text)
+    # 列表页只显示摘要，在修改正文时生成，列表查询可以不加载正文
+    excerpt = db.Column(db.String(300))
+    body_length = db.column_property(db.func.length(body), deferred=True)
     private = db.Column(db.Boolean, default=False)
     can_comment = db.Column(db.Boolean, default=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    comment_count = db.Column(db.Integer, default=0)
+    reviewed_comment_count = db.Column(db.Integer, default=0)
     # category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     # category = db.relationship('Category', back_populates='posts')
     categories = db.relationship(
@@ -61,6 +82,14 @@ class Post(db.Model):
         "Comment", back_populates="post", cascade="all, delete-orphan"
     )
 
+    @staticmethod
+    def make_excerpt(body, length=255):
+        # 与 Jinja 的 striptags|truncate 结果一致
+        text = Markup(body or "").striptags()
+        if len(text) <= length + 5:
+            return text
+        return text[: length - 3].rsplit(" ", 1)[0] + "..."
+
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -71,9 +100,9 @@ class Comment(db.Model):
     from_admin = db.Column(db.Boolean, default=False)
     reviewed = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    post_id = db.Column(db.Integer, db.ForeignKey("post.id"))
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id"), index=True)
     post = db.relationship("Post", back_populates="comments")
-    replied_id = db.Column(db.Integer, db.ForeignKey("comment.id"))
+    replied_id = db.Column(db.Integer, db.ForeignKey("comment.id"), index=True)
     replied = db.relationship("Comment", back_populates="replies", remote_side=[id])
     replies = db.relationship("Comment", back_populates="replied", cascade="all")
 
@@ -82,3 +111,170 @@ class Link(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30))
     url = db.Column(db.String(255))
+
+
+@db.event.listens_for(Post.body, "set")
+def _update_excerpt(post, value, oldvalue, initiator):
+    post.excerpt = Post.make_excerpt(value)
+
+
+def update_counters(post_ids=None, category_ids=None, session=None):
+    """Recompute the denormalized counters from the related rows.
+
+    ``None`` means every row, an empty collection means nothing to do.
+    """
+    session = session or db.session
+    post, comment = Post.__table__, Comment.__table__
+    if post_ids is None or post_ids:
+        comments = db.select([db.func.count(comment.c.id)]).where(
+            comment.c.post_id == post.c.id
+        )
+        stmt = post.update().values(
+            comment_count=comments.as_scalar(),
+            reviewed_comment_count=comments.where(
+                comment.c.reviewed == db.true()
+            ).as_scalar(),
+        )
+        if post_ids is not None:
+            stmt = stmt.where(post.c.id.in_(post_ids))
+        session.execute(stmt)
+
+    category = Category.__table__
+    if category_ids is None or category_ids:
+        stmt = category.update().values(
+            post_count=db.select([db.func.count()])
+            .where(category_post_table.c.category_id == category.c.id)
+            .as_scalar()
+        )
+        if category_ids is not None:
+            stmt = stmt.where(category.c.id.in_(category_ids))
+        session.execute(stmt)
+
+
+def approve_comments(criterion, session=None):
+    """Mark the pending comments matching ``criterion`` as reviewed.
+
+    Runs as one ``UPDATE`` and bypasses the session events, so the
+    counters are refreshed here.  Returns the ``(id, post_id)`` rows that
+    were approved.
+    """
+    session = session or db.session
+    comment = Comment.__table__
+    pending = db.and_(criterion, comment.c.reviewed.isnot(True))
+    rows = [
+        (row.id, row.post_id)
+        for row in session.execute(
+            db.select([comment.c.id, comment.c.post_id]).where(pending)
+        )
+    ]
+    if rows:
+        session.execute(comment.update().where(pending).values(reviewed=True))
+        update_counters({post_id for i, post_id in rows}, (), session=session)
+    return rows
+
+
+def delete_comments(criterion, session=None, chunk=500):
+    """Delete the comments matching ``criterion`` and all replies below them.
+
+    The replies are found with a recursive CTE, like the ``replies``
+    cascade would, and deleted with ``DELETE ... WHERE id IN`` from the
+    deepest level up so no row is removed before the replies pointing at
+    it.  Returns the ``(id, post_id)`` rows that were deleted.
+    """
+    session = session or db.session
+    comment = Comment.__table__
+    tree = (
+        db.select([comment.c.id, comment.c.post_id, db.literal(0).label("depth")])
+        .where(criterion)
+        .cte("tree", recursive=True)
+    )
+    tree = tree.union_all(
+        db.select([comment.c.id, comment.c.post_id, tree.c.depth + 1]).where(
+            comment.c.replied_id == tree.c.id
+        )
+    )
+    rows = session.execute(
+        db.select([tree.c.id, tree.c.post_id, tree.c.depth]).order_by(
+            tree.c.depth.desc()
+        )
+    ).fetchall()
+    # 同一条评论可能既被选中又是别的选中评论的回复
+    depths = {}
+    for row in rows:
+        depths.setdefault(row.id, row.depth)
+    levels = {}
+    for i, depth in depths.items():
+        levels.setdefault(depth, []).append(i)
+    for depth in sorted(levels, reverse=True):
+        ids = levels[depth]
+        for start in range(0, len(ids), chunk):
+            session.execute(
+                comment.delete().where(comment.c.id.in_(ids[start : start + chunk]))
+            )
+    if rows:
+        update_counters({row.post_id for row in rows}, (), session=session)
+    return list({row.id: (row.id, row.post_id) for row in rows}.values())
+
+
+def _history_values(obj, key, unchanged=False):
+    history = inspect(obj).attrs[key].history
+    values = list(history.added or ()) + list(history.deleted or ())
+    if unchanged:
+        values += list(history.unchanged or ())
+    return [value for value in values if value is not None]
+
+
+@db.event.listens_for(db.session, "before_flush")
+def _collect_counter_targets(session, flush_context, instances):
+    # 新对象在 flush 之后才有 id，所以先记下对象，flush 之后再取 id
+    targets = session.info.setdefault("counter_targets", set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Comment):
+            state = inspect(obj)
+            if (
+                obj in session.dirty
+                and not state.attrs.reviewed.history.has_changes()
+                and not state.attrs.post.history.has_changes()
+                and not state.attrs.post_id.history.has_changes()
+            ):
+                continue
+            targets.update(_history_values(obj, "post", unchanged=True))
+            targets.update((Post, i) for i in _history_values(obj, "post_id"))
+            if obj.post_id is not None:
+                targets.add((Post, obj.post_id))
+        elif isinstance(obj, Post):
+            if obj in session.deleted:
+                targets.update(obj.categories)
+            else:
+                targets.update(_history_values(obj, "categories"))
+        elif isinstance(obj, Category) and obj not in session.deleted:
+            if obj in session.new or inspect(obj).attrs.posts.history.has_changes():
+                targets.add(obj)
+
+
+@db.event.listens_for(db.session, "after_flush_postexec")
+def _refresh_counters(session, flush_context):
+    targets = session.info.pop("counter_targets", ())
+    ids = {Post: set(), Category: set()}
+    for target in targets:
+        model, i = target if isinstance(target, tuple) else (type(target), target.id)
+        if i is not None:
+            ids[model].add(i)
+    if not ids[Post] and not ids[Category]:
+        return
+    update_counters(ids[Post], ids[Category], session=session)
+
+    # 让内存中的对象在下次访问时重新读取计数
+    for model, keys in (
+        (Post, ["comment_count", "reviewed_comment_count"]),
+        (Category, ["post_count"]),
+    ):
+        for i in ids[model]:
+            obj = session.identity_map.get(identity_key(model, i))
+            if obj is not None:
+                session.expire(obj, keys)
+
+
+@db.event.listens_for(db.session, "after_soft_rollback")
+def _discard_counter_targets(session, previous_transaction):
+    session.info.pop("counter_targets", None)
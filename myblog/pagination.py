@@ -0,0 +1,216 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, request
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from myblog.extensions import db
+from myblog.models import Comment
+
+# 一个评论和它下面的回复，parent 是被回复的评论，楼层的第一条为 None
+CommentThread = namedtuple("CommentThread", "comment parent replies")
+
+
+class KeysetPagination(object):
+    """Seek pagination on ``(timestamp, id)``.
+
+    Pages are addressed by opaque cursor tokens instead of page numbers, so
+    a page costs one ``LIMIT`` query on the index no matter how deep it is
+    and no ``COUNT(*)`` is needed.  A cursor points at the first or last row
+    of the current page and says which way to seek from it.
+    """
+
+    def __init__(self, query, model, per_page, cursor=None, descending=True, page=1):
+        self.per_page = per_page
+        self.descending = descending
+        # 页码来自 URL 参数，负数会变成负的 OFFSET，MySQL 直接报错
+        page = max(page, 1)
+        # 按页码访问时的页码，用游标访问时为 None
+        self.page = page if cursor is None else None
+        self._timestamp = model.timestamp
+        self._id = model.id
+
+        direction, key = self.load_cursor(cursor) if cursor else ("next", None)
+        backwards = direction in ("prev", "last")
+        if key is not None:
+            query = query.filter(self._seek(key, forward=not backwards))
+        query = query.order_by(*self._ordering(reverse=backwards)).limit(per_page + 1)
+        if cursor is None and page > 1:
+            # 兼容旧的页码链接
+            query = query.offset((page - 1) * per_page)
+
+        items = self._fetch(query, self.descending != backwards)
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_prev = more
+            self.has_next = direction == "prev"
+        else:
+            self.has_prev = key is not None or page > 1
+            self.has_next = more
+        self.items = items
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return self.dump_cursor("next", self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return self.dump_cursor("prev", self.items[0])
+
+    @property
+    def last_cursor(self):
+        return self.dump_cursor("last")
+
+    def _fetch(self, query, descending):
+        return query.all()
+
+    def dump_cursor(self, direction, item=None):
+        return make_cursor(direction, item)
+
+    @staticmethod
+    def load_cursor(token):
+        try:
+            direction, key = _serializer().loads(token)
+            if key is not None:
+                key = (datetime.fromisoformat(key[0]), int(key[1]))
+        except (BadSignature, TypeError, ValueError):
+            abort(400)
+        if direction not in ("next", "prev", "last"):
+            abort(400)
+        return direction, key
+
+    def _ordering(self, reverse=False):
+        if self.descending != reverse:
+            return self._timestamp.desc(), self._id.desc()
+        return self._timestamp.asc(), self._id.asc()
+
+    def _seek(self, key, forward=True):
+        timestamp, id = key
+        if self.descending == forward:
+            return db.or_(
+                self._timestamp < timestamp,
+                db.and_(self._timestamp == timestamp, self._id < id),
+            )
+        return db.or_(
+            self._timestamp > timestamp,
+            db.and_(self._timestamp == timestamp, self._id > id),
+        )
+
+
+class ThreadPagination(KeysetPagination):
+    """Seek pagination over the comment threads of a post.
+
+    A page holds ``per_page`` top-level comments, and the same query loads
+    every reviewed reply below them with a recursive CTE, so the number of
+    queries does not depend on how deep the threads are.  ``threads`` is the
+    page as a list of :class:`CommentThread`, replies deeper than
+    ``max_depth`` are flattened into their ancestor at that depth.
+    """
+
+    def __init__(self, post, per_page, cursor=None, page=1, max_depth=4):
+        self.max_depth = max_depth
+        self._replies = {}
+        super().__init__(thread_roots(post), Comment, per_page, cursor, False, page)
+
+    def _fetch(self, query, descending):
+        roots = query.with_entities(Comment.id).subquery()
+        thread = db.session.query(
+            roots.c.id.label("id"), db.literal(0).label("depth")
+        ).cte("thread", recursive=True)
+        thread = thread.union_all(
+            db.session.query(Comment.id, thread.c.depth + 1).filter(
+                Comment.replied_id == thread.c.id, Comment.reviewed == db.true()
+            )
+        )
+        items = []
+        for comment, depth in (
+            db.session.query(Comment, thread.c.depth)
+            .join(thread, Comment.id == thread.c.id)
+            .order_by(Comment.timestamp, Comment.id)
+        ):
+            if depth:
+                self._replies.setdefault(comment.replied_id, []).append(comment)
+            else:
+                items.append(comment)
+        if descending:
+            items.reverse()
+        return items
+
+    @property
+    def threads(self):
+        threads = [CommentThread(root, None, []) for root in self.items]
+        # 不用递归，很深的楼层也不会超过递归深度
+        stack = [(node, 0) for node in threads]
+        while stack:
+            node, depth = stack.pop()
+            if depth < self.max_depth:
+                for reply in self._replies.get(node.comment.id, ()):
+                    child = CommentThread(reply, node.comment, [])
+                    node.replies.append(child)
+                    stack.append((child, depth + 1))
+                continue
+            # 超过最大层数的回复按时间顺序平铺
+            parents = {node.comment.id: node.comment}
+            pending = list(self._replies.get(node.comment.id, ()))
+            flat = []
+            while pending:
+                reply = pending.pop()
+                flat.append(CommentThread(reply, parents[reply.replied_id], []))
+                parents[reply.id] = reply
+                pending.extend(self._replies.get(reply.id, ()))
+            flat.sort(key=lambda child: (child.comment.timestamp, child.comment.id))
+            node.replies.extend(flat)
+        return threads
+
+
+def thread_roots(post):
+    """Reviewed comments of ``post`` that start a thread."""
+    parent = db.aliased(Comment)
+    return (
+        Comment.query.with_parent(post)
+        .outerjoin(parent, Comment.replied_id == parent.id)
+        .filter(is_thread_root(parent))
+    )
+
+
+def is_thread_root(parent):
+    """The condition for a comment, outer joined to ``parent``, to start a thread.
+
+    A reply whose parent is not reviewed starts its own thread until the
+    parent is approved.
+    """
+    return db.and_(
+        Comment.reviewed == db.true(),
+        db.or_(Comment.replied_id.is_(None), parent.reviewed.isnot(True)),
+    )
+
+
+def paginate(query, model, per_page, descending=True, page=1):
+    """Paginate ``query`` with the cursor from the request arguments."""
+    cursor = request.args.get("cursor")
+    return KeysetPagination(query, model, per_page, cursor, descending, page)
+
+
+def paginate_threads(post, per_page, page=1):
+    """Paginate the comment threads of ``post`` with the request cursor."""
+    cursor = request.args.get("cursor")
+    max_depth = current_app.config["BLOG_COMMENT_MAX_DEPTH"]
+    return ThreadPagination(post, per_page, cursor, page, max_depth)
+
+
+def make_cursor(direction, item=None):
+    """A cursor seeking ``direction`` from ``item``, a row with timestamp and id."""
+    key = None
+    if item is not None:
+        key = [item.timestamp.isoformat(), item.id]
+    return _serializer().dumps([direction, key])
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt="pagination-cursor")
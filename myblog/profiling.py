@@ -0,0 +1,195 @@
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from flask import current_app
+
+_FIELDS = ("requests", "queries", "db_time", "max_queries", "slow")
+
+
+class QueryStats(object):
+    """Per-endpoint SQL statistics aggregated in memory.
+
+    Every process keeps its own counters and, when ``BLOG_QUERY_STATS_PATH``
+    is set, writes them to ``<pid>.json`` in that directory at most every
+    ``BLOG_QUERY_STATS_FLUSH`` seconds and at exit, so the report can merge
+    all workers and the CLI can read them from outside the server.  Files
+    not written for ``BLOG_QUERY_STATS_MAX_AGE`` seconds, left by workers
+    that exited or were restarted, are skipped and removed on the next flush.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_SLOW_QUERY_THRESHOLD", 1)
+        app.config.setdefault("BLOG_QUERY_STATS_PATH", None)
+        app.config.setdefault("BLOG_QUERY_STATS_FLUSH", 60)
+        app.config.setdefault("BLOG_QUERY_STATS_MAX_AGE", 60 * 60)
+        app.extensions["blog_query_stats"] = _QueryStatsState(
+            app.config["BLOG_QUERY_STATS_PATH"],
+            app.config["BLOG_QUERY_STATS_FLUSH"],
+            app.config["BLOG_QUERY_STATS_MAX_AGE"],
+        )
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_query_stats"]
+
+    def add(self, endpoint, queries):
+        """Record one request to ``endpoint`` that ran ``queries``."""
+        threshold = current_app.config["BLOG_SLOW_QUERY_THRESHOLD"]
+        state = self._state
+        with state.lock:
+            stats = state.endpoints.setdefault(endpoint, dict.fromkeys(_FIELDS, 0))
+            stats["requests"] += 1
+            stats["queries"] += len(queries)
+            stats["db_time"] += sum(q.duration for q in queries)
+            stats["max_queries"] = max(stats["max_queries"], len(queries))
+            stats["slow"] += sum(1 for q in queries if q.duration >= threshold)
+        state.maybe_flush()
+
+    def report(self):
+        """Rows for every endpoint of every process, most DB time first."""
+        totals = {}
+        for endpoints in self._state.snapshots():
+            for endpoint, stats in endpoints.items():
+                total = totals.setdefault(endpoint, dict.fromkeys(_FIELDS, 0))
+                for field in _FIELDS:
+                    if field == "max_queries":
+                        total[field] = max(total[field], stats[field])
+                    else:
+                        total[field] += stats[field]
+        rows = []
+        for endpoint, total in totals.items():
+            rows.append(
+                dict(
+                    total,
+                    endpoint=endpoint,
+                    avg_queries=total["queries"] / total["requests"],
+                    avg_db_time=total["db_time"] / total["requests"],
+                )
+            )
+        rows.sort(key=lambda row: row["db_time"], reverse=True)
+        return rows
+
+    def reset(self):
+        self._state.reset()
+
+
+class _QueryStatsState(object):
+    def __init__(self, path, interval, max_age):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.next_flush = 0
+        if path is not None:
+            atexit.register(self.flush)
+
+    @property
+    def filename(self):
+        return os.path.join(self.path, "%d.json" % os.getpid())
+
+    def maybe_flush(self):
+        if self.path is not None and time.monotonic() > self.next_flush:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.endpoints:
+                return
+            data = json.dumps(self.endpoints)
+            self.next_flush = time.monotonic() + self.interval
+        os.makedirs(self.path, exist_ok=True)
+        # 先写临时文件再替换，读取方不会看到写了一半的文件
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.filename)
+        for filename in self._files(stale=True):
+            try:
+                os.remove(filename)
+            except OSError:
+                # 别的进程可能已经删掉了
+                pass
+
+    def snapshots(self):
+        with self.lock:
+            yield json.loads(json.dumps(self.endpoints))
+        for filename in self._files():
+            if filename == self.filename:
+                continue
+            try:
+                with open(filename) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def _files(self, stale=False):
+        """The stats files of live workers, or with ``stale`` the old ones."""
+        if self.path is None or not os.path.isdir(self.path):
+            return
+        expires = time.time() - self.max_age
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                old = os.path.getmtime(filename) < expires
+            except OSError:
+                continue
+            if old == stale:
+                yield filename
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+        if self.path is not None and os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.path, name))
+
+
+def profile_startup(config_name, lazy=True):
+    """Import the app and run ``create_app`` in a fresh interpreter.
+
+    The interpreter runs with ``-X importtime``.  Returns
+    ``(seconds, packages)``: the wall time of the import plus
+    ``create_app``, and ``(name, seconds)`` for every top-level package
+    imported on the way, slowest first.  A package imported by another one
+    is counted in both.
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        "from myblog import create_app; create_app(%r); "
+        "print(time.perf_counter() - start)" % config_name
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, BLOG_LAZY_IMPORTS="1" if lazy else "0")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    packages = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        if cumulative.strip().isdigit() and "." not in name:
+            packages.append((name, int(cumulative) / 1e6))
+    packages.sort(key=lambda package: package[1], reverse=True)
+    return float(result.stdout.split()[-1]), packages
@@ -0,0 +1,158 @@
+import ipaddress
+import math
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from flask import current_app, request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+# 多久清理一次已经回满的令牌桶（秒）
+PRUNE_INTERVAL = 60
+
+
+class RateLimiter(object):
+    """Token buckets per client IP and endpoint for POST requests.
+
+    ``BLOG_RATELIMITS`` maps an endpoint to ``(requests, seconds)``: a client
+    can send a burst of ``requests`` POSTs, then gets one more every
+    ``seconds / requests`` seconds.  The buckets are rows in the SQLite file
+    ``BLOG_RATELIMIT_PATH``, updated in a write transaction, so every worker
+    process counts against the same limit.  A request over the limit gets
+    ``429 Too Many Requests`` with ``Retry-After``.  Logged-in users are not
+    limited.  Behind a reverse proxy ``BLOG_PROXY_FIX`` must be set, or every
+    client shares the bucket of the proxy's address, a warning is logged
+    when the first limited request comes from a loopback address without it.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOG_RATELIMIT", True)
+        app.config.setdefault("BLOG_RATELIMITS", {})
+        app.config.setdefault("BLOG_RATELIMIT_PATH", None)
+        app.extensions["blog_ratelimit"] = _RateLimitState(
+            app.config["BLOG_RATELIMIT_PATH"]
+        )
+        if app.config["BLOG_RATELIMIT"]:
+            app.before_request(self.check_request)
+
+    @property
+    def _state(self):
+        return current_app.extensions["blog_ratelimit"]
+
+    def check_request(self):
+        if request.method != "POST" or current_user.is_authenticated:
+            return
+        rule = current_app.config["BLOG_RATELIMITS"].get(request.endpoint)
+        if rule is None:
+            return
+        key = "%s %s" % (request.endpoint, request.remote_addr)
+        self._check_proxy()
+        try:
+            wait = self.hit(key, *rule)
+        except sqlite3.Error:
+            # 计数出错时放行，不能因为限流让评论和登录都不可用
+            current_app.logger.exception("Rate limit check failed for %s", key)
+            return
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+    def _check_proxy(self):
+        state = self._state
+        if state.proxy_checked or current_app.config["BLOG_PROXY_FIX"]:
+            return
+        state.proxy_checked = True
+        try:
+            loopback = ipaddress.ip_address(request.remote_addr or "").is_loopback
+        except ValueError:
+            return
+        if loopback:
+            current_app.logger.warning(
+                "Rate limiting a request from %s, if the app is behind a reverse "
+                "proxy set BLOG_PROXY_FIX or every client shares one bucket.",
+                request.remote_addr,
+            )
+
+    def hit(self, key, limit, period, now=None):
+        """Take a token from the bucket of ``key``.
+
+        Returns 0 if there was one, otherwise the seconds until the next
+        token, a rejected request does not use up anything.
+        """
+        state = self._state
+        now = time.time() if now is None else now
+        rate = limit / period
+        conn = state.connect()
+        # 先拿写锁，多个进程同时读到同一个余量时不会都放行
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                tokens = limit
+            else:
+                tokens = min(limit, row[0] + max(now - row[1], 0) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens - 1, now),
+            )
+        finally:
+            conn.execute("COMMIT")
+        if now - state.pruned > PRUNE_INTERVAL:
+            state.pruned = now
+            periods = [p for _, p in current_app.config["BLOG_RATELIMITS"].values()]
+            self.prune(now - max(periods, default=period))
+        return 0
+
+    def prune(self, before):
+        """Delete the buckets last used before ``before``, they are full again."""
+        self._state.connect().execute(
+            "DELETE FROM buckets WHERE updated < ?", (before,)
+        )
+
+    def reset(self):
+        self._state.connect().execute("DELETE FROM buckets")
+
+
+class _RateLimitState(object):
+    def __init__(self, path):
+        if path is None:
+            # 只在本进程内共享，给测试和单进程开发服务器用
+            self.database = "file:blog-ratelimit-%d?mode=memory&cache=shared" % id(self)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.database = "file:%s" % quote(path)
+        self.local = threading.local()
+        self.pruned = 0
+        # 只检查第一个限流的请求是否来自本机
+        self.proxy_checked = False
+        # 内存数据库在最后一个连接关闭时消失，这个连接一直留着
+        self.keeper = self._open()
+        self.keeper.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        if path is not None:
+            self.keeper.execute("PRAGMA journal_mode=WAL")
+
+    def connect(self):
+        """A connection for the current thread, opened again after a fork."""
+        pid = os.getpid()
+        if getattr(self.local, "pid", None) != pid:
+            self.local.conn = self._open()
+            self.local.pid = pid
+        return self.local.conn
+
+    def _open(self):
+        conn = sqlite3.connect(self.database, uri=True, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
@@ -0,0 +1,426 @@
+import re
+from abc import ABC, abstractmethod
+
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import exc, inspect, text
+
+from myblog.extensions import db
+from myblog.models import Post, Comment
+
+
+class SearchBackend(ABC):
+    """An inverted index of posts and reviewed comments.
+
+    Documents are keyed by ``(kind, ref_id)`` where kind is ``"post"`` or
+    ``"comment"``, and carry the id and the private flag of the post they
+    belong to so private posts can be filtered out inside the index.
+    """
+
+    table = "search_index"
+
+    @abstractmethod
+    def create(self, connection):
+        """Create the index table if it does not exist."""
+
+    def drop(self, connection):
+        connection.execute(text("DROP TABLE IF EXISTS %s" % self.table))
+
+    def put(self, connection, docs):
+        if not docs:
+            return
+        self.delete(connection, [(doc["kind"], doc["ref_id"]) for doc in docs])
+        connection.execute(
+            text(
+                "INSERT INTO %s (kind, ref_id, post_id, private, title, body) "
+                "VALUES (:kind, :ref_id, :post_id, :private, :title, :body)"
+                % self.table
+            ),
+            docs,
+        )
+
+    def delete(self, connection, keys):
+        for kind, ref_id in keys:
+            connection.execute(
+                text(
+                    "DELETE FROM %s WHERE kind = :kind AND ref_id = :ref_id"
+                    % self.table
+                ),
+                dict(kind=kind, ref_id=ref_id),
+            )
+
+    def set_private(self, connection, post_id, private):
+        connection.execute(
+            text(
+                "UPDATE %s SET private = :private WHERE post_id = :post_id" % self.table
+            ),
+            dict(post_id=post_id, private=private),
+        )
+
+    @abstractmethod
+    def search(self, connection, terms, include_private, limit, offset):
+        """Return ``(kind, ref_id, post_id, title, body)`` rows, best first."""
+
+
+class SQLiteBackend(SearchBackend):
+    """SQLite FTS5, the rowid encodes the document key so updates are cheap.
+
+    The ``trigram`` tokenizer needs SQLite 3.34, older versions fall back to
+    ``unicode61``, which does not split CJK text, so those terms are
+    matched with ``LIKE`` instead.
+    """
+
+    @staticmethod
+    def tokenizer(connection):
+        tokenizer = current_app.config["BLOG_SEARCH_TOKENIZER"]
+        if tokenizer.startswith(
+            "trigram"
+        ) and connection.dialect.dbapi.sqlite_version_info < (3, 34, 0):
+            return "unicode61"
+        return tokenizer
+
+    def create(self, connection):
+        try:
+            connection.execute(
+                text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+                    "title, body, kind UNINDEXED, ref_id UNINDEXED, "
+                    "post_id UNINDEXED, private UNINDEXED, tokenize = '%s')"
+                    % (self.table, self.tokenizer(connection))
+                )
+            )
+        except exc.OperationalError as e:
+            if "no such module" not in str(e):
+                raise
+            raise RuntimeError(
+                "This SQLite build has no FTS5, set BLOG_SEARCH_BACKEND to "
+                '"none" to turn search off.'
+            ) from e
+
+    @staticmethod
+    def _rowid(kind, ref_id):
+        return ref_id * 2 + (kind == "comment")
+
+    def put(self, connection, docs):
+        if not docs:
+            return
+        self.delete(connection, [(doc["kind"], doc["ref_id"]) for doc in docs])
+        connection.execute(
+            text(
+                "INSERT INTO %s (rowid, kind, ref_id, post_id, private, title, body) "
+                "VALUES (:rowid, :kind, :ref_id, :post_id, :private, :title, :body)"
+                % self.table
+            ),
+            [dict(doc, rowid=self._rowid(doc["kind"], doc["ref_id"])) for doc in docs],
+        )
+
+    def delete(self, connection, keys):
+        if keys:
+            connection.execute(
+                text("DELETE FROM %s WHERE rowid = :rowid" % self.table),
+                [dict(rowid=self._rowid(kind, ref_id)) for kind, ref_id in keys],
+            )
+
+    def set_private(self, connection, post_id, private):
+        # post_id 没有索引，通过 comment 表找到对应的 rowid
+        connection.execute(
+            text(
+                "UPDATE {0} SET private = :private WHERE rowid = :post_rowid "
+                "OR rowid IN (SELECT id * 2 + 1 FROM comment "
+                "WHERE post_id = :post_id)".format(self.table)
+            ),
+            dict(post_id=post_id, post_rowid=post_id * 2, private=private),
+        )
+
+    def search(self, connection, terms, include_private, limit, offset):
+        params = dict(limit=limit, offset=offset)
+        where = []
+        # trigram 分词器只能匹配三个字符以上的词，unicode61 不能切分中文，
+        # 这些词退回到 LIKE
+        trigram = self.tokenizer(connection).startswith("trigram")
+        phrases = []
+        for i, term in enumerate(terms):
+            like = len(term) < 3 if trigram else not term.isascii()
+            if like:
+                params["like%d" % i] = "%" + term.replace("%", "") + "%"
+                where.append("(title LIKE :like{0} OR body LIKE :like{0})".format(i))
+            else:
+                phrases.append('"%s"' % term.replace('"', '""'))
+        if phrases:
+            params["match"] = " ".join(phrases)
+            where.insert(0, "%s MATCH :match" % self.table)
+            order = "bm25(%s, 10.0, 1.0)" % self.table
+        else:
+            order = "rowid DESC"
+        if not include_private:
+            where.append("private = 0")
+        return connection.execute(
+            text(
+                "SELECT kind, ref_id, post_id, title, body FROM %s WHERE %s "
+                "ORDER BY %s LIMIT :limit OFFSET :offset"
+                % (self.table, " AND ".join(where), order)
+            ),
+            params,
+        ).fetchall()
+
+
+class MySQLBackend(SearchBackend):
+    """MySQL InnoDB ``FULLTEXT`` with the ngram parser for CJK text."""
+
+    def create(self, connection):
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS %s ("
+                "kind VARCHAR(10) NOT NULL, ref_id INTEGER NOT NULL, "
+                "post_id INTEGER NOT NULL, private BOOL NOT NULL DEFAULT 0, "
+                "title VARCHAR(60), body MEDIUMTEXT, "
+                "PRIMARY KEY (kind, ref_id), KEY ix_search_post (post_id), "
+                "FULLTEXT KEY ft_search (title, body) WITH PARSER ngram"
+                ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4" % self.table
+            )
+        )
+
+    def search(self, connection, terms, include_private, limit, offset):
+        where = "MATCH (title, body) AGAINST (:q IN NATURAL LANGUAGE MODE)"
+        if not include_private:
+            where += " AND private = 0"
+        return connection.execute(
+            text(
+                "SELECT kind, ref_id, post_id, title, body FROM {0} WHERE {1} "
+                "ORDER BY MATCH (title, body) AGAINST (:q IN NATURAL LANGUAGE MODE) "
+                "DESC LIMIT :limit OFFSET :offset".format(self.table, where)
+            ),
+            dict(q=" ".join(terms), limit=limit, offset=offset),
+        ).fetchall()
+
+
+backends = {"sqlite": SQLiteBackend, "mysql": MySQLBackend}
+
+
+def get_backend(dialect_name=None):
+    """The configured backend, or the one matching the database dialect."""
+    name = current_app.config["BLOG_SEARCH_BACKEND"]
+    if name is None:
+        name = dialect_name or db.engine.dialect.name
+    backend = backends.get(name)
+    return backend() if backend is not None else None
+
+
+def post_document(post):
+    return dict(
+        kind="post",
+        ref_id=post.id,
+        post_id=post.id,
+        private=bool(post.private),
+        title=post.title,
+        body=Markup(post.body or "").striptags(),
+    )
+
+
+def comment_document(comment):
+    return dict(
+        kind="comment",
+        ref_id=comment.id,
+        post_id=comment.post_id,
+        private=bool(comment.post.private),
+        title=comment.author,
+        body=comment.body,
+    )
+
+
+def index_comments(ids):
+    """Index reviewed comments changed with bulk statements.
+
+    The session events only see ORM changes, statements that bypass them
+    call this and :func:`unindex_comments` instead.
+    """
+    backend = get_backend()
+    if backend is None or not ids:
+        return
+    comments = Comment.query.filter(Comment.id.in_(ids)).options(
+        db.joinedload(Comment.post).load_only("private")
+    )
+    backend.put(db.session.connection(), [comment_document(c) for c in comments])
+
+
+def unindex_comments(ids):
+    backend = get_backend()
+    if backend is not None and ids:
+        backend.delete(db.session.connection(), [("comment", i) for i in ids])
+
+
+def split_terms(q):
+    return [term for term in q.split() if term][:10]
+
+
+def highlight(body, terms, width=160):
+    """Cut an escaped snippet of ``body`` around the first term, mark terms."""
+    lowered = body.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [p for p in positions if p >= 0]
+    start = max(min(positions) - width // 4, 0) if positions else 0
+    snippet = ("…" if start else "") + body[start : start + width]
+    if not terms:
+        return escape(snippet)
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    parts, last = [], 0
+    for match in pattern.finditer(snippet):
+        parts.append(escape(snippet[last : match.start()]))
+        parts.append(Markup("<mark>%s</mark>") % match.group(0))
+        last = match.end()
+    parts.append(escape(snippet[last:]))
+    return Markup("").join(parts)
+
+
+class SearchPage(object):
+    """One page of ranked hits, with the attributes the ``pager`` macro uses."""
+
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_prev = page > 1
+        self.has_next = has_next
+        self.prev_num = page - 1
+        self.next_num = page + 1
+
+
+def search_index(q, include_private, page, per_page):
+    terms = split_terms(q)
+    backend = get_backend()
+    if not terms or backend is None:
+        return SearchPage([], page, False)
+    rows = backend.search(
+        db.session.connection(),
+        terms,
+        include_private,
+        limit=per_page + 1,
+        offset=(page - 1) * per_page,
+    )
+    titles = dict(
+        Post.query.with_entities(Post.id, Post.title)
+        .filter(Post.id.in_({row.post_id for row in rows}))
+        .all()
+    )
+    hits = [
+        dict(
+            kind=row.kind,
+            ref_id=row.ref_id,
+            post_id=row.post_id,
+            post_title=titles.get(row.post_id, row.title),
+            author=row.title if row.kind == "comment" else None,
+            snippet=highlight(row.body or "", terms),
+        )
+        for row in rows[:per_page]
+    ]
+    return SearchPage(hits, page, len(rows) > per_page)
+
+
+def rebuild_index(chunk=500, echo=None):
+    """Drop and refill the index in chunks, returns the documents written."""
+    connection = db.session.connection()
+    backend = get_backend()
+    backend.drop(connection)
+    backend.create(connection)
+    count = 0
+    for query, make_document in (
+        (Post.query, post_document),
+        (
+            Comment.query.filter_by(reviewed=True).options(
+                db.joinedload(Comment.post).load_only("private")
+            ),
+            comment_document,
+        ),
+    ):
+        model = query.column_descriptions[0]["entity"]
+        last_id = 0
+        while True:
+            items = (
+                query.filter(model.id > last_id).order_by(model.id).limit(chunk).all()
+            )
+            if not items:
+                break
+            backend.put(connection, [make_document(item) for item in items])
+            count += len(items)
+            last_id = items[-1].id
+            db.session.commit()
+            db.session.expunge_all()
+            # commit 之后 session 换了连接
+            connection = db.session.connection()
+            if echo is not None:
+                echo("Indexed %d documents..." % count)
+    db.session.commit()
+    return count
+
+
+@db.event.listens_for(db.metadata, "after_create")
+def _create_index(target, connection, **kw):
+    backend = get_backend(connection.dialect.name)
+    if backend is not None:
+        backend.create(connection)
+
+
+@db.event.listens_for(db.metadata, "before_drop")
+def _drop_index(target, connection, **kw):
+    backend = get_backend(connection.dialect.name)
+    if backend is not None:
+        backend.drop(connection)
+
+
+def _changed(obj, *keys):
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+
+@db.event.listens_for(db.session, "before_flush")
+def _collect_documents(session, flush_context, instances):
+    if get_backend() is None:
+        return
+    changes = session.info.setdefault(
+        "search_changes", dict(put=set(), delete=set(), private=set())
+    )
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Post) and (
+            obj in session.new or _changed(obj, "title", "body", "private")
+        ):
+            changes["put"].add(obj)
+            if obj not in session.new and _changed(obj, "private"):
+                changes["private"].add(obj)
+        elif isinstance(obj, Comment) and (
+            obj in session.new or _changed(obj, "body", "reviewed", "post", "post_id")
+        ):
+            if obj.reviewed:
+                changes["put"].add(obj)
+            elif obj not in session.new:
+                changes["delete"].add(("comment", obj.id))
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            changes["delete"].add(("post", obj.id))
+        elif isinstance(obj, Comment):
+            changes["delete"].add(("comment", obj.id))
+
+
+@db.event.listens_for(db.session, "after_flush_postexec")
+def _write_documents(session, flush_context):
+    changes = session.info.pop("search_changes", None)
+    if not changes or not (changes["put"] or changes["delete"]):
+        return
+    backend = get_backend()
+    connection = session.connection()
+    docs = []
+    for obj in changes["put"]:
+        if obj in session.deleted or inspect(obj).was_deleted:
+            continue
+        if isinstance(obj, Post):
+            docs.append(post_document(obj))
+        else:
+            docs.append(comment_document(obj))
+    backend.delete(connection, changes["delete"])
+    backend.put(connection, docs)
+    # 文章的可见性变化时，它的评论也要跟着变
+    for post in changes["private"]:
+        backend.set_private(connection, post.id, bool(post.private))
+
+
+@db.event.listens_for(db.session, "after_soft_rollback")
+def _discard_documents(session, previous_transaction):
+    session.info.pop("search_changes", None)
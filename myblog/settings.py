@@ -2,6 +2,8 @@ import os
 import sys
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+# Flask 的 instance 文件夹，放运行时生成、不提交的文件
+instancedir = os.path.join(basedir, "instance")
 
 WIN = sys.platform.startswith("win")
 if WIN:
@@ -13,6 +15,12 @@ else:
 class BaseConfig(object):
     SECRET_KEY = os.getenv("SECRET_KEY", "a secret string")
 
+    # 启动时不导入 flask_moment、flask_migrate（以及 alembic），第一次渲染模板
+    # 或执行 flask db 时再导入，缩短 worker 的启动时间；flask startup 查看导入耗时
+    BLOG_LAZY_IMPORTS = os.getenv("BLOG_LAZY_IMPORTS", "1") != "0"
+    # Flask-DebugToolbar，只在调试模式下生效
+    BLOG_DEBUG_TOOLBAR = False
+
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
 
@@ -26,10 +34,35 @@ class BaseConfig(object):
     MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = ("Blog Admin", MAIL_USERNAME)
 
+    # SQLite 每个新连接都执行这些 PRAGMA；WAL 让读写互不阻塞，写锁最多等
+    # busy_timeout 毫秒，mmap 和 cache_size（负数单位为 KiB）减少读文件
+    BLOG_SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -16000,
+    }
+    # MySQL 连接池，RECYCLE 要比 wait_timeout 短
+    BLOG_DB_POOL_SIZE = 10
+    BLOG_DB_POOL_RECYCLE = 3600
+    # 只读副本的数据库 URL，这些蓝本的 GET 请求随机选一个副本读，
+    # 其余请求和所有写入都走主库
+    BLOG_DB_REPLICAS = []
+    BLOG_DB_READ_BLUEPRINTS = ["blog"]
+    # 写入之后这么多秒内同一个客户端的请求也读主库，要比副本的延迟长；
+    # 填充缓存的查询总是读主库
+    BLOG_DB_PRIMARY_AFTER_WRITE = 10
+
     BLOG_EMAIL = os.getenv("BLOG_EMAIL")
     BLOG_POST_PER_PAGE = 10
     BLOG_MANAGE_POST_PER_PAGE = 15
+    # 评论按楼层分页，每页 15 个顶层评论和它们的全部回复；回复超过
+    # MAX_DEPTH 层后不再缩进，按时间顺序排在第 MAX_DEPTH 层下面
     BLOG_COMMENT_PER_PAGE = 15
+    BLOG_COMMENT_MAX_DEPTH = 4
+    # 后台输入和显示时间用的时区，数据库里保存的是 UTC
+    BLOG_TIMEZONE = os.getenv("BLOG_TIMEZONE", "Asia/Shanghai")
     # ('theme name', 'display name')
     BLOG_THEMES = {
         "sketchy": "Sketchy",
@@ -39,14 +72,96 @@ class BaseConfig(object):
         "black_swan": "Black Swan",
         "lumen": "Lumen",
     }
+    # 超过这个时间（秒）的查询会记录到日志
     BLOG_SLOW_QUERY_THRESHOLD = 1
+    # 各进程的查询统计定期写到这个目录，供 flask queries 和后台报表合并；
+    # 超过 MAX_AGE 秒没有更新的文件属于已经退出的进程，合并时跳过并删除
+    BLOG_QUERY_STATS_PATH = os.path.join(instancedir, "query-stats")
+    BLOG_QUERY_STATS_FLUSH = 60
+    BLOG_QUERY_STATS_MAX_AGE = 60 * 60
+    # Prometheus 指标，/metrics 只对管理员和下面的地址开放，多进程部署时
+    # 需要设置环境变量 prometheus_multiproc_dir；在反向代理之后时所有请求都
+    # 来自代理的地址，要先设置 BLOG_PROXY_FIX 再开放 127.0.0.1
+    BLOG_METRICS = True
+    BLOG_METRICS_ALLOWED_IPS = []
+    # 侧边栏、导航栏等数据的缓存时间（秒），修改数据时会主动失效
+    BLOG_CACHE_TIMEOUT = 300
+    # 登录后的管理员对象在各进程里缓存，修改设置或 flask init 时替换这个文件，
+    # 所有进程据此重新加载；None 时只在本进程内失效
+    BLOG_USER_STAMP_PATH = os.path.join(instancedir, "user-stamp")
+    # 匿名访客的整页缓存，修改文章只会清除相关页面，侧边栏的计数最多延迟 TIMEOUT 秒；
+    # 修改时替换 SITE_STAMP_PATH 处的文件，其他进程据此清空各自的缓存
+    BLOG_SITE_STAMP_PATH = os.path.join(instancedir, "site-stamp")
+    BLOG_PAGE_CACHE = False
+    BLOG_PAGE_CACHE_SIZE = 500
+    BLOG_PAGE_CACHE_TIMEOUT = 300
+    # 全文搜索后端，None 表示按数据库选择（sqlite 用 FTS5，mysql 用 FULLTEXT），
+    # "none" 表示关闭搜索
+    BLOG_SEARCH_BACKEND = None
+    # FTS5 的分词器，trigram 可以搜索中文，需要 SQLite 3.34 以上，更早的版本
+    # 换成 unicode61，中文词用 LIKE 匹配
+    BLOG_SEARCH_TOKENIZER = "trigram"
+    BLOG_FEED_SIZE = 20
+    # Feed 和 sitemap 在任何进程修改文章时失效（见 SITE_STAMP_PATH），这里只是兜底
+    BLOG_FEED_CACHE_TIMEOUT = 60 * 60 * 24
+    # sitemap 协议规定单个文件最多 50000 个 URL
+    BLOG_SITEMAP_MAX_URLS = 50000
+    # 后台发信线程数和队列长度，队列满时丢弃新邮件并记录日志
+    BLOG_MAIL_WORKERS = 2
+    BLOG_MAIL_QUEUE_SIZE = 100
+    # 发送失败的重试次数，第 n 次重试前等待 RETRY_DELAY * 2 ** n 秒
+    BLOG_MAIL_RETRIES = 3
+    BLOG_MAIL_RETRY_DELAY = 2
+    # SMTP 连接空闲多久后关闭（秒）
+    BLOG_MAIL_IDLE_TIMEOUT = 60
 
     BLOG_UPLOAD_PATH = os.path.join(basedir, "uploads")
     BLOG_ALLOWED_IMAGE_EXTENSIONS = ["png", "jpg", "jpeg", "gif"]
+    # 上传图片后在后台进程里生成这些宽度的缩略图和 WebP，需要 Pillow，
+    # WORKERS 为 0 时在请求里直接生成
+    BLOG_IMAGE_SIZES = [480, 960]
+    BLOG_IMAGE_WORKERS = 2
+    # 由 nginx 发送图片时设置为 internal location 的前缀，如 "/protected-uploads/"；
+    # Apache 等用 X-Sendfile 的服务器设置 USE_X_SENDFILE = True
+    BLOG_UPLOAD_ACCEL_REDIRECT = None
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    # flask assets 把带哈希的静态文件和 .gz/.br 写到这里，构建之后重启生效
+    BLOG_ASSETS_PATH = os.path.join(basedir, "assets")
+    # HTML、JSON、XML 响应的 gzip/brotli 压缩，前面有 nginx 压缩时可以关掉
+    BLOG_COMPRESS = True
+    BLOG_COMPRESS_MIN_SIZE = 500
+    BLOG_COMPRESS_LEVEL = 6
+    BLOG_COMPRESS_BR_QUALITY = 4
+    # 这些端点的页面边渲染边发送，模板里 {{ flush() }} 处和每攒够 BUFFER_SIZE
+    # 个字符发送一次；整页缓存要保存的页面不会流式渲染
+    BLOG_STREAM_ENDPOINTS = [
+        "blog.index",
+        "blog.show_post",
+        "admin.manage_post",
+        "admin.manage_category",
+        "admin.manage_comment",
+    ]
+    BLOG_STREAM_BUFFER_SIZE = 8192
+    # 按 IP 限制评论和登录的 POST，(次数, 秒) 表示最多连续 次数 个请求，之后每
+    # 秒/次数 秒恢复一个；各进程通过 PATH 处的 SQLite 文件共享计数，None 时
+    # 只在本进程内计数。在反向代理之后必须设置下面的 BLOG_PROXY_FIX，否则
+    # 所有访客共用代理地址的计数，几个人登录失败就会让所有人都无法登录
+    BLOG_RATELIMIT = True
+    BLOG_RATELIMITS = {
+        "blog.show_post": (5, 60),
+        "auth.login": (10, 300),
+    }
+    BLOG_RATELIMIT_PATH = os.path.join(instancedir, "ratelimit.db")
+    # 部署在 nginx 等反向代理之后时填 ProxyFix 的参数，如 dict(x_for=1, x_proto=1)，
+    # 数字是可信的代理层数；否则 remote_addr 都是代理的地址，所有访客共用一个限流桶
+    BLOG_PROXY_FIX = {}
+    # flask freeze 导出静态页面的目录，nginx 直接发送其中的页面
+    BLOG_FREEZE_PATH = os.path.join(basedir, "frozen")
 
 
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir, "data-dev.db")
+    BLOG_METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
     # EXPLAIN_TEMPLATE_LOADING = True
 
 
@@ -54,12 +169,24 @@ class ProductionConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv(
         "DATABASE_URL", prefix + os.path.join(basedir, "data.db")
     )
+    # 空格分隔的多个 URL
+    BLOG_DB_REPLICAS = os.getenv("DATABASE_REPLICA_URLS", "").split()
+    # 应用前面的反向代理层数，部署在 nginx 之后时必须设置
+    proxies = int(os.getenv("BLOG_PROXY_COUNT", "0"))
+    BLOG_PROXY_FIX = dict(x_for=proxies, x_proto=proxies) if proxies else {}
 
 
 class TestingConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"  # in-memory database
+    BLOG_QUERY_STATS_PATH = None
+    BLOG_METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+    BLOG_IMAGE_WORKERS = 0
+    BLOG_ASSETS_PATH = None
+    BLOG_RATELIMIT_PATH = None
+    BLOG_USER_STAMP_PATH = None
+    BLOG_SITE_STAMP_PATH = None
 
 
 config = {
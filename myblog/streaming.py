@@ -0,0 +1,31 @@
+from flask import current_app, stream_with_context
+
+
+def stream_response(chunks, **kwargs):
+    """A response that sends ``chunks`` inside the request context.
+
+    ``after_request`` handlers run before the first chunk is generated, the
+    ones that sum up the whole request register with :func:`after_response`
+    and run when the last chunk is sent or the client goes away.
+    """
+    callbacks = []
+
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            for callback in callbacks:
+                callback()
+
+    response = current_app.response_class(stream_with_context(generate()), **kwargs)
+    response.blog_stream_callbacks = callbacks
+    return response
+
+
+def after_response(response, func, *args):
+    """Call ``func(*args)`` now, or after a streamed ``response`` is finished."""
+    callbacks = getattr(response, "blog_stream_callbacks", None)
+    if callbacks is None:
+        func(*args)
+    else:
+        callbacks.append(lambda: func(*args))
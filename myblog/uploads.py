@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, request, send_from_directory, safe_join, abort
+
+try:
+    from PIL import Image
+except ImportError:  # 没有 Pillow 时只保存原图
+    Image = None
+
+# 按文件头判断图片类型，不相信扩展名和浏览器给的 Content-Type
+SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+# save_image 保存的文件名：内容的 SHA-256，按前两位分目录
+UPLOAD_NAME = re.compile(
+    r"[0-9a-f]{2}/[0-9a-f]{64}\.(%s)" % "|".join(sorted(set(SIGNATURES.values())))
+)
+
+_pool = None
+_pool_pid = None
+
+
+def allowed_file(filename):
+    return (
+        "." in filename
+        and filename.rsplit(".", 1)[1].lower()
+        in current_app.config["BLOG_ALLOWED_IMAGE_EXTENSIONS"]
+    )
+
+
+def sniff(head):
+    for signature, kind in SIGNATURES.items():
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def save_image(storage):
+    """Stream an uploaded image to disk under the hash of its content.
+
+    Returns the stored name, relative to ``BLOG_UPLOAD_PATH``, or None if
+    the file is not an image.  Uploading the same image twice stores it
+    once.
+    """
+    upload_path = current_app.config["BLOG_UPLOAD_PATH"]
+    os.makedirs(upload_path, exist_ok=True)
+    digest = hashlib.sha256()
+    head = storage.stream.read(CHUNK_SIZE)
+    kind = sniff(head)
+    if kind is None:
+        return None
+
+    fd, tmp = tempfile.mkstemp(dir=upload_path, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                f.write(chunk)
+                chunk = storage.stream.read(CHUNK_SIZE)
+        name = digest.hexdigest()
+        filename = "%s/%s.%s" % (name[:2], name, kind)
+        path = os.path.join(upload_path, filename)
+        if os.path.exists(path):
+            os.remove(tmp)
+            return filename
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if Image is not None and kind != "gif":
+        sizes = current_app.config["BLOG_IMAGE_SIZES"]
+        if current_app.config["BLOG_IMAGE_WORKERS"]:
+            _get_pool().submit(make_variants, path, sizes).add_done_callback(
+                _log_failure
+            )
+        else:
+            make_variants(path, sizes)
+    return filename
+
+
+def variant_name(filename, width=None, webp=False):
+    base, ext = os.path.splitext(filename)
+    if width is not None:
+        base = "%s-%d" % (base, width)
+    return base + (".webp" if webp else ext)
+
+
+def make_variants(path, sizes):
+    """Write narrower copies of the image and WebP copies of all of them.
+
+    Runs in the pool, files are written under a temporary name and renamed
+    so a request never sees half a file.
+    """
+    with Image.open(path) as image:
+        image.load()
+    jobs = [(None, image)]
+    for width in sizes:
+        if width < image.width:
+            height = round(image.height * width / image.width)
+            jobs.append((width, image.resize((width, height), Image.LANCZOS)))
+    for width, copy in jobs:
+        for webp in (False, True):
+            if width is None and not webp:
+                continue
+            target = variant_name(path, width, webp)
+            if os.path.exists(target):
+                continue
+            tmp = target + ".part"
+            if webp:
+                if copy.mode not in ("RGB", "RGBA"):
+                    copy = copy.convert("RGBA")
+                copy.save(tmp, "WEBP", quality=80)
+            else:
+                copy.save(tmp, image.format, quality=85, optimize=True)
+            os.replace(tmp, target)
+
+
+def send_image(filename):
+    """Serve an upload, or the WebP copy of it if the client accepts WebP.
+
+    Names contain the content hash so responses are cached forever.
+    """
+    if UPLOAD_NAME.fullmatch(filename) is None:
+        abort(404)
+    upload_path = current_app.config["BLOG_UPLOAD_PATH"]
+    width = request.args.get("w", type=int)
+    candidates = [variant_name(filename, width), filename] if width else [filename]
+    if "image/webp" in request.accept_mimetypes:
+        candidates = [variant_name(c, webp=True) for c in candidates] + candidates
+    for candidate in candidates:
+        path = safe_join(upload_path, candidate)
+        if path is not None and os.path.isfile(path):
+            break
+    else:
+        abort(404)
+
+    accel = current_app.config["BLOG_UPLOAD_ACCEL_REDIRECT"]
+    if accel:
+        # 交给 nginx 发送文件，nginx 里对应的 location 要设置 internal
+        response = current_app.response_class(
+            mimetype=_mimetype(candidate),
+            headers={"X-Accel-Redirect": accel + candidate},
+        )
+    else:
+        # USE_X_SENDFILE 打开时 send_file 会设置 X-Sendfile；Range 请求由 conditional 处理
+        response = send_from_directory(upload_path, candidate, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    response.vary.add("Accept")
+    return response
+
+
+def _mimetype(filename):
+    ext = filename.rsplit(".", 1)[1]
+    return "image/" + {"jpg": "jpeg"}.get(ext, ext)
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    # 进程池不能跨 fork 使用
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(current_app.config["BLOG_IMAGE_WORKERS"])
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        # 回调在池的管理线程里执行，没有应用上下文
+        logging.getLogger("myblog").error(
+            "Failed to make image variants", exc_info=future.exception()
+        )
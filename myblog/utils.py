@@ -1,6 +1,27 @@
 from urllib.parse import urlparse, urljoin
 
-from flask import request, redirect, url_for
+from dateutil import tz
+from flask import (
+    request,
+    redirect,
+    url_for,
+    current_app,
+    render_template,
+    get_flashed_messages,
+    before_render_template,
+    template_rendered,
+)
+from flask_login import current_user
+from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
+
+from myblog.extensions import page_cache
+from myblog.streaming import stream_response
+
+# 模板里 {{ flush() }} 的输出，流式渲染时在这里把已经渲染的部分发出去
+FLUSH = Markup("<!-- flush -->")
 
 
 def is_safe_url(target):
@@ -16,3 +37,104 @@ def redirect_back(default="blog.index", **kwargs):
         if is_safe_url(target):
             return redirect(target)
     return redirect(url_for(default, **kwargs))
+
+
+def stream_template(template_name, **context):
+    """Like ``render_template`` but yields the output piece by piece.
+
+    The template signals are sent too, ``template_rendered`` once the last
+    piece has been generated.
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        yield from template.generate(context)
+        template_rendered.send(app, template=template, context=context)
+
+    return generate()
+
+
+def render_page(template_name, **context):
+    """Render a page, streamed if the endpoint is in ``BLOG_STREAM_ENDPOINTS``.
+
+    A streamed page goes out in chunks of ``BLOG_STREAM_BUFFER_SIZE`` bytes
+    and at every ``{{ flush() }}`` in the template, so the browser gets the
+    head and the top of the page while the rest is still being queried,
+    pass :func:`deferred` values for the slow parts.  Check the request
+    before calling this, an error in the middle of the stream can no
+    longer change the status code.  Pages the page cache is going to store
+    are rendered in one piece.
+    """
+    endpoints = current_app.config["BLOG_STREAM_ENDPOINTS"]
+    if request.endpoint not in endpoints or page_cache.storing:
+        return render_template(template_name, **context)
+
+    # 响应头发出后 session 就不能再改了，CSRF 令牌和闪现消息要先放进 session
+    if current_user.is_authenticated or any(
+        isinstance(value, FlaskForm) for value in context.values()
+    ):
+        generate_csrf()
+    get_flashed_messages()
+
+    context["flush"] = lambda: FLUSH
+    chunks = _buffered(
+        stream_template(template_name, **context),
+        current_app.config["BLOG_STREAM_BUFFER_SIZE"],
+    )
+    return stream_response(chunks)
+
+
+def _buffered(chunks, size):
+    # Jinja 每个变量输出一块，攒够 size 再发，压缩时每块都要 flush
+    buffer, length = [], 0
+    for chunk in chunks:
+        if chunk == FLUSH:
+            if buffer:
+                yield "".join(buffer)
+                buffer, length = [], 0
+            continue
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def deferred(func):
+    """A proxy to ``func()``, called the first time the proxy is used.
+
+    Lets a streamed template run a query after flushing what comes before
+    the part that needs it.
+    """
+    result = []
+
+    def load():
+        if not result:
+            result.append(func())
+        return result[0]
+
+    return LocalProxy(load)
+
+
+def get_timezone():
+    """The timezone of ``BLOG_TIMEZONE``, times are stored in UTC."""
+    name = current_app.config["BLOG_TIMEZONE"]
+    zone = tz.gettz(name)
+    if zone is None:
+        raise ValueError("Unknown timezone %r in BLOG_TIMEZONE" % name)
+    return zone
+
+
+def to_local(value):
+    """Convert a naive UTC datetime to naive local time."""
+    return value.replace(tzinfo=tz.UTC).astimezone(get_timezone()).replace(tzinfo=None)
+
+
+def to_utc(value):
+    """Convert a naive local datetime to naive UTC."""
+    return value.replace(tzinfo=get_timezone()).astimezone(tz.UTC).replace(tzinfo=None)
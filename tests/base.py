@@ -1,7 +1,11 @@
 import unittest
+from contextlib import contextmanager
+
 from flask import url_for
+from sqlalchemy import event
 
 from myblog import create_app
+from myblog.emails import email_queue
 from myblog.extensions import db
 from myblog.models import Admin
 
@@ -22,24 +26,68 @@ class BaseTestCase(unittest.TestCase):
             blog_title="Testlog",
             blog_sub_title="a test",
         )
-        user.set_password("123")
+        user.set_password("12345678")
         db.session.add(user)
         db.session.commit()
 
     def tearDown(self) -> None:
+        email_queue.shutdown()
         db.drop_all()
         self.context.pop()
 
     def login(self, username=None, password=None):
         if username is None or password is None:
             username = "grey"
-            password = "123"
+            password = "12345678"
 
-        return self.client.post(
-            url_for("auth.login"),
-            data=dict(username=username, password=password),
-            follow_redirects=True,
+        return self.read(
+            self.client.post(
+                url_for("auth.login"),
+                data=dict(username=username, password=password),
+                follow_redirects=True,
+            )
         )
 
     def logout(self):
-        return self.client.get(url_for("auth.logout"), follow_redirects=True)
+        return self.read(self.client.get(url_for("auth.logout"), follow_redirects=True))
+
+    @staticmethod
+    def read(response):
+        """Read a response the test may ignore, e.g. a streamed page.
+
+        A streamed page keeps its request context pushed until it is read,
+        when it ends up in a reference cycle the garbage collector pops it
+        later, in the middle of another request.
+        """
+        response.get_data()
+        return response
+
+    @contextmanager
+    def assertMaxQueries(self, count):
+        """Fail if the block runs more than ``count`` SQL statements."""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        if len(statements) > count:
+            self.fail(
+                "%d queries executed, %d expected\n%s"
+                % (len(statements), count, "\n\n".join(statements))
+            )
+
+    def assertQueryBudget(self, url, count, status_code=200):
+        """GET ``url`` and check it stays within ``count`` SQL statements."""
+        # 先请求一次，让侧边栏等缓存的数据就位
+        self.read(self.client.get(url))
+        with self.assertMaxQueries(count):
+            response = self.client.get(url)
+            # 流式渲染的页面读完响应时才执行完全部查询
+            response.get_data()
+        self.assertEqual(response.status_code, status_code)
+        return response
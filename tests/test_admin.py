@@ -1,7 +1,12 @@
-from flask import url_for
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from flask import current_app, url_for
 
 from myblog.models import Post, Category, Link, Comment
-from myblog.extensions import db
+from myblog import create_app
+from myblog.extensions import db, user_stamp
 
 from tests.base import BaseTestCase
 
@@ -12,7 +17,7 @@ class AdminTestCase(BaseTestCase):
         self.login()
 
         category = Category(name="Default")
-        post = Post(title="Hello", category=category, body="Blah...")
+        post = Post(title="Hello", categories=[category], body="Blah...")
         comment = Comment(body="A comment", post=post, from_admin=True)
         link = Link(name="GitHub", url="https://github.com/greyli")
         db.session.add_all([category, post, comment, link])
@@ -36,3 +41,139 @@ class AdminTestCase(BaseTestCase):
         self.assertIn("Post created.", data)
         self.assertIn("Something", data)
         self.assertIn("Hello, world.", data)
+
+    def add_comments(self, count, **kwargs):
+        post = Post.query.first()
+        comments = [
+            Comment(author="Reader", body="Pending %d" % i, post=post, **kwargs)
+            for i in range(count)
+        ]
+        db.session.add_all(comments)
+        db.session.commit()
+        return [comment.id for comment in comments]
+
+    def test_bulk_approve(self):
+        ids = self.add_comments(20)
+        # 语句数和评论数无关
+        with self.assertMaxQueries(8):
+            self.client.post(
+                url_for("admin.bulk_comments"),
+                data=dict(action="approve", ids=ids[:15]),
+            )
+        response = self.client.get(url_for("admin.manage_comment"))
+        self.assertIn("15 comments published.", response.get_data(as_text=True))
+        post = Post.query.first()
+        self.assertEqual(post.reviewed_comment_count, 15)
+        self.assertEqual(Comment.query.filter_by(reviewed=False).count(), 6)
+        data = self.client.get(url_for("blog.search", q="Pending")).get_data(
+            as_text=True
+        )
+        self.assertIn("<mark>Pending</mark> 0", data)
+
+    def test_bulk_delete_replies(self):
+        first, second = self.add_comments(2, reviewed=True)
+        reply = Comment(body="A reply", post_id=1, replied_id=first, reviewed=True)
+        db.session.add(reply)
+        db.session.commit()
+        db.session.add(Comment(body="Deeper", post_id=1, replied_id=reply.id))
+        db.session.commit()
+
+        response = self.client.post(
+            url_for("admin.bulk_comments"),
+            data=dict(action="delete", ids=[first, reply.id]),
+            follow_redirects=True,
+        )
+        self.assertIn("3 comments deleted.", response.get_data(as_text=True))
+        self.assertEqual(
+            [c.body for c in Comment.query.order_by(Comment.id)],
+            ["A comment", "Pending 1"],
+        )
+        post = Post.query.first()
+        self.assertEqual((post.comment_count, post.reviewed_comment_count), (2, 1))
+
+    def test_prune(self):
+        old = datetime.utcnow() - timedelta(days=40)
+        self.add_comments(3, timestamp=old)
+        self.add_comments(2, timestamp=old, reviewed=True)
+        self.add_comments(1)
+        response = self.client.post(
+            url_for("admin.prune_comments"), data=dict(days=30), follow_redirects=True
+        )
+        # setUp 里的评论也没有审核，但不到 30 天
+        self.assertIn("3 comments deleted.", response.get_data(as_text=True))
+        self.assertEqual(Comment.query.count(), 4)
+        self.assertEqual(Post.query.first().comment_count, 4)
+
+    def test_prune_invalid_days(self):
+        for days in ("-1", "999999999", "soon"):
+            response = self.client.post(
+                url_for("admin.prune_comments"),
+                data=dict(days=days),
+                follow_redirects=True,
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Invalid number of days.", response.get_data(as_text=True))
+
+    def test_timemachine(self):
+        current_app.config["BLOG_TIMEZONE"] = "Asia/Shanghai"
+        second = Post(title="World", body="Blah...", timestamp=datetime(2020, 1, 1))
+        db.session.add(second)
+        db.session.commit()
+        response = self.client.get(url_for("admin.timemachine"))
+        self.assertIn("2020-01-01 08:00:00", response.get_data(as_text=True))
+
+        with self.assertMaxQueries(3):
+            response = self.client.post(
+                url_for("admin.timemachine"),
+                data={"1": "2021-05-01T08:30", "2": "2021-05-02T00:00:15", "3": ""},
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Post.query.get(1).timestamp, datetime(2021, 5, 1, 0, 30))
+        self.assertEqual(Post.query.get(2).timestamp, datetime(2021, 5, 1, 16, 0, 15))
+
+    def test_timemachine_all_or_nothing(self):
+        before = Post.query.get(1).timestamp
+        response = self.client.post(
+            url_for("admin.timemachine"),
+            data={"1": "2021-05-01T08:30", "2": "2021-05-01T08:30", "x": "soon"},
+            follow_redirects=True,
+        )
+        data = response.get_data(as_text=True)
+        self.assertIn("Nothing changed, invalid time for: x, 2.", data)
+        db.session.expire_all()
+        self.assertEqual(Post.query.get(1).timestamp, before)
+
+    def test_settings_reload_user(self):
+        self.client.post(
+            url_for("admin.settings"),
+            data=dict(name="New Name", blog_title="T", blog_sub_title="S", about="A"),
+        )
+        data = self.client.get(url_for("blog.show_post", post_id=1)).get_data(
+            as_text=True
+        )
+        # 评论表单里的作者来自重新加载的 current_user
+        self.assertIn('value="New Name"', data)
+
+    def test_password_change_logs_out(self):
+        self.assertEqual(self.client.get(url_for("admin.settings")).status_code, 200)
+        result = self.runner.invoke(
+            args=["init", "--username", "grey", "--password", "new-password"]
+        )
+        self.assertIn("Done.", result.output)
+        response = self.client.get(url_for("admin.settings"))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/auth/login", response.location)
+
+    def test_user_stamp_shared(self):
+        with tempfile.TemporaryDirectory() as path:
+            apps = [create_app("testing") for i in range(2)]
+            for app in apps:
+                app.config["BLOG_USER_STAMP_PATH"] = os.path.join(path, "stamp")
+                user_stamp.init_app(app)
+            with apps[1].app_context():
+                before = user_stamp.get()
+            # 另一个进程（比如 flask init）替换了文件
+            with apps[0].app_context():
+                user_stamp.bump()
+            with apps[1].app_context():
+                self.assertNotEqual(user_stamp.get(), before)
@@ -0,0 +1,76 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from flask import current_app, url_for
+
+from myblog.assets import brotli, build_assets
+from myblog.extensions import assets
+from tests.base import BaseTestCase
+
+
+class AssetsTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        self.output = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.source, "css"))
+        self.css = b"body { color: red; }\n" * 100
+        with open(os.path.join(self.source, "css", "style.css"), "wb") as f:
+            f.write(self.css)
+        with open(os.path.join(self.source, "favicon.ico"), "wb") as f:
+            f.write(os.urandom(100))
+        self.manifest = build_assets(self.source, self.output)
+
+        current_app.config["BLOG_ASSETS_PATH"] = self.output
+        assets.init_app(current_app)
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.output)
+        super().tearDown()
+
+    def test_build(self):
+        hashed = self.manifest["css/style.css"]
+        self.assertRegex(hashed, r"^css/style\.[0-9a-f]{10}\.css$")
+        self.assertTrue(os.path.exists(os.path.join(self.output, hashed + ".gz")))
+        self.assertTrue(os.path.exists(os.path.join(self.output, "css/style.css.gz")))
+        # 随机内容压缩不了，不生成 .gz
+        self.assertFalse(os.path.exists(os.path.join(self.output, "favicon.ico.gz")))
+
+    def test_url_for(self):
+        self.assertEqual(
+            url_for("static", filename="css/style.css"),
+            "/static/" + self.manifest["css/style.css"],
+        )
+        self.assertEqual(
+            url_for("static", filename="js/script.js"), "/static/js/script.js"
+        )
+
+    def test_serve_precompressed(self):
+        url = url_for("static", filename="css/style.css")
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertEqual(response.mimetype, "text/css")
+        self.assertEqual(gzip.decompress(response.data), self.css)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+
+        if brotli is not None:
+            response = self.client.get(url, headers={"Accept-Encoding": "gzip, br"})
+            self.assertEqual(response.content_encoding, "br")
+            self.assertEqual(brotli.decompress(response.data), self.css)
+
+        response = self.client.get(url)
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.data, self.css)
+
+    def test_unhashed_and_fallback(self):
+        response = self.client.get("/static/css/style.css")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response.headers.get("Cache-Control", ""))
+        # 不在构建结果里的文件从原来的 static 目录发送
+        response = self.client.get("/static/js/script.js")
+        self.assertEqual(response.status_code, 200)
+        response.close()
@@ -0,0 +1,27 @@
+import os
+import tempfile
+import unittest
+
+from myblog.extensions import db
+from benchmarks.runner import make_app, run, compare
+from benchmarks.seed import seed
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_smoke(self):
+        with tempfile.TemporaryDirectory() as path:
+            app = make_app(os.path.join(path, "bench.db"))
+            with app.app_context():
+                db.create_all()
+                seed("smoke")
+            report = run(app, requests=4, concurrency=2, warmup=1)
+
+        routes = report["routes"]
+        self.assertIn("post", routes)
+        self.assertIn("manage_comment", routes)
+        for name, result in routes.items():
+            self.assertEqual(result["errors"], 0, name)
+            self.assertEqual(result["requests"], 4)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["queries_per_request"], 0)
+        self.assertTrue(compare(report, report))
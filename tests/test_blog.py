@@ -0,0 +1,200 @@
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+
+from flask import url_for, current_app
+from flask_sqlalchemy import get_debug_queries
+
+from myblog.models import Admin, Post, Category, Comment, Link
+from myblog.extensions import db, page_cache, site_stamp
+from myblog.pagination import ThreadPagination
+
+from tests.base import BaseTestCase
+
+
+class BlogTestCase(BaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        category = Category(name="Default")
+        post = Post(title="Hello", categories=[category], body="Blah...")
+        link = Link(name="GitHub", url="https://github.com/greyli")
+        db.session.add_all([category, post, link])
+        db.session.commit()
+
+    def count_queries(self, table):
+        return sum(
+            "FROM %s" % table in query.statement for query in get_debug_queries()
+        )
+
+    def test_site_context_cached(self):
+        self.client.get(url_for("blog.about"))
+        link_queries = self.count_queries("link")
+        self.assertGreater(link_queries, 0)
+        response = self.client.get(url_for("blog.about"))
+        self.assertIn("GitHub", response.get_data(as_text=True))
+        self.assertEqual(self.count_queries("link"), link_queries)
+
+    def test_site_context_invalidated(self):
+        self.client.get(url_for("blog.about"))
+        self.login()
+        self.client.post(
+            url_for("admin.new_link"),
+            data=dict(name="Flask", url="https://flask.palletsprojects.com"),
+        )
+        response = self.client.get(url_for("blog.about"))
+        self.assertIn("Flask", response.get_data(as_text=True))
+
+    def test_page_cache(self):
+        current_app.config["BLOG_PAGE_CACHE"] = True
+        response = self.client.get(url_for("blog.index"))
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        response = self.client.get(url_for("blog.index"))
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+        self.assertIn("Hello", response.get_data(as_text=True))
+        self.assertEqual(page_cache.stats()["hits"], 1)
+
+        self.client.set_cookie("localhost", "theme", "sketchy")
+        response = self.client.get(url_for("blog.index"))
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+
+        self.login()
+        response = self.client.get(url_for("blog.index"))
+        self.assertNotIn("X-Cache", response.headers)
+
+    def test_page_cache_evicted_by_edit(self):
+        current_app.config["BLOG_PAGE_CACHE"] = True
+        self.client.get(url_for("blog.show_post", post_id=1))
+        self.client.get(url_for("blog.about"))
+        self.login()
+        self.client.post(
+            url_for("admin.edit_post", post_id=1),
+            data=dict(title="Changed", categories=[1], body="Blah..."),
+        )
+        self.logout()
+        response = self.client.get(url_for("blog.show_post", post_id=1))
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertIn("Changed", response.get_data(as_text=True))
+        response = self.client.get(url_for("blog.about"))
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+
+    def test_page_cache_shared_stamp(self):
+        current_app.config["BLOG_PAGE_CACHE"] = True
+        with tempfile.TemporaryDirectory() as path:
+            current_app.extensions["blog_site_stamp"].path = os.path.join(path, "s")
+            self.client.get(url_for("blog.show_post", post_id=1))
+            self.client.get(url_for("blog.about"))
+            response = self.client.get(url_for("blog.about"))
+            self.assertEqual(response.headers["X-Cache"], "HIT")
+
+            # 另一个进程（这里是 CLI）修改了数据
+            self.runner.invoke(args=["recount"])
+            response = self.client.get(url_for("blog.about"))
+            self.assertEqual(response.headers["X-Cache"], "MISS")
+            response = self.client.get(url_for("blog.show_post", post_id=1))
+            self.assertEqual(response.headers["X-Cache"], "MISS")
+
+    def test_site_context_shared_stamp(self):
+        self.client.get(url_for("blog.about"))
+        Admin.query.first().blog_title = "Renamed"
+        db.session.commit()
+        # 另一个进程修改设置后只会更新 site_stamp
+        site_stamp.bump()
+        data = self.client.get(url_for("blog.about")).get_data(as_text=True)
+        self.assertIn("Renamed", data)
+
+    def test_negative_page(self):
+        for url in (
+            url_for("blog.show_category", category_id=1) + "?page=-3",
+            url_for("blog.show_post", post_id=1) + "?page=-3",
+        ):
+            self.assertEqual(self.read(self.client.get(url)).status_code, 200)
+        # 负数页码会变成负的 OFFSET，MySQL 不接受
+        self.assertEqual(ThreadPagination(Post.query.get(1), 2, page=-3).page, 1)
+
+    def test_keyset_pagination(self):
+        category = Category.query.first()
+        start = datetime(2020, 1, 1)
+        for i in range(25):
+            db.session.add(
+                Post(
+                    title="Post %d" % i,
+                    body="Blah...",
+                    categories=[category],
+                    private=i % 5 == 0,
+                    timestamp=start + timedelta(hours=i // 2),
+                )
+            )
+        db.session.commit()
+
+        seen = []
+        url = url_for("blog.index")
+        while url:
+            data = self.client.get(url).get_data(as_text=True)
+            titles = re.findall(r">(Post \d+)</a></h3>", data)
+            seen.extend(titles)
+            links = re.findall(r'href="([^"]+)">&raquo;', data)
+            url = links[0].replace("&amp;", "&") if links and links[0] != "#" else None
+        public = ["Post %d" % i for i in range(24, -1, -1) if i % 5]
+        # 私有文章在 SQL 里就被过滤掉了，每页都是满的
+        self.assertEqual(seen, public)
+
+        prev = re.findall(r'href="([^"]+)">&laquo;', data)[0].replace("&amp;", "&")
+        data = self.client.get(prev).get_data(as_text=True)
+        self.assertEqual(re.findall(r">(Post \d+)</a></h3>", data), public[9:19])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(url_for("blog.index", cursor="bogus"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_comment_threads(self):
+        post = Post.query.first()
+        start = datetime(2020, 1, 1)
+
+        def comment(body, replied=None, reviewed=True):
+            comment = Comment(
+                author="Reader",
+                body=body,
+                post=post,
+                replied=replied,
+                reviewed=reviewed,
+                timestamp=start + timedelta(minutes=len(post.comments)),
+            )
+            db.session.add(comment)
+            return comment
+
+        first = parent = comment("First")
+        for i in range(4):
+            parent = comment("Reply %d" % i, parent)
+        comment("Second reply", first)
+        comment("Second")
+        pending = comment("Pending", first, reviewed=False)
+        comment("Orphan", pending)
+        db.session.commit()
+        db.session.refresh(post)
+
+        with self.assertMaxQueries(1):
+            pagination = ThreadPagination(post, 2, max_depth=2)
+            threads = pagination.threads
+        self.assertEqual([t.comment.body for t in threads], ["First", "Second"])
+        replies = threads[0].replies
+        self.assertEqual([r.comment.body for r in replies], ["Reply 0", "Second reply"])
+        # 第二层以下的回复平铺，并记下回复的是哪条
+        deep = replies[0].replies[0]
+        self.assertEqual(deep.comment.body, "Reply 1")
+        self.assertEqual(
+            [(r.comment.body, r.parent.body) for r in deep.replies],
+            [("Reply 2", "Reply 1"), ("Reply 3", "Reply 2")],
+        )
+
+        # 被回复的评论还没审核时，回复单独成为一个楼层
+        cursor = pagination.next_cursor
+        pagination = ThreadPagination(post, 2, cursor)
+        self.assertEqual([t.comment.body for t in pagination.threads], ["Orphan"])
+        self.assertFalse(pagination.has_next)
+
+        data = self.client.get(url_for("blog.show_post", post_id=post.id)).get_data(
+            as_text=True
+        )
+        self.assertIn("Reply 3", data)
+        self.assertNotIn("Pending", data)
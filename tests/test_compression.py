@@ -0,0 +1,116 @@
+import gzip
+import unittest
+
+from flask import current_app, url_for, jsonify
+
+from myblog.assets import brotli
+from myblog.extensions import db, page_cache, compress
+from myblog.models import Post, Category
+from tests.base import BaseTestCase
+
+
+class CompressionTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category(name="Default")
+        db.session.add(
+            Post(
+                title="Hello",
+                body="<p>%s</p>" % ("lorem " * 200),
+                categories=[category],
+            )
+        )
+        db.session.commit()
+
+    def test_gzip(self):
+        response = self.client.get(
+            url_for("blog.index"), headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertIn("Accept-Encoding", response.vary)
+        self.assertIn(b"Hello", gzip.decompress(response.get_data()))
+
+    @unittest.skipIf(brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        response = self.client.get(
+            url_for("blog.index"), headers={"Accept-Encoding": "gzip, br"}
+        )
+        self.assertEqual(response.content_encoding, "br")
+        self.assertIn(b"Hello", brotli.decompress(response.get_data()))
+
+    def test_identity(self):
+        response = self.client.get(url_for("blog.index"))
+        self.assertIsNone(response.content_encoding)
+        self.assertIn("Accept-Encoding", response.vary)
+        self.assertIn(b"Hello", response.get_data())
+
+    def test_small_body_not_compressed(self):
+        @current_app.route("/small")
+        def small():
+            return jsonify(ok=True)
+
+        response = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.get_json(), {"ok": True})
+
+    def test_other_mimetypes_not_compressed(self):
+        response = self.client.get(
+            url_for("static", filename="css/style.css"),
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertIsNone(response.content_encoding)
+        response.close()
+
+    def test_streamed(self):
+        @current_app.route("/stream")
+        def stream():
+            def generate():
+                for i in range(100):
+                    yield "<p>%d</p>" % i
+
+            return current_app.response_class(generate(), mimetype="text/html")
+
+        response = self.client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertIn(b"<p>99</p>", gzip.decompress(response.get_data()))
+
+    def test_feed(self):
+        response = self.client.get(
+            url_for("feed.atom"), headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertIn(b"<title>Hello</title>", gzip.decompress(response.get_data()))
+
+        # 第二次从缓存里取，压缩结果也一起缓存了
+        response = self.client.get(
+            url_for("feed.atom"), headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertIn(b"<title>Hello</title>", gzip.decompress(response.get_data()))
+        response = self.client.get(
+            url_for("feed.atom"), headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertIn(b"<title>Hello</title>", gzip.decompress(response.get_data()))
+
+    def test_cached_page_compressed_once(self):
+        current_app.config["BLOG_PAGE_CACHE"] = True
+        calls = []
+        original = compress.compress
+
+        def counting(data, encoding):
+            calls.append(encoding)
+            return original(data, encoding)
+
+        compress.compress = counting
+        try:
+            for i in range(3):
+                response = self.client.get(
+                    url_for("blog.index"),
+                    headers={"Accept-Encoding": "gzip"},
+                )
+                self.assertIn(b"Hello", gzip.decompress(response.get_data()))
+        finally:
+            compress.compress = original
+        # 第一次渲染压缩一次，第一次命中压缩一次后保存在缓存项里
+        self.assertEqual(calls, ["gzip", "gzip"])
+        self.assertEqual(page_cache.stats()["hits"], 2)
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+from myblog import create_app
+from myblog.database import PRIMARY_COOKIE
+from myblog.extensions import cache, db
+from myblog.models import Admin, Comment, Post
+from myblog.settings import config, TestingConfig
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """A primary and a replica SQLite file stand in for MySQL replication."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        primary = os.path.join(self.path, "primary.db")
+        self.replica = os.path.join(self.path, "replica.db")
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + primary
+            BLOG_DB_REPLICAS = ["sqlite:///" + self.replica]
+
+        config["replica"] = ReplicaConfig
+        self.app = create_app("replica")
+        # 不在 blog 蓝本下，测试代码自己的查询走主库
+        self.context = self.app.test_request_context("/auth/login")
+        self.context.push()
+        db.create_all()
+        admin = Admin(username="grey", name="Grey")
+        admin.set_password("12345678")
+        db.session.add_all([admin, Post(title="Replicated", body="Blah...")])
+        db.session.commit()
+        self.sync()
+        db.session.add(Post(title="Not yet replicated", body="Blah..."))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.dispose()
+        self.context.pop()
+        del config["replica"]
+        shutil.rmtree(self.path)
+
+    def sync(self):
+        # 关掉连接让 WAL 写回主文件，再整个复制过去
+        db.session.remove()
+        db.dispose()
+        shutil.copy(os.path.join(self.path, "primary.db"), self.replica)
+
+    def test_pragmas(self):
+        with db.engine.connect() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").scalar(), "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").scalar(), 1)
+            self.assertEqual(conn.execute("PRAGMA cache_size").scalar(), -16000)
+
+    def test_blog_reads_from_replica(self):
+        data = self.client.get(url_for("blog.index")).get_data(as_text=True)
+        self.assertIn("Replicated", data)
+        self.assertNotIn("Not yet replicated", data)
+
+    def test_writes_and_admin_use_primary(self):
+        response = self.client.post(
+            url_for("blog.show_post", post_id=1),
+            data=dict(author="Guest", email="a@b.com", body="Hi"),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Comment.query.count(), 1)
+
+        self.client.post(
+            url_for("auth.login"), data=dict(username="grey", password="12345678")
+        )
+        data = self.client.get(url_for("admin.manage_post")).get_data(as_text=True)
+        self.assertIn("Not yet replicated", data)
+
+    def test_cache_fill_reads_primary(self):
+        with self.app.test_request_context("/"):
+            self.assertEqual(Post.query.count(), 1)
+            # 缓存的值要给之后的请求用，不能是副本上落后的数据
+            self.assertEqual(cache.get_or_set("posts", Post.query.count), 2)
+
+        self.app.config["BLOG_PAGE_CACHE"] = True
+        response = self.client.get(url_for("blog.index"))
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertIn("Not yet replicated", response.get_data(as_text=True))
+
+    def test_primary_after_write(self):
+        response = self.client.post(
+            url_for("blog.show_post", post_id=1),
+            data=dict(author="Guest", email="a@b.com", body="Hi"),
+        )
+        self.assertIn(PRIMARY_COOKIE, response.headers["Set-Cookie"])
+        # 评论者刷新页面时副本可能还没有他的评论
+        data = self.client.get(url_for("blog.index")).get_data(as_text=True)
+        self.assertIn("Not yet replicated", data)
+
+        self.client.delete_cookie("localhost", PRIMARY_COOKIE)
+        data = self.client.get(url_for("blog.index")).get_data(as_text=True)
+        self.assertNotIn("Not yet replicated", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import socketserver
+import threading
+
+from flask import current_app
+from flask_mail import Message
+
+from myblog.emails import email_queue, send_email
+from myblog.extensions import mail
+from tests.base import BaseTestCase
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib, messages are kept on the server."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 localhost")
+        lines = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if lines is not None:
+                if line == b".\r\n":
+                    server.messages.append(b"".join(lines))
+                    lines = None
+                    self.reply("250 OK")
+                else:
+                    lines.append(line)
+                continue
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 localhost")
+            elif command == b"MAIL" and server.failures:
+                server.failures -= 1
+                self.reply("451 Try again later")
+            elif command == b"DATA":
+                lines = []
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                break
+            else:
+                self.reply("250 OK")
+
+
+class EmailQueueTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.failures = 0
+        self.server.messages = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        current_app.config.update(
+            MAIL_SERVER="127.0.0.1",
+            MAIL_PORT=self.server.server_address[1],
+            MAIL_USE_SSL=False,
+            MAIL_USERNAME=None,
+            MAIL_DEFAULT_SENDER="blog@example.com",
+            MAIL_SUPPRESS_SEND=False,
+            BLOG_MAIL_WORKERS=1,
+            BLOG_MAIL_RETRY_DELAY=0,
+        )
+        mail.init_app(current_app)
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused(self):
+        for i in range(3):
+            send_email("Hello %d" % i, "reader@example.com", "<p>Hi</p>")
+        email_queue.join()
+
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+        stats = email_queue.stats()
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(stats["depth"], 0)
+
+    def test_retry(self):
+        self.server.failures = 2
+        send_email("Hello", "reader@example.com", "<p>Hi</p>")
+        email_queue.join()
+
+        self.assertEqual(len(self.server.messages), 1)
+        stats = email_queue.stats()
+        self.assertEqual(stats["retried"], 2)
+        self.assertEqual(stats["failed"], 0)
+
+    def test_give_up(self):
+        current_app.config["BLOG_MAIL_RETRIES"] = 1
+        self.server.failures = 5
+        send_email("Hello", "reader@example.com", "<p>Hi</p>")
+        email_queue.join()
+
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(email_queue.stats()["failed"], 1)
+
+    def test_shutdown_sends_queued(self):
+        for i in range(5):
+            email_queue.send(
+                Message("Hello %d" % i, recipients=["reader@example.com"], body="Hi")
+            )
+        email_queue.shutdown()
+
+        self.assertEqual(len(self.server.messages), 5)
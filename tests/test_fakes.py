@@ -0,0 +1,53 @@
+from myblog.extensions import db
+from myblog.models import Category, Comment, Post
+from tests.base import BaseTestCase
+
+
+class ForgeTestCase(BaseTestCase):
+    def forge(self, *args):
+        result = self.runner.invoke(
+            args=["forge", "--category", "5", "--post", "20", "--comment", "50"]
+            + list(args)
+        )
+        self.assertIn("Done.", result.output, result.output)
+        return (
+            [p.title for p in Post.query.order_by(Post.id)],
+            [
+                (c.author, c.post_id, c.replied_id)
+                for c in Comment.query.order_by(Comment.id)
+            ],
+        )
+
+    def test_forge(self):
+        self.forge("--chunk", "7")
+        self.assertEqual(Post.query.count(), 20)
+        # 50 条审核通过的评论，加上各 10% 的待审核、管理员评论和回复
+        self.assertEqual(Comment.query.count(), 65)
+        self.assertEqual(Comment.query.filter_by(reviewed=False).count(), 5)
+
+        for post in Post.query:
+            self.assertEqual(post.comment_count, len(post.comments))
+            self.assertTrue(post.excerpt)
+            self.assertTrue(post.categories)
+        for category in Category.query:
+            self.assertEqual(category.post_count, len(category.posts))
+        for reply in Comment.query.filter(Comment.replied_id.isnot(None)):
+            self.assertEqual(reply.post_id, reply.replied.post_id)
+
+    def test_seed(self):
+        first = self.forge("--seed", "42")
+        db.session.remove()
+        self.assertEqual(self.forge("--seed", "42", "--workers", "2"), first)
+        db.session.remove()
+        self.assertNotEqual(self.forge("--seed", "43"), first)
+
+    def test_empty_tables(self):
+        for posts in ("0", "3"):
+            result = self.runner.invoke(
+                args=["forge", "--category", "0", "--post", posts, "--comment", "10"]
+            )
+            self.assertIn("Done.", result.output, result.output)
+            db.session.remove()
+        self.assertEqual(Post.query.count(), 3)
+        # 10 条审核通过的评论，加上各 1 条待审核、管理员评论和回复
+        self.assertEqual(Comment.query.count(), 13)
@@ -0,0 +1,93 @@
+from flask import url_for, current_app
+
+from myblog.models import Post, Category
+from myblog.extensions import db, cache, site_stamp
+
+from tests.base import BaseTestCase
+
+
+class FeedTestCase(BaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        category = Category(name="Default")
+        db.session.add_all(
+            [
+                category,
+                Post(title="Public post", body="<p>Hello</p>", categories=[category]),
+                Post(title="Private post", body="<p>Secret</p>", private=True),
+            ]
+        )
+        db.session.commit()
+
+    def test_atom_feed(self):
+        response = self.client.get(url_for("feed.atom"))
+        # 没有缓存时边渲染边发送
+        self.assertNotIn("Content-Length", response.headers)
+        data = response.get_data(as_text=True)
+        self.assertEqual(response.mimetype, "application/atom+xml")
+        self.assertIn("<title>Public post</title>", data)
+        self.assertIn('<category term="Default"/>', data)
+        self.assertNotIn("Private post", data)
+
+    def test_if_modified_since(self):
+        response = self.client.get(url_for("feed.atom"))
+        last_modified = response.headers["Last-Modified"]
+        response = self.client.get(
+            url_for("feed.atom"), headers={"If-Modified-Since": last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditional_miss_fills_cache(self):
+        last_modified = self.client.get(url_for("feed.atom")).headers["Last-Modified"]
+        cache.bump("site")
+        # 缓存失效后的第一个请求就是条件请求，回复 304 也要把文档存进缓存
+        self.client.get(
+            url_for("feed.atom"), headers={"If-Modified-Since": last_modified}
+        )
+        with self.assertMaxQueries(0):
+            data = self.client.get(url_for("feed.atom")).get_data(as_text=True)
+        self.assertIn("Public post", data)
+
+    def test_feed_invalidated_by_other_process(self):
+        self.client.get(url_for("feed.atom"))
+        db.session.add(Post(title="Forged post", body="<p>Hi</p>"))
+        db.session.commit()
+        # 另一个进程写入时只会更新共享的版本
+        site_stamp.bump()
+        data = self.client.get(url_for("feed.atom")).get_data(as_text=True)
+        self.assertIn("Forged post", data)
+
+    def test_feed_invalidated_by_new_post(self):
+        self.client.get(url_for("feed.atom"))
+        self.login()
+        self.client.post(
+            url_for("admin.new_post"),
+            data=dict(title="Fresh post", categories=[1], body="Hello, world."),
+        )
+        data = self.client.get(url_for("feed.atom")).get_data(as_text=True)
+        self.assertIn("Fresh post", data)
+
+    def test_sitemap(self):
+        data = self.client.get(url_for("feed.sitemap")).get_data(as_text=True)
+        self.assertIn("<urlset", data)
+        self.assertIn(url_for("blog.show_post", post_id=1, _external=True), data)
+        self.assertNotIn(url_for("blog.show_post", post_id=2, _external=True), data)
+        self.assertIn(
+            url_for("blog.show_category", category_id=1, _external=True), data
+        )
+
+    def test_sitemap_index(self):
+        current_app.config["BLOG_SITEMAP_MAX_URLS"] = 2
+        for i in range(4):
+            db.session.add(Post(title="Post %d" % i, body="Blah..."))
+        db.session.commit()
+        data = self.client.get(url_for("feed.sitemap")).get_data(as_text=True)
+        self.assertIn("<sitemapindex", data)
+        self.assertIn(url_for("feed.sitemap_posts", n=2, _external=True), data)
+
+        data = self.client.get(url_for("feed.sitemap_posts", n=1)).get_data(
+            as_text=True
+        )
+        self.assertEqual(data.count("<loc>"), 2)
+        response = self.client.get(url_for("feed.sitemap_posts", n=3))
+        self.assertEqual(response.status_code, 404)
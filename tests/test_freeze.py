@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+
+from flask import current_app
+
+from myblog import create_app
+from myblog.extensions import db
+from myblog.freeze import freeze_site, load_manifest
+from myblog.models import Category, Comment, Post
+from myblog.settings import config, TestingConfig
+from tests.base import BaseTestCase
+
+
+class FreezeTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        current_app.config["BLOG_POST_PER_PAGE"] = 2
+        current_app.config["BLOG_COMMENT_PER_PAGE"] = 2
+        self.app = current_app._get_current_object()
+        self.output = tempfile.mkdtemp()
+        category = Category(name="Default")
+        now = datetime(2020, 1, 1)
+        posts = [
+            Post(
+                title="Post %d" % i,
+                body="<p>Body %d</p>" % i,
+                categories=[category],
+                timestamp=now + timedelta(days=i),
+            )
+            for i in range(1, 4)
+        ]
+        posts.append(Post(title="Secret", body="<p>Secret</p>", private=True))
+        db.session.add_all(posts)
+        db.session.add_all(
+            Comment(
+                author="Reader",
+                body="Comment %d" % i,
+                post=posts[0],
+                reviewed=True,
+                timestamp=now + timedelta(hours=i),
+            )
+            for i in range(3)
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        super().tearDown()
+
+    def read(self, *parts):
+        with open(os.path.join(self.output, *parts, "index.html")) as f:
+            return f.read()
+
+    def test_freeze(self):
+        rendered, unchanged, removed, failed = freeze_site(self.app, self.output)
+        self.assertEqual(failed, [])
+        # 首页两页、分类两页、三篇文章（第一篇的评论有两页）和 about
+        self.assertEqual(rendered, 9)
+
+        index = self.read()
+        self.assertIn("Post 3", index)
+        self.assertNotIn("Secret", index)
+        self.assertIn('href="/page/2"', index)
+        self.assertIn("Post 1", self.read("page", "2"))
+        self.assertIn('href="/category/1/page/2"', self.read("category", "1"))
+        self.assertIn("Comment 2", self.read("post", "1", "page", "2"))
+        # 评论表单由应用渲染
+        self.assertNotIn("csrf_token", self.read("post", "1"))
+        self.assertFalse(os.path.exists(os.path.join(self.output, "post", "4")))
+        self.assertTrue(os.path.exists(os.path.join(self.output, "index.html.gz")))
+
+    def test_incremental(self):
+        freeze_site(self.app, self.output)
+        manifest = load_manifest(self.output)
+        self.assertEqual(freeze_site(self.app, self.output)[:2], (0, 9))
+
+        # 新评论只影响这篇文章和列出它的页面
+        db.session.add(Comment(author="Reader", body="New", post_id=2, reviewed=True))
+        db.session.commit()
+        rendered, unchanged, removed, failed = freeze_site(self.app, self.output)
+        self.assertEqual((rendered, removed), (3, []))
+        changed = {
+            url
+            for url, fingerprint in load_manifest(self.output).items()
+            if manifest[url] != fingerprint
+        }
+        self.assertEqual(changed, {"/post/2", "/", "/category/1"})
+        self.assertIn("New", self.read("post", "2"))
+
+        # 删除评论后多出来的评论页被删掉
+        Comment.query.filter_by(post_id=1).first().reviewed = False
+        db.session.commit()
+        removed = freeze_site(self.app, self.output)[2]
+        self.assertEqual(removed, ["/post/1/page/2"])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.output, "post", "1", "page", "2"))
+            and os.listdir(os.path.join(self.output, "post", "1", "page", "2"))
+        )
+
+    def test_command(self):
+        result = self.runner.invoke(args=["freeze", "--output", self.output])
+        self.assertIn("Done, 9 rendered", result.output, result.output)
+        result = self.runner.invoke(args=["freeze", "--output", self.output, "--full"])
+        self.assertIn("Done, 9 rendered", result.output, result.output)
+
+    def test_workers_under_spawn(self):
+        # 子进程要连同一个数据库，内存数据库不行
+        database = os.path.join(self.output, "data.db")
+
+        class FileConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + database
+
+        config["freeze-file"] = FileConfig
+        app = create_app("freeze-file")
+        output = os.path.join(self.output, "site")
+        method = multiprocessing.get_start_method(allow_none=True)
+        # macOS 和 Windows 上默认的启动方式
+        multiprocessing.set_start_method("spawn", force=True)
+        # session 按线程共用，先丢掉绑定在测试应用上的那个
+        db.session.remove()
+        try:
+            with app.app_context():
+                db.create_all()
+                db.session.add(Post(title="Forked", body="<p>Hi</p>"))
+                db.session.commit()
+                rendered, unchanged, removed, failed = freeze_site(
+                    app, output, workers=2
+                )
+                db.session.remove()
+                db.drop_all()
+        finally:
+            multiprocessing.set_start_method(method, force=True)
+            del config["freeze-file"]
+        self.assertEqual(failed, [])
+        self.assertIn("Forked", self.read("site"))
+
+    def test_workers_need_fork(self):
+        with mock.patch.object(
+            multiprocessing, "get_all_start_methods", return_value=["spawn"]
+        ):
+            result = self.runner.invoke(
+                args=["freeze", "--output", self.output, "--workers", "2"]
+            )
+        self.assertIn("needs os.fork()", result.output)
+        self.assertEqual(freeze_site(self.app, self.output)[3], [])
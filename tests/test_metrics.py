@@ -0,0 +1,49 @@
+from flask import current_app, url_for
+
+from myblog.settings import ProductionConfig
+from tests.base import BaseTestCase
+
+
+class MetricsTestCase(BaseTestCase):
+    def test_metrics(self):
+        # 首页是流式渲染的，读完响应才渲染完
+        self.client.get(url_for("blog.index")).get_data()
+        response = self.client.get(url_for("metrics"))
+        data = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'blog_request_duration_seconds_count{endpoint="blog.index",method="GET"} 1.0',
+            data,
+        )
+        self.assertIn(
+            'blog_responses_total{endpoint="blog.index",status="200"} 1.0', data
+        )
+        self.assertIn(
+            'blog_sql_query_duration_seconds_count{endpoint="blog.index"}', data
+        )
+        self.assertIn(
+            'blog_template_render_seconds_count{template="blog/index.html"}', data
+        )
+        self.assertIn("blog_email_queue_depth 0.0", data)
+
+    def test_access(self):
+        current_app.config["BLOG_METRICS_ALLOWED_IPS"] = ["10.0.0.0/8"]
+        response = self.client.get(url_for("metrics"))
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get(
+            url_for("metrics"), environ_base={"REMOTE_ADDR": "10.1.2.3"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.login()
+        response = self.client.get(url_for("metrics"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_closed_by_default(self):
+        # 在 nginx 后面时所有请求都来自 127.0.0.1
+        allowed = ProductionConfig.BLOG_METRICS_ALLOWED_IPS
+        current_app.config["BLOG_METRICS_ALLOWED_IPS"] = allowed
+        response = self.client.get(url_for("metrics"))
+        self.assertEqual(response.status_code, 403)
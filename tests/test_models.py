@@ -0,0 +1,72 @@
+from myblog.models import Post, Category, Comment
+from myblog.extensions import db
+
+from tests.base import BaseTestCase
+
+
+class CounterTestCase(BaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.default = Category(name="Default")
+        self.python = Category(name="Python")
+        self.post = Post(title="Hello", categories=[self.python], body="Blah...")
+        db.session.add_all([self.default, self.python, self.post])
+        db.session.commit()
+
+    def test_comment_counters(self):
+        comment = Comment(body="A comment", post=self.post)
+        db.session.add_all([comment, Comment(body="B", post=self.post, reviewed=True)])
+        db.session.commit()
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(self.post.reviewed_comment_count, 1)
+
+        comment.reviewed = True
+        db.session.commit()
+        self.assertEqual(self.post.reviewed_comment_count, 2)
+
+        db.session.delete(comment)
+        db.session.commit()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.post.reviewed_comment_count, 1)
+
+    def test_category_counters(self):
+        self.assertEqual(self.python.post_count, 1)
+        self.post.categories = [self.default]
+        db.session.commit()
+        self.assertEqual(self.python.post_count, 0)
+        self.assertEqual(self.default.post_count, 1)
+
+        db.session.delete(self.post)
+        db.session.commit()
+        self.assertEqual(self.default.post_count, 0)
+
+    def test_delete_category_moves_posts(self):
+        self.python.delete()
+        self.assertEqual(self.post.categories, [self.default])
+        self.assertEqual(self.default.post_count, 1)
+
+    def test_recount_command(self):
+        post_id = self.post.id
+        db.session.execute(Post.__table__.update().values(comment_count=42))
+        db.session.commit()
+        result = self.runner.invoke(args=["recount"])
+        self.assertIn("Done.", result.output)
+        self.assertEqual(Post.query.get(post_id).comment_count, 0)
+
+
+class ExcerptTestCase(BaseTestCase):
+    def test_excerpt_follows_body(self):
+        post = Post(title="Hello", body="<p>Hello <b>world</b></p>")
+        self.assertEqual(post.excerpt, "Hello world")
+        post.body = "<p>%s</p>" % ("word " * 100)
+        self.assertTrue(post.excerpt.endswith("..."))
+        self.assertLessEqual(len(post.excerpt), 255)
+
+    def test_excerpt_command(self):
+        db.session.add(Post(title="Hello", body="<p>Blah...</p>"))
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(excerpt=None))
+        db.session.commit()
+        result = self.runner.invoke(args=["excerpt"])
+        self.assertIn("Generated 1 excerpts.", result.output)
+        self.assertEqual(Post.query.first().excerpt, "Blah...")
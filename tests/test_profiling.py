@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import time
+
+from flask import current_app, url_for
+
+from myblog.extensions import query_stats
+from tests.base import BaseTestCase
+
+
+class QueryStatsTestCase(BaseTestCase):
+    def test_endpoint_stats(self):
+        self.client.get(url_for("blog.index"))
+        self.client.get(url_for("blog.index"))
+        rows = {row["endpoint"]: row for row in query_stats.report()}
+
+        self.assertEqual(rows["blog.index"]["requests"], 2)
+        self.assertGreater(rows["blog.index"]["queries"], 0)
+        self.assertEqual(rows["blog.index"]["slow"], 0)
+
+    def test_slow_query_logged(self):
+        current_app.config["BLOG_SLOW_QUERY_THRESHOLD"] = 0
+        with self.assertLogs(current_app.logger, "WARNING") as logs:
+            self.client.get(url_for("blog.index"))
+        self.assertIn("Endpoint: blog.index", logs.output[0])
+        row = query_stats.report()[0]
+        self.assertEqual(row["slow"], row["queries"])
+
+    def test_report_merges_processes(self):
+        with tempfile.TemporaryDirectory() as path:
+            state = current_app.extensions["blog_query_stats"]
+            state.path = path
+            with open(os.path.join(path, "1.json"), "w") as f:
+                json.dump(
+                    {
+                        "blog.index": dict(
+                            requests=3, queries=9, db_time=0.3, max_queries=4, slow=1
+                        )
+                    },
+                    f,
+                )
+            self.client.get(url_for("blog.index"))
+            row = {r["endpoint"]: r for r in query_stats.report()}["blog.index"]
+            self.assertEqual(row["requests"], 4)
+            self.assertEqual(row["slow"], 1)
+
+            result = self.runner.invoke(args=["queries", "--reset"])
+            self.assertIn("blog.index", result.output)
+            self.assertEqual(os.listdir(path), [])
+
+    def test_report_page(self):
+        self.login()
+        self.client.get(url_for("blog.index"))
+        response = self.client.get(url_for("admin.query_report"))
+        data = response.get_data(as_text=True)
+        self.assertIn("blog.index", data)
+
+    def test_stale_files_pruned(self):
+        with tempfile.TemporaryDirectory() as path:
+            state = current_app.extensions["blog_query_stats"]
+            state.path = path
+            stale = os.path.join(path, "1.json")
+            with open(stale, "w") as f:
+                json.dump(
+                    {
+                        "blog.index": dict(
+                            requests=3, queries=9, db_time=0.3, max_queries=4, slow=1
+                        )
+                    },
+                    f,
+                )
+            # 一个早已退出的进程留下的文件
+            old = time.time() - current_app.config["BLOG_QUERY_STATS_MAX_AGE"] - 1
+            os.utime(stale, (old, old))
+            self.client.get(url_for("blog.index"))
+            row = {r["endpoint"]: r for r in query_stats.report()}["blog.index"]
+            self.assertEqual(row["requests"], 1)
+
+            state.flush()
+            self.assertEqual(os.listdir(path), ["%d.json" % os.getpid()])
@@ -0,0 +1,32 @@
+from flask import url_for
+
+from myblog.models import Post, Category, Comment
+from myblog.extensions import db
+
+from tests.base import BaseTestCase
+
+
+class QueryBudgetTestCase(BaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        categories = [Category(name="Category %d" % i) for i in range(3)]
+        for i in range(12):
+            post = Post(title="Post %d" % i, body="Blah...", categories=categories)
+            comment = Comment(body="A comment", post=post, reviewed=True)
+            reply = Comment(body="A reply", post=post, reviewed=True, replied=comment)
+            db.session.add_all([post, comment, reply])
+        db.session.commit()
+
+    def test_blog_pages(self):
+        self.assertQueryBudget(url_for("blog.index"), 2)
+        self.assertQueryBudget(url_for("blog.show_category", category_id=1), 3)
+        self.assertQueryBudget(url_for("blog.show_post", post_id=1), 2)
+        self.assertQueryBudget(url_for("blog.about"), 0)
+
+    def test_admin_pages(self):
+        self.login()
+        # 当前用户是缓存的，不用每个请求都查询
+        self.assertQueryBudget(url_for("blog.about"), 0)
+        self.assertQueryBudget(url_for("blog.index"), 2)
+        self.assertQueryBudget(url_for("admin.manage_post"), 2)
+        self.assertQueryBudget(url_for("admin.manage_comment"), 1)
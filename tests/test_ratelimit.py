@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from flask import current_app, url_for
+
+from myblog import create_app
+from myblog.extensions import db, ratelimiter
+from myblog.models import Post
+from myblog.settings import TestingConfig
+from tests.base import BaseTestCase
+
+
+class RateLimitTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        current_app.config["BLOG_RATELIMITS"] = {
+            "blog.show_post": (2, 60),
+            "auth.login": (2, 60),
+        }
+        db.session.add(Post(title="Hello", body="Blah..."))
+        db.session.commit()
+
+    def comment(self, address="10.0.0.1"):
+        return self.client.post(
+            url_for("blog.show_post", post_id=1),
+            data=dict(author="Guest", email="a@b.com", body="Hi"),
+            environ_base={"REMOTE_ADDR": address},
+        )
+
+    def test_comments_limited(self):
+        self.assertEqual(self.comment().status_code, 302)
+        self.assertEqual(self.comment().status_code, 302)
+        response = self.comment()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "30")
+        # 被拒绝的请求没有写入数据库
+        self.assertEqual(len(Post.query.get(1).comments), 2)
+        # 其他 IP 不受影响
+        self.assertEqual(self.comment("10.0.0.2").status_code, 302)
+
+    def test_warns_without_proxy_fix(self):
+        with self.assertLogs(current_app.logger, "WARNING") as logs:
+            self.comment("127.0.0.1")
+        self.assertIn("BLOG_PROXY_FIX", logs.output[0])
+
+    def test_login_limited(self):
+        for i in range(2):
+            self.login("grey", "wrong")
+        response = self.client.post(
+            url_for("auth.login"), data=dict(username="grey", password="12345678")
+        )
+        self.assertEqual(response.status_code, 429)
+        # GET 不限流
+        self.assertEqual(self.client.get(url_for("auth.login")).status_code, 200)
+
+    def test_logged_in_not_limited(self):
+        self.login()
+        for i in range(3):
+            self.assertEqual(self.comment().status_code, 302)
+
+    def test_refill(self):
+        self.assertEqual(ratelimiter.hit("key", 2, 60, now=0), 0)
+        self.assertEqual(ratelimiter.hit("key", 2, 60, now=0), 0)
+        self.assertEqual(ratelimiter.hit("key", 2, 60, now=15), 15)
+        self.assertEqual(ratelimiter.hit("key", 2, 60, now=30), 0)
+        self.assertEqual(ratelimiter.hit("key", 2, 60, now=30), 30)
+
+    def test_shared_store(self):
+        path = tempfile.mkdtemp()
+        try:
+            apps = []
+            for i in range(2):
+                app = create_app("testing")
+                app.config["BLOG_RATELIMIT_PATH"] = os.path.join(path, "limit.db")
+                # 配置改了之后重新初始化，模拟两个 worker 进程
+                ratelimiter.init_app(app)
+                apps.append(app)
+            for app, expected in zip(apps + apps, [0, 0, 30, 30]):
+                with app.app_context():
+                    self.assertEqual(ratelimiter.hit("key", 2, 60, now=0), expected)
+        finally:
+            shutil.rmtree(path)
+
+    def test_behind_proxy(self):
+        def login(app, address):
+            with app.test_request_context():
+                return app.test_client().post(
+                    url_for("auth.login"),
+                    data=dict(username="grey", password="wrong"),
+                    environ_base={"REMOTE_ADDR": "127.0.0.1"},
+                    headers={"X-Forwarded-For": address},
+                )
+
+        with mock.patch.object(TestingConfig, "BLOG_PROXY_FIX", dict(x_for=1)):
+            app = create_app("testing")
+        app.config["BLOG_RATELIMITS"] = {"auth.login": (2, 60)}
+        # session 按线程共用，先丢掉绑定在测试应用上的那个
+        db.session.remove()
+        with app.app_context():
+            db.create_all()
+            try:
+                self.assertEqual(login(app, "1.1.1.1").status_code, 200)
+                self.assertEqual(login(app, "1.1.1.1").status_code, 200)
+                self.assertEqual(login(app, "1.1.1.1").status_code, 429)
+                # 同一个代理后面的其他访客不受影响
+                self.assertEqual(login(app, "2.2.2.2").status_code, 200)
+            finally:
+                db.session.remove()
+                db.drop_all()
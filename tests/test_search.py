@@ -0,0 +1,80 @@
+from unittest import mock
+
+from flask import url_for
+
+from myblog.models import Post, Comment
+from myblog.extensions import db
+
+from tests.base import BaseTestCase
+
+
+class SearchTestCase(BaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.post = Post(
+            title="Flask tutorial", body="<p>Learning <b>SQLAlchemy</b></p>"
+        )
+        self.secret = Post(title="Diary", body="<p>A secret plan</p>", private=True)
+        db.session.add_all([self.post, self.secret])
+        db.session.commit()
+
+    def search(self, q):
+        response = self.client.get(url_for("blog.search", q=q))
+        return response.get_data(as_text=True)
+
+    def test_search_posts(self):
+        data = self.search("sqlalchemy")
+        self.assertIn("Flask tutorial", data)
+        self.assertIn("<mark>SQLAlchemy</mark>", data)
+
+    def test_private_posts_hidden(self):
+        self.assertIn("No results.", self.search("secret"))
+        self.login()
+        self.assertIn("Diary", self.search("secret"))
+
+    def test_index_follows_writes(self):
+        comment = Comment(author="Mima", body="Great tutorial", post=self.post)
+        db.session.add(comment)
+        db.session.commit()
+        self.assertIn("No results.", self.search("great"))
+
+        comment.reviewed = True
+        db.session.commit()
+        self.assertIn("Mima", self.search("great"))
+
+        self.post.private = True
+        db.session.commit()
+        self.assertIn("No results.", self.search("great"))
+
+        db.session.delete(self.post)
+        db.session.commit()
+        self.login()
+        self.assertIn("No results.", self.search("great"))
+
+    def test_short_and_unicode_terms(self):
+        db.session.add(Post(title="你好", body="<p>你好世界，欢迎来到博客</p>"))
+        db.session.commit()
+        self.assertIn("你好", self.search("世界"))
+        self.assertIn("你好", self.search("欢迎来到"))
+
+    def test_reindex_command(self):
+        result = self.runner.invoke(args=["reindex"])
+        self.assertIn("Indexed 2 documents.", result.output)
+        self.assertIn("Flask tutorial", self.search("learning"))
+
+    def test_tokenizer_fallback(self):
+        # trigram 分词器出现之前的 SQLite
+        with mock.patch.object(
+            db.engine.dialect.dbapi, "sqlite_version_info", (3, 31, 1)
+        ):
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+            sql = db.session.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'search_index'"
+            ).scalar()
+            self.assertIn("unicode61", sql)
+            db.session.add(Post(title="你好", body="<p>你好世界，Flask 博客</p>"))
+            db.session.commit()
+            self.assertIn("你好", self.search("世界"))
+            self.assertIn("你好", self.search("flask"))
@@ -0,0 +1,24 @@
+from flask import current_app
+
+from myblog.profiling import profile_startup
+from tests.base import BaseTestCase
+
+
+class StartupTestCase(BaseTestCase):
+    def test_cold_start(self):
+        seconds, packages = profile_startup("testing")
+        imported = {name for name, _ in packages}
+        for name in ("flask_moment", "flask_migrate", "alembic", "faker"):
+            self.assertNotIn(name, imported)
+        # 只防止明显的退化，慢机器上也要留足余量
+        self.assertLess(seconds, 3)
+
+    def test_deferred_extensions(self):
+        self.assertEqual(current_app.extensions["migrate"].directory, "migrations")
+        self.assertIn(
+            "flask_moment_render_all", self.client.get("/").get_data(as_text=True)
+        )
+
+    def test_command(self):
+        result = self.runner.invoke(args=["startup", "--config", "testing"])
+        self.assertIn("create_app('testing') took", result.output, result.output)
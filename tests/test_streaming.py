@@ -0,0 +1,98 @@
+import gzip
+
+from flask import current_app, url_for
+
+from myblog.extensions import db, query_stats
+from myblog.models import Post, Category, Comment
+from tests.base import BaseTestCase
+
+
+class StreamingTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category(name="Default")
+        post = Post(title="Hello", body="<p>Post body</p>", categories=[category])
+        comment = Comment(author="Reader", body="Nice post", post=post, reviewed=True)
+        db.session.add_all([category, post, comment])
+        db.session.commit()
+
+    def test_post_streamed(self):
+        response = self.client.get(url_for("blog.show_post", post_id=1))
+        self.assertNotIn("Content-Length", response.headers)
+        chunks = [chunk.decode() for chunk in response.response]
+        # 文章在评论之前单独发出
+        body = next(i for i, c in enumerate(chunks) if "Post body" in c)
+        comments = next(i for i, c in enumerate(chunks) if "Nice post" in c)
+        self.assertLess(body, comments)
+        self.assertNotIn("<!-- flush -->", "".join(chunks))
+
+    def test_comments_queried_after_flush(self):
+        with self.assertMaxQueries(100) as statements:
+            response = self.client.get(url_for("blog.show_post", post_id=1))
+            sent = []
+            for chunk in response.response:
+                sent.append(chunk.decode())
+                if "Post body" in chunk.decode():
+                    # 发出文章时还没有查询评论
+                    queried = [s for s in statements if "RECURSIVE" in s]
+        self.assertEqual(queried, [])
+        self.assertIn("Nice post", "".join(sent))
+        self.assertTrue([s for s in statements if "RECURSIVE" in s])
+
+    def test_bad_cursor(self):
+        # 游标在发出响应头之前检查，不会发出半个页面
+        response = self.client.get(url_for("blog.show_post", post_id=1, cursor="x"))
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("Post body", response.get_data(as_text=True))
+
+    def test_stats_after_stream(self):
+        response = self.client.get(url_for("blog.show_post", post_id=1))
+        endpoints = {row["endpoint"] for row in query_stats.report()}
+        self.assertNotIn("blog.show_post", endpoints)
+        response.get_data()
+        row = {r["endpoint"]: r for r in query_stats.report()}["blog.show_post"]
+        self.assertEqual(row["requests"], 1)
+        data = self.client.get(url_for("metrics")).get_data(as_text=True)
+        self.assertIn(
+            'blog_responses_total{endpoint="blog.show_post",status="200"} 1.0', data
+        )
+
+    def test_not_streamed(self):
+        current_app.config["BLOG_STREAM_ENDPOINTS"] = []
+        response = self.client.get(url_for("blog.show_post", post_id=1))
+        self.assertIn("Content-Length", response.headers)
+        self.assertIn("Nice post", response.get_data(as_text=True))
+
+    def test_page_cache_not_streamed(self):
+        current_app.config["BLOG_PAGE_CACHE"] = True
+        response = self.client.get(url_for("blog.index"))
+        self.assertIn("Content-Length", response.headers)
+        response = self.client.get(url_for("blog.index"))
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+
+    def test_compressed(self):
+        response = self.client.get(
+            url_for("blog.show_post", post_id=1), headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertIn(b"Nice post", gzip.decompress(response.get_data()))
+
+    def test_flash_shown_once(self):
+        data = self.client.post(
+            url_for("blog.show_post", post_id=1),
+            data=dict(author="Guest", email="a@b.com", body="Hi"),
+            follow_redirects=True,
+        ).get_data(as_text=True)
+        self.assertIn("your comment will be published", data)
+        data = self.client.get(url_for("blog.show_post", post_id=1)).get_data(
+            as_text=True
+        )
+        self.assertNotIn("your comment will be published", data)
+
+    def test_admin_pages(self):
+        self.login()
+        for endpoint in ("manage_post", "manage_comment"):
+            response = self.client.get(url_for("admin." + endpoint))
+            self.assertNotIn("Content-Length", response.headers)
+            # 令牌在发送响应头之前就生成好了
+            self.assertIn("csrf_token", response.get_data(as_text=True))
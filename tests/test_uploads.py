@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import current_app, url_for
+
+from myblog.uploads import Image
+from tests.base import BaseTestCase
+
+
+def png_bytes(width=1200, height=600):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class UploadTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+        current_app.config["BLOG_UPLOAD_PATH"] = self.path
+        current_app.config["BLOG_IMAGE_SIZES"] = [480]
+        self.login()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super().tearDown()
+
+    def upload(self, data, filename="image.png"):
+        return self.client.post(
+            url_for("admin.upload_image"),
+            data=dict(upload=(io.BytesIO(data), filename)),
+        )
+
+    def test_upload_deduplicated(self):
+        data = png_bytes()
+        first = self.upload(data).get_json()
+        second = self.upload(data, "copy.png").get_json()
+
+        self.assertEqual(first["uploaded"], 1)
+        self.assertEqual(first["url"], second["url"])
+        self.assertTrue(first["filename"].endswith(".png"))
+        stored = os.path.join(self.path, first["filename"])
+        with open(stored, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_reject_non_image(self):
+        response = self.upload(b"<script>alert(1)</script>", "evil.png")
+        self.assertEqual(response.get_json()["uploaded"], 0)
+        response = self.upload(png_bytes(), "image.svg")
+        self.assertEqual(response.get_json()["uploaded"], 0)
+
+    def test_serve(self):
+        data = self.upload(png_bytes()).get_json()
+        url, filename = data["url"], data["filename"]
+        self.logout()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "image/png")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertIn("Accept", response.headers["Vary"])
+
+        response = self.client.get(url, headers={"Range": "bytes=0-7"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b"\x89PNG\r\n\x1a\n")
+
+        self.assertEqual(self.client.get(url + "/../x").status_code, 404)
+        for filename in ("noext", "ab/noext", filename[:-3] + "webp"):
+            response = self.client.get(url_for("admin.get_image", filename=filename))
+            self.assertEqual(response.status_code, 404)
+
+    def test_variants(self):
+        current_app.config["BLOG_IMAGE_SIZES"] = [480, 2000]
+        filename = self.upload(png_bytes()).get_json()["filename"]
+        self.assertTrue(os.path.exists(os.path.join(self.path, filename[:-3] + "webp")))
+        url = url_for("admin.get_image", filename=filename)
+
+        response = self.client.get(url, headers={"Accept": "image/webp,*/*"})
+        self.assertEqual(response.mimetype, "image/webp")
+        response = self.client.get(url + "?w=480")
+        self.assertEqual(response.mimetype, "image/png")
+        with Image.open(io.BytesIO(response.data)) as image:
+            self.assertEqual(image.size, (480, 240))
+        # 原图不够宽时不生成更大的副本
+        response = self.client.get(url + "?w=2000")
+        with Image.open(io.BytesIO(response.data)) as image:
+            self.assertEqual(image.width, 1200)
+
+    def test_accel_redirect(self):
+        current_app.config["BLOG_UPLOAD_ACCEL_REDIRECT"] = "/protected/"
+        filename = self.upload(png_bytes()).get_json()["filename"]
+        response = self.client.get(url_for("admin.get_image", filename=filename))
+        self.assertEqual(response.headers["X-Accel-Redirect"], "/protected/" + filename)
+        self.assertEqual(response.data, b"")